@@ -1,22 +1,122 @@
 import atexit
+import hashlib
+import json
+import logging
+import os
+import socket
 import sqlite3
 import threading
+import time
+from contextlib import suppress
 from datetime import datetime, timezone
 from urllib.parse import urlsplit
 
-from settings import DATABASE
+import analytics_log
+import hyperloglog
+import metrics
+from settings import (
+    ANALYTICS_COLLECTOR_ENABLED,
+    ANALYTICS_DAILY_RETENTION_DAYS,
+    ANALYTICS_HANDOFF_SECONDS,
+    ANALYTICS_HOURLY_RETENTION_DAYS,
+    ANALYTICS_MAX_BUFFER_KEYS,
+    ANALYTICS_SOCKET_PATH,
+    DATABASE,
+    SECRET_KEY,
+    STORAGE_ROOT,
+)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
 
 BUFFER_LOCK = threading.Lock()
 PAGE_VISIT_BUFFER = {}
 VIDEO_VIEW_BUFFER = {}
 VIDEO_WATCH_BUFFER = {}
+# Hashed viewer keys seen since the last flush, folded into each row's
+# HyperLogLog sketch at flush time.
+PAGE_VIEWER_BUFFER = {}
+VIDEO_VIEWER_BUFFER = {}
+_VIEWER_HASH_KEY = hashlib.blake2b(f"viewer:{SECRET_KEY}".encode("utf-8"), digest_size=32).digest()
 
 FLUSH_INTERVAL_SECONDS = 10
 FLUSH_EVENT_THRESHOLD = 100
+# Threshold-triggered flushes are spaced at least this far apart so a flood
+# of distinct keys cannot keep the writer in a flush loop.
+FLUSH_MIN_INTERVAL_SECONDS = 1
 WATCH_BUCKET_SECONDS = 10
+MAX_PATH_LENGTH = 512
+
+# Events refused because their buffer already held ANALYTICS_MAX_BUFFER_KEYS
+# distinct keys (or the path was oversized). Guarded by BUFFER_LOCK.
+DROPPED_EVENTS = {"page_visits": 0, "video_views": 0, "video_watch_buckets": 0}
+_OVERFLOW_LOGGED = False
+
+# Known video ids, so beacons for made-up ids are refused without a query.
+# Reloaded every VIDEO_ID_CACHE_TTL_SECONDS, and on a miss at most once per
+# VIDEO_ID_MISS_RELOAD_SECONDS so new uploads are picked up quickly without
+# letting random ids turn into a query per event.
+VIDEO_ID_CACHE_TTL_SECONDS = 60
+VIDEO_ID_MISS_RELOAD_SECONDS = 5
+_KNOWN_VIDEO_IDS = frozenset()
+_KNOWN_VIDEO_IDS_LOADED_AT = None
+_VIDEO_ID_CACHE_LOCK = threading.Lock()
 
 _FLUSH_THREAD = None
 _STOP_EVENT = threading.Event()
+_FLUSH_REQUESTED = threading.Event()
+_FLUSH_LOCK = threading.Lock()
+
+# One worker per host holds the collector lock, binds ANALYTICS_SOCKET_PATH and
+# is the only process writing analytics to SQLite. Every other worker ships its
+# buffered deltas to that socket as datagrams instead of flushing itself.
+COLLECTOR_LOCK_PATH = os.path.join(STORAGE_ROOT, ".analytics_collector.lock")
+HANDOFF_CHUNK_KEYS = 500
+# Stored sketches fetched per query when merging a flush (SQLite's default
+# limit on bound parameters is 999).
+SKETCH_READ_BATCH = 500
+HANDOFF_MAX_DATAGRAM = 256 * 1024
+_IS_COLLECTOR = False
+_COLLECTOR_LOCK_FILE = None
+_COLLECTOR_SOCKET = None
+_COLLECTOR_THREAD = None
+_HANDOFF_SOCKET = None
+
+HOUR_SECONDS = 3600
+DAY_SECONDS = 86400
+ROLLUP_INTERVAL_SECONDS = HOUR_SECONDS
+_LAST_ROLLUP_AT = 0.0
+
+DASHBOARD_RANGES = {
+    "24h": DAY_SECONDS,
+    "7d": 7 * DAY_SECONDS,
+    "30d": 30 * DAY_SECONDS,
+    "90d": 90 * DAY_SECONDS,
+    "all": None,
+}
+
+# Dashboard results per (range, limit), reused until another flush commits
+# (see get_flush_generation) or the TTL passes. The TTL bounds how long
+# sliding ranges and renamed video titles can lag behind.
+DASHBOARD_CACHE_TTL_SECONDS = 60
+_DASHBOARD_CACHE = {}
+_DASHBOARD_CACHE_LOCK = threading.Lock()
+
+FLUSH_STATS_LOCK = threading.Lock()
+FLUSH_STATS = {
+    "flush_count": 0,
+    "flush_errors": 0,
+    "rows_written": 0,
+    "last_flush_at": None,
+    "last_flush_ms": 0.0,
+    "max_flush_ms": 0.0,
+    "total_flush_ms": 0.0,
+    "last_rows": {"page_visits": 0, "video_views": 0, "video_watch_buckets": 0},
+}
 
 ADMIN_ANALYTICS_PREFIXES = (
     "/admin",
@@ -57,30 +157,111 @@ def _is_admin_analytics_path(path):
     return False
 
 
-def record_page_visit(path):
+def viewer_hash(viewer_key):
+    """Keyed 64-bit hash of a viewer identifier; the raw key is never stored."""
+    if not viewer_key:
+        return None
+    digest = hashlib.blake2b(str(viewer_key).encode("utf-8"), digest_size=8, key=_VIEWER_HASH_KEY).digest()
+    return int.from_bytes(digest, "big")
+
+
+def _reload_video_ids():
+    global _KNOWN_VIDEO_IDS, _KNOWN_VIDEO_IDS_LOADED_AT
+
+    conn = sqlite3.connect(DATABASE, timeout=10)
+    conn.execute("PRAGMA busy_timeout = 10000")
+    try:
+        _KNOWN_VIDEO_IDS = frozenset(row[0] for row in conn.execute("SELECT id FROM videos"))
+    finally:
+        conn.close()
+    _KNOWN_VIDEO_IDS_LOADED_AT = time.monotonic()
+
+
+def is_known_video(video_id):
+    if not isinstance(video_id, str) or not video_id:
+        return False
+
+    age = None
+    if _KNOWN_VIDEO_IDS_LOADED_AT is not None:
+        age = time.monotonic() - _KNOWN_VIDEO_IDS_LOADED_AT
+    if age is not None and age < VIDEO_ID_CACHE_TTL_SECONDS and video_id in _KNOWN_VIDEO_IDS:
+        return True
+    if age is not None and age < VIDEO_ID_MISS_RELOAD_SECONDS:
+        return False
+
+    with _VIDEO_ID_CACHE_LOCK:
+        # Another thread may have reloaded while this one waited.
+        if _KNOWN_VIDEO_IDS_LOADED_AT is None or time.monotonic() - _KNOWN_VIDEO_IDS_LOADED_AT >= VIDEO_ID_MISS_RELOAD_SECONDS:
+            try:
+                _reload_video_ids()
+            except sqlite3.Error:
+                logger.exception("could not load video ids for analytics validation")
+    return video_id in _KNOWN_VIDEO_IDS
+
+
+def _admit_key(buffer, key, kind, events=1):
+    """Caller holds BUFFER_LOCK. False (and ``events`` counted as dropped) if
+    ``key`` would grow a full buffer."""
+    global _OVERFLOW_LOGGED
+
+    if key in buffer or len(buffer) < ANALYTICS_MAX_BUFFER_KEYS:
+        return True
+    if not _OVERFLOW_LOGGED:
+        _OVERFLOW_LOGGED = True
+        logger.warning(
+            "analytics %s buffer is full (%d keys); dropping events for new keys until the next flush",
+            kind,
+            ANALYTICS_MAX_BUFFER_KEYS,
+        )
+    DROPPED_EVENTS[kind] += events
+    metrics.ANALYTICS_DROPPED_EVENTS.labels(kind).inc(events)
+    return False
+
+
+def record_page_visit(path, viewer_key=None):
     normalized = _normalize_path(path)
     if _is_admin_analytics_path(normalized):
         return
 
+    hashed = viewer_hash(viewer_key)
     with BUFFER_LOCK:
+        if len(normalized) > MAX_PATH_LENGTH:
+            DROPPED_EVENTS["page_visits"] += 1
+            metrics.ANALYTICS_DROPPED_EVENTS.labels("page_visits").inc()
+            return
+        if not _admit_key(PAGE_VISIT_BUFFER, normalized, "page_visits"):
+            return
+        entry = {"p": {normalized: 1}}
+        if hashed is not None:
+            entry["pu"] = {normalized: [hashed]}
+            PAGE_VIEWER_BUFFER.setdefault(normalized, set()).add(hashed)
+        analytics_log.append(entry)
         PAGE_VISIT_BUFFER[normalized] = PAGE_VISIT_BUFFER.get(normalized, 0) + 1
         should_flush = _buffer_size() >= FLUSH_EVENT_THRESHOLD
 
     if should_flush:
-        flush_to_db()
+        _request_flush()
 
 
-def record_video_view(video_id):
+def record_video_view(video_id, viewer_key=None):
     if not video_id:
         return
 
+    hashed = viewer_hash(viewer_key)
     with BUFFER_LOCK:
         key = str(video_id)
+        if not _admit_key(VIDEO_VIEW_BUFFER, key, "video_views"):
+            return
+        entry = {"v": {key: 1}}
+        if hashed is not None:
+            entry["vu"] = {key: [hashed]}
+            VIDEO_VIEWER_BUFFER.setdefault(key, set()).add(hashed)
+        analytics_log.append(entry)
         VIDEO_VIEW_BUFFER[key] = VIDEO_VIEW_BUFFER.get(key, 0) + 1
         should_flush = _buffer_size() >= FLUSH_EVENT_THRESHOLD
 
     if should_flush:
-        flush_to_db()
+        _request_flush()
 
 
 def record_video_watch(video_id, current_time, delta_seconds):
@@ -107,72 +288,644 @@ def record_video_watch(video_id, current_time, delta_seconds):
 
     with BUFFER_LOCK:
         key = (str(video_id), bucket_start)
+        if not _admit_key(VIDEO_WATCH_BUFFER, key, "video_watch_buckets"):
+            return
+        analytics_log.append({"w": [[key[0], bucket_start, delta]]})
         VIDEO_WATCH_BUFFER[key] = VIDEO_WATCH_BUFFER.get(key, 0.0) + delta
         should_flush = _buffer_size() >= FLUSH_EVENT_THRESHOLD
 
     if should_flush:
+        _request_flush()
+
+
+def _request_flush():
+    # Threshold crossings only wake the background flusher; the request that
+    # tipped the buffer over never pays for the write itself.
+    if _FLUSH_THREAD and _FLUSH_THREAD.is_alive():
+        _FLUSH_REQUESTED.set()
+    else:
         flush_to_db()
 
 
-def flush_to_db():
+def _record_flush(started, row_counts, failed=False):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if failed:
+        metrics.ANALYTICS_FLUSH_ERRORS.inc()
+    else:
+        metrics.ANALYTICS_FLUSH_SECONDS.observe(elapsed_ms / 1000)
+        for table, count in row_counts.items():
+            metrics.ANALYTICS_ROWS_WRITTEN.labels(table).inc(count)
+    with FLUSH_STATS_LOCK:
+        if failed:
+            FLUSH_STATS["flush_errors"] += 1
+            return
+        FLUSH_STATS["flush_count"] += 1
+        FLUSH_STATS["rows_written"] += sum(row_counts.values())
+        FLUSH_STATS["last_flush_at"] = _now_iso()
+        FLUSH_STATS["last_flush_ms"] = elapsed_ms
+        FLUSH_STATS["max_flush_ms"] = max(FLUSH_STATS["max_flush_ms"], elapsed_ms)
+        FLUSH_STATS["total_flush_ms"] += elapsed_ms
+        FLUSH_STATS["last_rows"] = dict(row_counts)
+
+
+def get_flush_stats():
+    with FLUSH_STATS_LOCK:
+        stats = dict(FLUSH_STATS)
+        stats["last_rows"] = dict(FLUSH_STATS["last_rows"])
     with BUFFER_LOCK:
-        if not PAGE_VISIT_BUFFER and not VIDEO_VIEW_BUFFER and not VIDEO_WATCH_BUFFER:
+        stats["buffered_keys"] = {
+            "page_visits": len(PAGE_VISIT_BUFFER),
+            "video_views": len(VIDEO_VIEW_BUFFER),
+            "video_watch_buckets": len(VIDEO_WATCH_BUFFER),
+        }
+        stats["dropped_events"] = dict(DROPPED_EVENTS)
+    return stats
+
+
+def flush_to_db(allow_handoff=True):
+    with _FLUSH_LOCK:
+        snapshot, segment = _take_snapshot()
+        if snapshot is None:
+            analytics_log.discard(segment)
             return
 
+        analytics_log.seal(segment)
+        try:
+            if not (allow_handoff and _handoff_to_collector(*snapshot, segment=segment)):
+                _write_snapshot(*snapshot, applied_id=analytics_log.segment_id(segment))
+        except Exception:
+            analytics_log.release(segment)
+            raise
+        analytics_log.discard(segment)
+
+
+def _take_snapshot():
+    global _OVERFLOW_LOGGED
+
+    with BUFFER_LOCK:
+        _OVERFLOW_LOGGED = False
+        segment = analytics_log.rotate()
+        metrics.ANALYTICS_BUFFERED_KEYS.labels("page_visits").set(len(PAGE_VISIT_BUFFER))
+        metrics.ANALYTICS_BUFFERED_KEYS.labels("video_views").set(len(VIDEO_VIEW_BUFFER))
+        metrics.ANALYTICS_BUFFERED_KEYS.labels("video_watch_buckets").set(len(VIDEO_WATCH_BUFFER))
+        if not (PAGE_VISIT_BUFFER or VIDEO_VIEW_BUFFER or VIDEO_WATCH_BUFFER
+                or PAGE_VIEWER_BUFFER or VIDEO_VIEWER_BUFFER):
+            return None, segment
+
         page_snapshot = PAGE_VISIT_BUFFER.copy()
         view_snapshot = VIDEO_VIEW_BUFFER.copy()
         watch_snapshot = VIDEO_WATCH_BUFFER.copy()
+        page_viewers = PAGE_VIEWER_BUFFER.copy()
+        video_viewers = VIDEO_VIEWER_BUFFER.copy()
 
         PAGE_VISIT_BUFFER.clear()
         VIDEO_VIEW_BUFFER.clear()
         VIDEO_WATCH_BUFFER.clear()
+        PAGE_VIEWER_BUFFER.clear()
+        VIDEO_VIEWER_BUFFER.clear()
+
+    return (page_snapshot, view_snapshot, watch_snapshot, page_viewers, video_viewers), segment
+
+
+def _new_sketch(hashes):
+    return bytes(hyperloglog.sketch_from_hashes(hashes)) if hashes else None
 
+
+def _with_stored_sketches(conn, table, key_column, rows):
+    """``rows`` of (key, count, at, new sketch) as upsert rows whose sketch is
+    already merged with the stored one and followed by its estimate.
+
+    Merging here, with NumPy, keeps per-row Python out of the write
+    transaction; the upsert then only stores values.
+    """
+    sketch_keys = [row[0] for row in rows if row[3] is not None]
+    stored = {}
+    for start in range(0, len(sketch_keys), SKETCH_READ_BATCH):
+        batch = sketch_keys[start:start + SKETCH_READ_BATCH]
+        placeholders = ", ".join("?" for _ in batch)
+        stored.update(
+            conn.execute(
+                f"""
+                SELECT {key_column}, viewer_sketch FROM {table}
+                WHERE {key_column} IN ({placeholders}) AND length(viewer_sketch) = ?
+                """,
+                (*batch, hyperloglog.SKETCH_BYTES),
+            ).fetchall()
+        )
+
+    sketches = {row[0]: row[3] for row in rows if row[3] is not None}
+    merge_keys = [key for key in sketches if key in stored]
+    merged = hyperloglog.merge_many(
+        [sketches[key] for key in merge_keys],
+        [stored[key] for key in merge_keys],
+    )
+    sketches.update(zip(merge_keys, merged))
+    estimates = dict(zip(sketches, hyperloglog.estimate_many(list(sketches.values()))))
+
+    return [
+        (key, count, at, sketches.get(key), estimates.get(key, 0))
+        for key, count, at, _ in rows
+    ]
+
+
+def _write_snapshot(
+    page_snapshot,
+    view_snapshot,
+    watch_snapshot,
+    page_viewers=None,
+    video_viewers=None,
+    applied_id=None,
+):
+    """Upsert a snapshot. With ``applied_id`` (an event log entry, see
+    analytics_log) the write is recorded under it, and skipped if that entry
+    was already applied."""
+    started = time.perf_counter()
     now = _now_iso()
+    page_viewers = page_viewers or {}
+    video_viewers = video_viewers or {}
+    # A handoff chunk can carry a key's viewer hashes without its count, so
+    # rows are built over the union of both.
+    page_sketch_rows = [
+        (path, int(page_snapshot.get(path, 0)), now, _new_sketch(page_viewers.get(path)))
+        for path in page_snapshot.keys() | page_viewers.keys()
+    ]
+    view_sketch_rows = [
+        (video_id, int(view_snapshot.get(video_id, 0)), now, _new_sketch(video_viewers.get(video_id)))
+        for video_id in view_snapshot.keys() | video_viewers.keys()
+    ]
+    watch_rows = [
+        (video_id, int(bucket_start), float(watch_seconds), now)
+        for (video_id, bucket_start), watch_seconds in watch_snapshot.items()
+    ]
+
+    # Events are attributed to the hour they are flushed in, which is at most
+    # one flush interval after they happened.
+    hour_start = int(time.time()) // HOUR_SECONDS * HOUR_SECONDS
+    video_hourly = {}
+    # Keys a collector merged only for their viewer hashes sit at zero.
+    for video_id, count in view_snapshot.items():
+        if count:
+            video_hourly.setdefault(video_id, [0, 0.0])[0] += int(count)
+    for (video_id, _), watch_seconds in watch_snapshot.items():
+        video_hourly.setdefault(video_id, [0, 0.0])[1] += float(watch_seconds)
+    page_hourly_rows = [(path, hour_start, int(count)) for path, count in page_snapshot.items() if count]
+    video_hourly_rows = [
+        (video_id, hour_start, views, watch_seconds)
+        for video_id, (views, watch_seconds) in video_hourly.items()
+    ]
+
     conn = sqlite3.connect(DATABASE, timeout=10)
     conn.execute("PRAGMA busy_timeout = 10000")
 
     try:
-        for path, count in page_snapshot.items():
+        # Sketches are merged against a read snapshot before taking the write
+        # lock. Only this function writes them and every write bumps
+        # flush_generation, so an unchanged generation under the lock means
+        # the merge is still current; otherwise it is redone there.
+        conn.execute("BEGIN")
+        read_generation = get_flush_generation(conn)
+        page_rows = _with_stored_sketches(conn, "page_visits", "path", page_sketch_rows)
+        view_rows = _with_stored_sketches(conn, "video_views", "video_id", view_sketch_rows)
+        conn.commit()
+
+        conn.execute("BEGIN IMMEDIATE")
+        if get_flush_generation(conn) != read_generation:
+            page_rows = _with_stored_sketches(conn, "page_visits", "path", page_sketch_rows)
+            view_rows = _with_stored_sketches(conn, "video_views", "video_id", view_sketch_rows)
+        if applied_id is not None:
+            already_applied = conn.execute(
+                "SELECT 1 FROM analytics_applied_log WHERE entry_id = ?",
+                (applied_id,),
+            ).fetchone()
+            if already_applied:
+                conn.rollback()
+                return
             conn.execute(
-                """
-                INSERT INTO page_visits (path, visit_count, last_visited_at)
-                VALUES (?, ?, ?)
-                ON CONFLICT(path) DO UPDATE SET
-                    visit_count = page_visits.visit_count + excluded.visit_count,
-                    last_visited_at = excluded.last_visited_at
-                """,
-                (path, int(count), now),
+                "INSERT INTO analytics_applied_log (entry_id, applied_at) VALUES (?, ?)",
+                (applied_id, int(time.time())),
             )
+        conn.executemany(
+            """
+            INSERT INTO page_visits (path, visit_count, last_visited_at, viewer_sketch, unique_viewers)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET
+                visit_count = page_visits.visit_count + excluded.visit_count,
+                last_visited_at = excluded.last_visited_at,
+                viewer_sketch = COALESCE(excluded.viewer_sketch, page_visits.viewer_sketch),
+                unique_viewers = CASE
+                    WHEN excluded.viewer_sketch IS NULL THEN page_visits.unique_viewers
+                    ELSE excluded.unique_viewers
+                END
+            """,
+            page_rows,
+        )
+        conn.executemany(
+            """
+            INSERT INTO video_views (video_id, view_count, last_viewed_at, viewer_sketch, unique_viewers)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(video_id) DO UPDATE SET
+                view_count = video_views.view_count + excluded.view_count,
+                last_viewed_at = excluded.last_viewed_at,
+                viewer_sketch = COALESCE(excluded.viewer_sketch, video_views.viewer_sketch),
+                unique_viewers = CASE
+                    WHEN excluded.viewer_sketch IS NULL THEN video_views.unique_viewers
+                    ELSE excluded.unique_viewers
+                END
+            """,
+            view_rows,
+        )
+        conn.executemany(
+            """
+            INSERT INTO video_watch_buckets (video_id, bucket_start_sec, watch_seconds, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(video_id, bucket_start_sec) DO UPDATE SET
+                watch_seconds = video_watch_buckets.watch_seconds + excluded.watch_seconds,
+                updated_at = excluded.updated_at
+            """,
+            watch_rows,
+        )
+        conn.executemany(
+            """
+            INSERT INTO page_visits_hourly (path, hour_start, visit_count)
+            VALUES (?, ?, ?)
+            ON CONFLICT(path, hour_start) DO UPDATE SET
+                visit_count = page_visits_hourly.visit_count + excluded.visit_count
+            """,
+            page_hourly_rows,
+        )
+        conn.executemany(
+            """
+            INSERT INTO video_stats_hourly (video_id, hour_start, view_count, watch_seconds)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(video_id, hour_start) DO UPDATE SET
+                view_count = video_stats_hourly.view_count + excluded.view_count,
+                watch_seconds = video_stats_hourly.watch_seconds + excluded.watch_seconds
+            """,
+            video_hourly_rows,
+        )
+        conn.execute("UPDATE analytics_meta SET value = value + 1 WHERE key = 'flush_generation'")
+        conn.commit()
+    except Exception:
+        _record_flush(started, {}, failed=True)
+        raise
+    finally:
+        conn.close()
 
-        for video_id, count in view_snapshot.items():
-            conn.execute(
-                """
-                INSERT INTO video_views (video_id, view_count, last_viewed_at)
-                VALUES (?, ?, ?)
-                ON CONFLICT(video_id) DO UPDATE SET
-                    view_count = video_views.view_count + excluded.view_count,
-                    last_viewed_at = excluded.last_viewed_at
-                """,
-                (video_id, int(count), now),
+    _record_flush(
+        started,
+        {
+            "page_visits": len(page_rows),
+            "video_views": len(view_rows),
+            "video_watch_buckets": len(watch_rows),
+        },
+    )
+
+
+def get_flush_generation(conn):
+    """Number of analytics flushes committed so far, across all processes."""
+    row = conn.execute("SELECT value FROM analytics_meta WHERE key = 'flush_generation'").fetchone()
+    return row[0] if row else 0
+
+
+def _merge_into_buffers(page_counts, view_counts, watch_items, page_viewers=None, video_viewers=None):
+    """Fold a handoff datagram into this process's buffers.
+
+    Keys go through the same per-buffer cap as local events, so the collector,
+    which holds every worker's keys, stays bounded too. A viewer-hash list
+    claims its key in the count buffer (at zero) so that buffer's cap also
+    bounds the viewer buffers. Only what was admitted is logged.
+    """
+    page_counts = {str(path): int(count) for path, count in page_counts.items()}
+    view_counts = {str(video_id): int(count) for video_id, count in view_counts.items()}
+    watch_items = [
+        (str(video_id), int(bucket_start), float(watch_seconds))
+        for video_id, bucket_start, watch_seconds in watch_items
+    ]
+    page_viewers = {str(path): [int(value) for value in hashes] for path, hashes in (page_viewers or {}).items()}
+    video_viewers = {
+        str(video_id): [int(value) for value in hashes] for video_id, hashes in (video_viewers or {}).items()
+    }
+
+    with BUFFER_LOCK:
+        admitted = {"p": {}, "v": {}, "w": [], "pu": {}, "vu": {}}
+        for path, count in page_counts.items():
+            if _admit_key(PAGE_VISIT_BUFFER, path, "page_visits", count):
+                PAGE_VISIT_BUFFER[path] = PAGE_VISIT_BUFFER.get(path, 0) + count
+                admitted["p"][path] = count
+        for video_id, count in view_counts.items():
+            if _admit_key(VIDEO_VIEW_BUFFER, video_id, "video_views", count):
+                VIDEO_VIEW_BUFFER[video_id] = VIDEO_VIEW_BUFFER.get(video_id, 0) + count
+                admitted["v"][video_id] = count
+        for video_id, bucket_start, watch_seconds in watch_items:
+            key = (video_id, bucket_start)
+            if _admit_key(VIDEO_WATCH_BUFFER, key, "video_watch_buckets"):
+                VIDEO_WATCH_BUFFER[key] = VIDEO_WATCH_BUFFER.get(key, 0.0) + watch_seconds
+                admitted["w"].append([video_id, bucket_start, watch_seconds])
+        for path, hashes in page_viewers.items():
+            if _admit_key(PAGE_VISIT_BUFFER, path, "page_visits", 0):
+                PAGE_VISIT_BUFFER.setdefault(path, 0)
+                PAGE_VIEWER_BUFFER.setdefault(path, set()).update(hashes)
+                admitted["pu"][path] = hashes
+        for video_id, hashes in video_viewers.items():
+            if _admit_key(VIDEO_VIEW_BUFFER, video_id, "video_views", 0):
+                VIDEO_VIEW_BUFFER.setdefault(video_id, 0)
+                VIDEO_VIEWER_BUFFER.setdefault(video_id, set()).update(hashes)
+                admitted["vu"][video_id] = hashes
+
+        if any(admitted.values()):
+            analytics_log.append(admitted)
+        return _buffer_size() >= FLUSH_EVENT_THRESHOLD
+
+
+def _handoff_chunks(page_snapshot, view_snapshot, watch_snapshot, page_viewers=None, video_viewers=None):
+    items = [("p", path, count) for path, count in page_snapshot.items()]
+    items.extend(("v", video_id, count) for video_id, count in view_snapshot.items())
+    items.extend(
+        ("w", video_id, bucket_start, watch_seconds)
+        for (video_id, bucket_start), watch_seconds in watch_snapshot.items()
+    )
+    # A viewer-hash list weighs one key per hash so no datagram outgrows
+    # HANDOFF_MAX_DATAGRAM however many viewers a single path has.
+    for kind, viewers in (("pu", page_viewers or {}), ("vu", video_viewers or {})):
+        for key, hashes in viewers.items():
+            hashes = list(hashes)
+            for start in range(0, len(hashes), HANDOFF_CHUNK_KEYS):
+                items.append((kind, key, hashes[start:start + HANDOFF_CHUNK_KEYS]))
+
+    def encode(chunk_items):
+        payload = {"p": {}, "v": {}, "w": [], "pu": {}, "vu": {}}
+        for item in chunk_items:
+            if item[0] == "w":
+                payload["w"].append(list(item[1:]))
+            elif item[0] in ("pu", "vu"):
+                payload[item[0]].setdefault(item[1], []).extend(item[2])
+            else:
+                payload[item[0]][item[1]] = item[2]
+        return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+    chunk_items = []
+    weight = 0
+    for item in items:
+        item_weight = len(item[2]) if item[0] in ("pu", "vu") else 1
+        if chunk_items and weight + item_weight > HANDOFF_CHUNK_KEYS:
+            yield encode(chunk_items)
+            chunk_items = []
+            weight = 0
+        chunk_items.append(item)
+        weight += item_weight
+    if chunk_items:
+        yield encode(chunk_items)
+
+
+def _collector_supported():
+    return ANALYTICS_COLLECTOR_ENABLED and fcntl is not None and hasattr(socket, "AF_UNIX")
+
+
+def _is_analytics_writer():
+    # With a collector only it writes to SQLite; otherwise every process does.
+    return _IS_COLLECTOR or not _collector_supported()
+
+
+def _handoff_to_collector(
+    page_snapshot,
+    view_snapshot,
+    watch_snapshot,
+    page_viewers=None,
+    video_viewers=None,
+    segment=None,
+):
+    """Ship a snapshot to the host collector. Returns False, leaving the
+    caller to write the snapshot itself, if this process is the collector
+    or the collector is unreachable.
+
+    If the collector goes away part way, the undelivered chunks are written
+    here, and ``segment`` (the snapshot's event log segment) is first cut
+    down to just those so a failed write cannot replay delivered ones."""
+    global _HANDOFF_SOCKET
+
+    if _IS_COLLECTOR or not _collector_supported():
+        return False
+
+    chunks = list(_handoff_chunks(page_snapshot, view_snapshot, watch_snapshot, page_viewers, video_viewers))
+    delivered = 0
+    try:
+        if _HANDOFF_SOCKET is None:
+            _HANDOFF_SOCKET = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            _HANDOFF_SOCKET.setblocking(False)
+        for chunk in chunks:
+            if len(chunk) > HANDOFF_MAX_DATAGRAM:
+                raise OSError("analytics handoff chunk too large")
+            _HANDOFF_SOCKET.sendto(chunk, ANALYTICS_SOCKET_PATH)
+            delivered += 1
+    except OSError:
+        if not delivered:
+            return False
+        _write_remaining_chunks(chunks[delivered:], delivered, segment)
+
+    return True
+
+
+def _write_remaining_chunks(chunks, first_index, segment):
+    payloads = [json.loads(chunk) for chunk in chunks]
+    applied_ids = [None] * len(payloads)
+    if segment:
+        name = analytics_log.segment_id(segment)
+        entry_ids = [f"{name}#{first_index + offset}" for offset in range(len(payloads))]
+        try:
+            analytics_log.rewrite(segment, list(zip(entry_ids, payloads)))
+            applied_ids = entry_ids
+        except OSError:
+            # The segment still holds the whole snapshot; replaying it after a
+            # failure below would count the delivered chunks again.
+            logger.exception("could not trim analytics log segment after a partial handoff")
+    _write_chunks(payloads, applied_ids)
+
+
+def _write_chunks(payloads, applied_ids):
+    for payload, applied_id in zip(payloads, applied_ids):
+        watch_snapshot = {
+            (video_id, int(bucket_start)): float(watch_seconds)
+            for video_id, bucket_start, watch_seconds in payload["w"]
+        }
+        _write_snapshot(
+            payload["p"],
+            payload["v"],
+            watch_snapshot,
+            _viewer_sets(payload.get("pu")),
+            _viewer_sets(payload.get("vu")),
+            applied_id=applied_id,
+        )
+
+
+def _viewer_sets(raw):
+    return {key: {int(value) for value in hashes} for key, hashes in (raw or {}).items()}
+
+
+def _collector_loop(sock):
+    while not _STOP_EVENT.is_set():
+        try:
+            data = sock.recv(HANDOFF_MAX_DATAGRAM)
+        except socket.timeout:
+            continue
+        except OSError:
+            break
+
+        try:
+            payload = json.loads(data)
+            should_flush = _merge_into_buffers(
+                payload.get("p") or {},
+                payload.get("v") or {},
+                payload.get("w") or [],
+                payload.get("pu") or {},
+                payload.get("vu") or {},
             )
+        except (ValueError, TypeError, AttributeError):
+            logger.warning("dropping malformed analytics handoff datagram")
+            continue
 
-        for (video_id, bucket_start), watch_seconds in watch_snapshot.items():
-            conn.execute(
-                """
-                INSERT INTO video_watch_buckets (video_id, bucket_start_sec, watch_seconds, updated_at)
-                VALUES (?, ?, ?, ?)
-                ON CONFLICT(video_id, bucket_start_sec) DO UPDATE SET
-                    watch_seconds = video_watch_buckets.watch_seconds + excluded.watch_seconds,
-                    updated_at = excluded.updated_at
-                """,
-                (video_id, int(bucket_start), float(watch_seconds), now),
+        if should_flush:
+            _FLUSH_REQUESTED.set()
+
+
+def _try_become_collector():
+    global _IS_COLLECTOR, _COLLECTOR_LOCK_FILE, _COLLECTOR_SOCKET, _COLLECTOR_THREAD
+
+    if _IS_COLLECTOR or not _collector_supported():
+        return
+
+    lock_file = open(COLLECTOR_LOCK_PATH, "w", encoding="utf-8")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return
+
+    # Holding the lock means any existing socket file belongs to a dead collector.
+    with suppress(FileNotFoundError):
+        os.unlink(ANALYTICS_SOCKET_PATH)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.bind(ANALYTICS_SOCKET_PATH)
+    except OSError:
+        sock.close()
+        lock_file.close()
+        logger.exception("could not bind analytics collector socket")
+        return
+    sock.settimeout(1.0)
+
+    _COLLECTOR_LOCK_FILE = lock_file
+    _COLLECTOR_SOCKET = sock
+    _IS_COLLECTOR = True
+    _COLLECTOR_THREAD = threading.Thread(
+        target=_collector_loop,
+        args=(sock,),
+        daemon=True,
+        name="analytics-collector",
+    )
+    _COLLECTOR_THREAD.start()
+    logger.info("pid %d is the analytics collector for this host", os.getpid())
+
+
+def _release_collector():
+    global _IS_COLLECTOR, _COLLECTOR_LOCK_FILE, _COLLECTOR_SOCKET
+
+    if not _IS_COLLECTOR:
+        return
+
+    _IS_COLLECTOR = False
+    with suppress(OSError):
+        _COLLECTOR_SOCKET.close()
+    with suppress(FileNotFoundError):
+        os.unlink(ANALYTICS_SOCKET_PATH)
+    with suppress(OSError):
+        _COLLECTOR_LOCK_FILE.close()
+    _COLLECTOR_SOCKET = None
+    _COLLECTOR_LOCK_FILE = None
+
+
+def rollup_analytics(now=None):
+    """Downsample hourly rollups past retention into daily rows and expire
+    daily rows past theirs. Safe to run from several processes."""
+    now = int(now if now is not None else time.time())
+    hourly_cutoff = (now - ANALYTICS_HOURLY_RETENTION_DAYS * DAY_SECONDS) // DAY_SECONDS * DAY_SECONDS
+
+    conn = sqlite3.connect(DATABASE, timeout=10)
+    conn.execute("PRAGMA busy_timeout = 10000")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            """
+            INSERT INTO page_visits_daily (path, day_start, visit_count)
+            SELECT path, hour_start / 86400 * 86400, SUM(visit_count)
+            FROM page_visits_hourly
+            WHERE hour_start < ?
+            GROUP BY path, hour_start / 86400
+            ON CONFLICT(path, day_start) DO UPDATE SET
+                visit_count = page_visits_daily.visit_count + excluded.visit_count
+            """,
+            (hourly_cutoff,),
+        )
+        conn.execute(
+            """
+            INSERT INTO video_stats_daily (video_id, day_start, view_count, watch_seconds)
+            SELECT video_id, hour_start / 86400 * 86400, SUM(view_count), SUM(watch_seconds)
+            FROM video_stats_hourly
+            WHERE hour_start < ?
+            GROUP BY video_id, hour_start / 86400
+            ON CONFLICT(video_id, day_start) DO UPDATE SET
+                view_count = video_stats_daily.view_count + excluded.view_count,
+                watch_seconds = video_stats_daily.watch_seconds + excluded.watch_seconds
+            """,
+            (hourly_cutoff,),
+        )
+        conn.execute("DELETE FROM page_visits_hourly WHERE hour_start < ?", (hourly_cutoff,))
+        conn.execute("DELETE FROM video_stats_hourly WHERE hour_start < ?", (hourly_cutoff,))
+
+        if ANALYTICS_DAILY_RETENTION_DAYS:
+            daily_cutoff = now - ANALYTICS_DAILY_RETENTION_DAYS * DAY_SECONDS
+            conn.execute("DELETE FROM page_visits_daily WHERE day_start < ?", (daily_cutoff,))
+            conn.execute("DELETE FROM video_stats_daily WHERE day_start < ?", (daily_cutoff,))
+
+        # An applied-entry marker is only consulted while its segment can
+        # still be replayed.
+        stale_entries = [
+            (entry_id,)
+            for (entry_id,) in conn.execute(
+                "SELECT entry_id FROM analytics_applied_log WHERE applied_at < ?",
+                (now - DAY_SECONDS,),
             )
+            if not analytics_log.segment_exists(entry_id)
+        ]
+        conn.executemany("DELETE FROM analytics_applied_log WHERE entry_id = ?", stale_entries)
 
         conn.commit()
     finally:
         conn.close()
 
 
+def _maybe_rollup():
+    global _LAST_ROLLUP_AT
+
+    if not _is_analytics_writer():
+        return
+    if _LAST_ROLLUP_AT and time.monotonic() - _LAST_ROLLUP_AT < ROLLUP_INTERVAL_SECONDS:
+        return
+
+    _LAST_ROLLUP_AT = time.monotonic()
+    try:
+        rollup_analytics()
+    except sqlite3.Error:
+        logger.exception("analytics rollup failed")
+
+
+def _replay_event_log():
+    try:
+        analytics_log.replay_orphans(_write_snapshot)
+    except (OSError, sqlite3.Error):
+        logger.exception("analytics event log replay failed")
+
+
 def start_analytics_flusher():
     global _FLUSH_THREAD
 
@@ -180,10 +933,29 @@ def start_analytics_flusher():
         return
 
     _STOP_EVENT.clear()
+    _try_become_collector()
+    analytics_log.start_log_syncer()
 
     def loop():
-        while not _STOP_EVENT.wait(FLUSH_INTERVAL_SECONDS):
-            flush_to_db()
+        _replay_event_log()
+        last_flush = time.monotonic()
+        while not _STOP_EVENT.is_set():
+            # Non-collectors hand off more often than the collector flushes so
+            # the single writer sees every worker's events within one interval.
+            interval = FLUSH_INTERVAL_SECONDS if _IS_COLLECTOR else ANALYTICS_HANDOFF_SECONDS
+            if _FLUSH_REQUESTED.wait(interval):
+                _STOP_EVENT.wait(max(0.0, FLUSH_MIN_INTERVAL_SECONDS - (time.monotonic() - last_flush)))
+            _FLUSH_REQUESTED.clear()
+            if _STOP_EVENT.is_set():
+                break
+            last_flush = time.monotonic()
+            try:
+                _try_become_collector()
+                flush_to_db()
+            except sqlite3.Error:
+                logger.exception("analytics flush failed")
+            _replay_event_log()
+            _maybe_rollup()
 
     _FLUSH_THREAD = threading.Thread(target=loop, daemon=True, name="analytics-flush")
     _FLUSH_THREAD.start()
@@ -191,38 +963,129 @@ def start_analytics_flusher():
 
 def stop_analytics_flusher():
     _STOP_EVENT.set()
-    flush_to_db()
+    _FLUSH_REQUESTED.set()
+    _release_collector()
+    # On shutdown the collector may already be gone, so write directly.
+    flush_to_db(allow_handoff=False)
+    analytics_log.stop_log_syncer()
 
 
-def get_analytics_dashboard(limit=20):
-    conn = sqlite3.connect(DATABASE, timeout=10)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA busy_timeout = 10000")
+def _rollup_sources(table_prefix, columns, since):
+    """SQL (and params) unioning hourly and daily rollup rows from ``since``.
+
+    Hourly and daily rows never overlap: rollup_analytics moves hours into
+    days, so each event is counted in exactly one of the two tables.
+    """
+    since_day = since // DAY_SECONDS * DAY_SECONDS
+    sql = f"""
+        SELECT {columns}, hour_start AS bucket_start FROM {table_prefix}_hourly WHERE hour_start >= ?
+        UNION ALL
+        SELECT {columns}, day_start AS bucket_start FROM {table_prefix}_daily WHERE day_start >= ?
+    """
+    return sql, (since, since_day)
+
+
+def _get_range_dashboard(conn, limit, since):
+    pages_sql, pages_params = _rollup_sources("page_visits", "path, visit_count", since)
+    videos_sql, videos_params = _rollup_sources("video_stats", "video_id, view_count, watch_seconds", since)
 
     top_pages = conn.execute(
-        """
-        SELECT path, visit_count, last_visited_at
-        FROM page_visits
+        f"""
+        SELECT path, SUM(visit_count) AS visit_count, NULL AS unique_viewers, NULL AS last_visited_at
+        FROM ({pages_sql})
+        GROUP BY path
         ORDER BY visit_count DESC
         LIMIT ?
         """,
-        (limit,),
+        (*pages_params, limit),
     ).fetchall()
 
     top_videos = conn.execute(
-        """
+        f"""
         SELECT v.id,
                COALESCE(v.display_name, v.filename) AS title,
-               vv.view_count,
-               vv.last_viewed_at
-        FROM video_views vv
-        JOIN videos v ON v.id = vv.video_id
-        ORDER BY vv.view_count DESC
+               s.view_count,
+               s.watch_seconds,
+               NULL AS unique_viewers,
+               NULL AS last_viewed_at
+        FROM (
+            SELECT video_id, SUM(view_count) AS view_count, SUM(watch_seconds) AS watch_seconds
+            FROM ({videos_sql})
+            GROUP BY video_id
+        ) s
+        JOIN videos v ON v.id = s.video_id
+        ORDER BY s.view_count DESC, s.watch_seconds DESC
         LIMIT ?
         """,
-        (limit,),
+        (*videos_params, limit),
+    ).fetchall()
+
+    daily_totals = conn.execute(
+        f"""
+        SELECT day_start,
+               SUM(visit_count) AS visit_count,
+               SUM(view_count) AS view_count,
+               SUM(watch_seconds) AS watch_seconds
+        FROM (
+            SELECT bucket_start / 86400 * 86400 AS day_start, visit_count, 0 AS view_count, 0 AS watch_seconds
+            FROM ({pages_sql})
+            UNION ALL
+            SELECT bucket_start / 86400 * 86400, 0, view_count, watch_seconds
+            FROM ({videos_sql})
+        )
+        GROUP BY day_start
+        ORDER BY day_start DESC
+        """,
+        (*pages_params, *videos_params),
     ).fetchall()
 
+    return top_pages, top_videos, [
+        {
+            "day": datetime.fromtimestamp(row["day_start"], timezone.utc).date().isoformat(),
+            "visit_count": int(row["visit_count"] or 0),
+            "view_count": int(row["view_count"] or 0),
+            "watch_seconds": float(row["watch_seconds"] or 0),
+        }
+        for row in daily_totals
+    ]
+
+
+def _load_dashboard(conn, limit, range_key):
+    range_seconds = DASHBOARD_RANGES.get(range_key)
+    daily_totals = []
+
+    if range_seconds:
+        top_pages, top_videos, daily_totals = _get_range_dashboard(
+            conn,
+            limit,
+            int(time.time()) - range_seconds,
+        )
+    else:
+        top_pages = conn.execute(
+            """
+            SELECT path, visit_count, unique_viewers, last_visited_at
+            FROM page_visits
+            ORDER BY visit_count DESC
+            LIMIT ?
+            """,
+            (limit,),
+        ).fetchall()
+
+        top_videos = conn.execute(
+            """
+            SELECT v.id,
+                   COALESCE(v.display_name, v.filename) AS title,
+                   vv.view_count,
+                   vv.unique_viewers,
+                   vv.last_viewed_at
+            FROM video_views vv
+            JOIN videos v ON v.id = vv.video_id
+            ORDER BY vv.view_count DESC
+            LIMIT ?
+            """,
+            (limit,),
+        ).fetchall()
+
     top_segments = conn.execute(
         """
         SELECT v.id,
@@ -237,13 +1100,39 @@ def get_analytics_dashboard(limit=20):
         (limit,),
     ).fetchall()
 
-    conn.close()
-
+    # Plain dicts: cached results outlive the connection that produced them.
     return {
-        "top_pages": top_pages,
-        "top_videos": top_videos,
-        "top_segments": top_segments,
+        "top_pages": [dict(row) for row in top_pages],
+        "top_videos": [dict(row) for row in top_videos],
+        "top_segments": [dict(row) for row in top_segments],
+        "daily_totals": daily_totals,
     }
 
 
+def get_analytics_dashboard(limit=20, range_key="all"):
+    conn = sqlite3.connect(DATABASE, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout = 10000")
+
+    try:
+        generation = get_flush_generation(conn)
+        cache_key = (range_key, limit)
+        with _DASHBOARD_CACHE_LOCK:
+            cached = _DASHBOARD_CACHE.get(cache_key)
+        if cached and cached[0] == generation and time.monotonic() < cached[1]:
+            return cached[2]
+
+        dashboard = _load_dashboard(conn, limit, range_key)
+    finally:
+        conn.close()
+
+    with _DASHBOARD_CACHE_LOCK:
+        _DASHBOARD_CACHE[cache_key] = (
+            generation,
+            time.monotonic() + DASHBOARD_CACHE_TTL_SECONDS,
+            dashboard,
+        )
+    return dashboard
+
+
 atexit.register(stop_analytics_flusher)
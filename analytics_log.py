@@ -0,0 +1,310 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import suppress
+
+from settings import ANALYTICS_LOG_DIR, ANALYTICS_LOG_ENABLED, ANALYTICS_LOG_FSYNC_SECONDS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Every analytics event is appended to a per-process segment file before it is
+# counted in memory, so a killed worker loses nothing that reached the OS.
+# fsyncs are batched by a background thread (group commit). Callers append and
+# rotate while holding analytics.BUFFER_LOCK, which keeps a segment's contents
+# identical to the buffer snapshot taken at rotation time.
+#
+# Each segment is flock'ed by its owner until it has been written to SQLite and
+# unlinked. Any segment that can be locked by someone else is an orphan from a
+# dead process (or a failed flush) and is replayed straight into SQLite.
+#
+# A segment is applied under its file name, recorded in analytics_applied_log
+# in the same transaction as its upserts, so replaying one that was written
+# but not yet unlinked changes nothing. When a handoff to the collector fails
+# part way, the segment is rewritten to hold only the undelivered chunks, one
+# per line, each applied under "<segment name>#<chunk index>".
+
+_ACTIVE = None
+_SEQUENCE = 0
+_DIRTY = False
+_WRITE_FAILED = False
+_SYNC_LOCK = threading.Lock()
+_SYNC_THREAD = None
+_SYNC_STOP = threading.Event()
+
+
+def log_enabled():
+    return ANALYTICS_LOG_ENABLED and fcntl is not None
+
+
+def _open_segment():
+    global _SEQUENCE
+
+    os.makedirs(ANALYTICS_LOG_DIR, exist_ok=True)
+    _SEQUENCE += 1
+    path = os.path.join(
+        ANALYTICS_LOG_DIR,
+        f"events-{os.getpid()}-{int(time.time() * 1000)}-{_SEQUENCE}.log",
+    )
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    return {"fd": fd, "path": path, "closed": False}
+
+
+def append(payload):
+    """Append one event payload. Caller must hold analytics.BUFFER_LOCK."""
+    global _ACTIVE, _DIRTY, _WRITE_FAILED
+
+    if not log_enabled():
+        return
+
+    line = json.dumps(payload, separators=(",", ":")) + "\n"
+    try:
+        if _ACTIVE is None:
+            _ACTIVE = _open_segment()
+        os.write(_ACTIVE["fd"], line.encode("utf-8"))
+        _DIRTY = True
+        _WRITE_FAILED = False
+    except OSError:
+        if not _WRITE_FAILED:
+            logger.exception("analytics event log append failed; events are memory-only until it recovers")
+        _WRITE_FAILED = True
+
+
+def rotate():
+    """Detach the active segment so new events start a fresh one. Caller must
+    hold analytics.BUFFER_LOCK. Returns the detached segment or None."""
+    global _ACTIVE
+
+    segment = _ACTIVE
+    _ACTIVE = None
+    return segment
+
+
+def segment_id(segment):
+    """Name a segment's events are applied under, or None without a log."""
+    return os.path.basename(segment["path"]) if segment else None
+
+
+def segment_exists(entry_id):
+    """Whether the segment an applied entry came from is still on disk (and
+    so may still be replayed)."""
+    name = entry_id.split("#", 1)[0]
+    return os.path.exists(os.path.join(ANALYTICS_LOG_DIR, name))
+
+
+def _fsync(segment):
+    with _SYNC_LOCK:
+        if segment and not segment["closed"]:
+            os.fsync(segment["fd"])
+
+
+def _close(segment, unlink):
+    with _SYNC_LOCK:
+        if segment["closed"]:
+            return
+        if unlink:
+            with suppress(FileNotFoundError):
+                os.unlink(segment["path"])
+        else:
+            with suppress(OSError):
+                os.fsync(segment["fd"])
+        os.close(segment["fd"])
+        segment["closed"] = True
+
+
+def seal(segment):
+    """Make a detached segment durable before its snapshot is written."""
+    if segment:
+        with suppress(OSError):
+            _fsync(segment)
+
+
+def discard(segment):
+    """The segment's events are in SQLite (or with the collector); drop it."""
+    if segment:
+        _close(segment, unlink=True)
+
+
+def release(segment):
+    """Writing the segment's snapshot failed; unlock it so replay picks it up."""
+    if segment:
+        _close(segment, unlink=False)
+
+
+def rewrite(segment, entries):
+    """Replace a detached segment's contents with ``entries``, a list of
+    (entry id, payload dict), so a replay applies only those.
+
+    The new contents are written and locked under a temporary name, then
+    renamed over the segment, so a crash leaves either the old or the new file.
+    """
+    temp_path = f"{segment['path']}.tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        lines = "".join(
+            json.dumps({"id": entry_id, **payload}, separators=(",", ":")) + "\n"
+            for entry_id, payload in entries
+        )
+        os.write(fd, lines.encode("utf-8"))
+        os.fsync(fd)
+        os.replace(temp_path, segment["path"])
+    except OSError:
+        os.close(fd)
+        with suppress(FileNotFoundError):
+            os.unlink(temp_path)
+        raise
+
+    with _SYNC_LOCK:
+        previous_fd = segment["fd"]
+        segment["fd"] = fd
+    os.close(previous_fd)
+
+
+def _empty_snapshot():
+    return {}, {}, {}, {}, {}
+
+
+def _add_payload(snapshot, payload):
+    page_counts, view_counts, watch_totals, page_viewers, video_viewers = snapshot
+    for path, count in (payload.get("p") or {}).items():
+        page_counts[path] = page_counts.get(path, 0) + int(count)
+    for video_id, count in (payload.get("v") or {}).items():
+        view_counts[video_id] = view_counts.get(video_id, 0) + int(count)
+    for video_id, bucket_start, watch_seconds in payload.get("w") or []:
+        key = (str(video_id), int(bucket_start))
+        watch_totals[key] = watch_totals.get(key, 0.0) + float(watch_seconds)
+    for path, hashes in (payload.get("pu") or {}).items():
+        page_viewers.setdefault(path, set()).update(int(value) for value in hashes)
+    for video_id, hashes in (payload.get("vu") or {}).items():
+        video_viewers.setdefault(video_id, set()).update(int(value) for value in hashes)
+
+
+def read_segment(handle, default_id=None):
+    """[(entry id, snapshot), ...] for a segment: one entry under
+    ``default_id`` holding every event, or one per chunk line of a segment
+    rewritten after a partial handoff."""
+    combined = _empty_snapshot()
+    entries = []
+
+    for raw_line in handle:
+        try:
+            payload = json.loads(raw_line)
+        except ValueError:
+            # A crash mid-append can leave a truncated final line.
+            continue
+        if not isinstance(payload, dict):
+            continue
+
+        if "id" in payload:
+            snapshot = _empty_snapshot()
+            _add_payload(snapshot, payload)
+            entries.append((str(payload["id"]), snapshot))
+        else:
+            _add_payload(combined, payload)
+
+    if any(combined):
+        entries.insert(0, (default_id, combined))
+    return entries
+
+
+def _remove_abandoned_rewrite(path):
+    # An unlocked rewrite was never renamed into place; the segment it was
+    # meant to replace still holds everything.
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return
+    else:
+        with suppress(FileNotFoundError):
+            os.unlink(path)
+    finally:
+        os.close(fd)
+
+
+def replay_orphans(write_snapshot):
+    """Write every unowned segment to SQLite via ``write_snapshot`` and delete it.
+
+    ``write_snapshot`` takes the snapshot plus ``applied_id`` and must skip
+    entries already recorded as applied.
+
+    Returns the number of segments replayed.
+    """
+    if not log_enabled() or not os.path.isdir(ANALYTICS_LOG_DIR):
+        return 0
+
+    replayed = 0
+    for name in sorted(os.listdir(ANALYTICS_LOG_DIR)):
+        if name.startswith("events-") and name.endswith(".log.tmp"):
+            _remove_abandoned_rewrite(os.path.join(ANALYTICS_LOG_DIR, name))
+            continue
+        if not (name.startswith("events-") and name.endswith(".log")):
+            continue
+
+        path = os.path.join(ANALYTICS_LOG_DIR, name)
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            # Another process may have replayed and unlinked it while we waited.
+            if os.fstat(fd).st_nlink == 0:
+                continue
+
+            with os.fdopen(os.dup(fd), "r", encoding="utf-8", errors="replace") as handle:
+                entries = read_segment(handle, default_id=name)
+
+            for entry_id, snapshot in entries:
+                write_snapshot(*snapshot, applied_id=entry_id)
+            os.unlink(path)
+            replayed += 1
+        finally:
+            os.close(fd)
+
+    if replayed:
+        logger.info("replayed %d unflushed analytics log segment(s)", replayed)
+    return replayed
+
+
+def start_log_syncer():
+    global _SYNC_THREAD
+
+    if not log_enabled() or (_SYNC_THREAD and _SYNC_THREAD.is_alive()):
+        return
+
+    _SYNC_STOP.clear()
+
+    def loop():
+        global _DIRTY
+
+        while not _SYNC_STOP.wait(ANALYTICS_LOG_FSYNC_SECONDS):
+            if not _DIRTY:
+                continue
+            _DIRTY = False
+            try:
+                _fsync(_ACTIVE)
+            except OSError:
+                logger.exception("analytics event log fsync failed")
+
+    _SYNC_THREAD = threading.Thread(target=loop, daemon=True, name="analytics-log-sync")
+    _SYNC_THREAD.start()
+
+
+def stop_log_syncer():
+    _SYNC_STOP.set()
@@ -0,0 +1,120 @@
+import math
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from analytics import WATCH_BUCKET_SECONDS, get_flush_generation
+from settings import DATABASE
+
+# Moving-average window, in buckets, applied to the retention curve.
+SMOOTHING_BUCKETS = 3
+RETENTION_CACHE_MAX_VIDEOS = 256
+
+# video_id -> (flush generation, curve). Every flush bumps the generation in
+# SQLite, which invalidates curves cached by any worker.
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def _smooth(values, window):
+    if window <= 1 or values.size < 2:
+        return values.copy()
+    kernel = np.ones(window)
+    # Centered slice of the full convolution: mode="same" returns `window`
+    # points when there are fewer buckets than that. Divide by the number of
+    # buckets actually under the window so the ends are not pulled to zero.
+    lead = (window - 1) // 2
+    totals = np.convolve(values, kernel, mode="full")[lead:lead + values.size]
+    counts = np.convolve(np.ones_like(values), kernel, mode="full")[lead:lead + values.size]
+    return totals / counts
+
+
+def compute_retention_curve(bucket_starts, watch_seconds, duration_seconds, view_count):
+    """Turn per-bucket watch seconds into retention and heatmap series.
+
+    retention[i] is the share of views that watched bucket i (a full replay
+    of the bucket by every viewer is 1.0); heat[i] is watch time relative to
+    the most watched bucket.
+    """
+    bucket_starts = np.asarray(bucket_starts, dtype=np.int64)
+    watch_seconds = np.asarray(watch_seconds, dtype=np.float64)
+
+    last_start = int(bucket_starts.max()) if bucket_starts.size else 0
+    span = float(duration_seconds or 0)
+    if span <= last_start:
+        # Unknown or stale duration: cover every bucket that has data.
+        span = float(last_start + WATCH_BUCKET_SECONDS)
+    bucket_count = max(1, math.ceil(span / WATCH_BUCKET_SECONDS))
+
+    totals = np.zeros(bucket_count, dtype=np.float64)
+    np.add.at(totals, bucket_starts // WATCH_BUCKET_SECONDS, watch_seconds)
+
+    starts = np.arange(bucket_count, dtype=np.float64) * WATCH_BUCKET_SECONDS
+    # The final bucket is usually shorter than WATCH_BUCKET_SECONDS.
+    widths = np.clip(span - starts, 1.0, WATCH_BUCKET_SECONDS)
+
+    views = max(int(view_count or 0), 1)
+    raw = np.clip(totals / (widths * views), 0.0, 1.0)
+    retention = _smooth(raw, SMOOTHING_BUCKETS)
+
+    peak = totals.max()
+    heat = totals / peak if peak > 0 else totals
+
+    return {
+        "bucket_seconds": WATCH_BUCKET_SECONDS,
+        "duration_seconds": span,
+        "view_count": int(view_count or 0),
+        "average_retention": round(float(raw.mean()), 4),
+        "starts": starts.astype(int).tolist(),
+        "retention": np.round(retention, 4).tolist(),
+        "heat": np.round(heat, 4).tolist(),
+    }
+
+
+def get_retention_curve(video_id):
+    """Cached retention curve for ``video_id``, or None if the video is unknown."""
+    conn = sqlite3.connect(DATABASE, timeout=10)
+    conn.execute("PRAGMA busy_timeout = 10000")
+    try:
+        generation = get_flush_generation(conn)
+        with _CACHE_LOCK:
+            cached = _CACHE.get(video_id)
+            if cached and cached[0] == generation:
+                _CACHE.move_to_end(video_id)
+                return cached[1]
+
+        video = conn.execute(
+            """
+            SELECT v.duration_seconds, COALESCE(vv.view_count, 0)
+            FROM videos v
+            LEFT JOIN video_views vv ON vv.video_id = v.id
+            WHERE v.id = ?
+            """,
+            (video_id,),
+        ).fetchone()
+        if video is None:
+            return None
+
+        rows = conn.execute(
+            "SELECT bucket_start_sec, watch_seconds FROM video_watch_buckets WHERE video_id = ?",
+            (video_id,),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    curve = compute_retention_curve(
+        [row[0] for row in rows],
+        [row[1] for row in rows],
+        video[0],
+        video[1],
+    )
+    curve["video_id"] = video_id
+
+    with _CACHE_LOCK:
+        _CACHE[video_id] = (generation, curve)
+        _CACHE.move_to_end(video_id)
+        while len(_CACHE) > RETENTION_CACHE_MAX_VIDEOS:
+            _CACHE.popitem(last=False)
+    return curve
@@ -1,22 +1,41 @@
+import hmac
+import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
 
-from flask import Flask, jsonify, render_template
+from flask import Flask, g, jsonify, render_template, request, session
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-from analytics import start_analytics_flusher
-from db import get_db, init_db
-from hls_utils import convert_to_hls, inspect_hls_state, probe_duration_seconds
+import metrics
+import profiling
+from analytics import WATCH_BUCKET_SECONDS, start_analytics_flusher
+from db import bump_content_generation, get_db, init_db
+from hls_utils import (
+    convert_to_hls,
+    get_runtime_hls_progress,
+    hls_state_fingerprint,
+    inspect_hls_state,
+    probe_duration_seconds,
+    publish_hls_metadata,
+)
 from routes.admin import admin_bp
+from routes.api import api_bp
 from routes.auth import auth_bp
 from routes.public import public_bp
 from settings import (
+    LOG_LEVEL,
     MAX_CONTENT_LENGTH,
+    METRICS_ENABLED,
+    METRICS_TOKEN,
     PERMANENT_SESSION_LIFETIME,
     SECRET_KEY,
     SESSION_COOKIE_HTTPONLY,
     SESSION_COOKIE_SAMESITE,
     SESSION_COOKIE_SECURE,
+    STARTUP_BACKFILL_WORKERS,
     STARTUP_HLS_RETRY_ENABLED,
     STARTUP_HLS_RETRY_LIMIT,
     STORAGE_ROOT,
@@ -26,61 +45,74 @@ from settings import (
 )
 from settings import UPLOAD_FOLDER
 
+logger = logging.getLogger(__name__)
 
-def run_startup_backfill():
-    read_conn = get_db()
-    videos = read_conn.execute(
-        "SELECT id, filename, duration_seconds, hls_progress_pct FROM videos"
-    ).fetchall()
-    read_conn.close()
 
-    retries_triggered = 0
+BACKFILL_BATCH_SIZE = 500
+_INIT_LOCK = threading.Lock()
+_INITIALIZED = False
+_SERVICES_PID = None
+RETRYABLE_HLS_STATES = {"missing", "processing", "pending"}
+# HLS columns of a backfill row, in _write_backfill_batch's UPDATE order.
+_BACKFILL_HLS_COLUMNS = (
+    "hls_status",
+    "hls_progress_pct",
+    "hls_step",
+    "hls_error",
+    "hls_segments_generated",
+    "hls_segments_expected",
+)
 
-    for video in videos:
-        video_id = video["id"]
-        duration_seconds = int(video["duration_seconds"] or 0)
-        hls_progress_pct = int(video["hls_progress_pct"] or 0)
-        media_path = os.path.join(UPLOAD_FOLDER, f"{video_id}_{video['filename']}")
 
-        if duration_seconds <= 0 and os.path.exists(media_path):
-            duration_seconds = probe_duration_seconds(media_path)
+def _inspect_backfill_video(video):
+    """Filesystem half of the backfill for one video; runs on a pool thread.
 
-        hls_state = inspect_hls_state(video_id)
+    Returns None when the video's fingerprint matches the one recorded at the
+    previous boot and nothing about it needs fixing.
+    """
+    video_id = video["id"]
+    media_path = os.path.join(UPLOAD_FOLDER, f"{video_id}_{video['filename']}")
+    fingerprint = hls_state_fingerprint(video_id, media_path)
+    duration_seconds = int(video["duration_seconds"] or 0)
+    media_exists = os.path.exists(media_path)
 
-        should_retry = (
-            STARTUP_HLS_RETRY_ENABLED
-            and retries_triggered < STARTUP_HLS_RETRY_LIMIT
-            and os.path.exists(media_path)
-            and hls_state["status"] in {"missing", "processing", "pending"}
-        )
-        if should_retry:
-            convert_to_hls(video_id, media_path, duration_seconds=duration_seconds)
-            retries_triggered += 1
-            hls_state["status"] = "processing"
-            hls_progress_pct = 0
-
-        if hls_state["status"] == "complete":
-            hls_progress_pct = 100
-            hls_step = "done"
-            hls_error = None
-        elif hls_state["status"] == "processing":
-            hls_progress_pct = min(hls_progress_pct, 99)
-            hls_step = "encoding"
-            hls_error = None
-        elif hls_state["status"] == "missing":
-            hls_progress_pct = 0
-            hls_step = "missing"
-            hls_error = None
-        elif should_retry:
-            hls_progress_pct = 0
-            hls_step = "retrying"
-            hls_error = None
-        else:
-            hls_step = "pending"
-            hls_error = None
-
-        write_conn = get_db()
-        write_conn.execute(
+    retry_candidate = media_exists and video["hls_status"] in RETRYABLE_HLS_STATES
+    needs_probe = duration_seconds <= 0 and media_exists
+    if fingerprint == video["hls_fingerprint"] and not needs_probe and not retry_candidate:
+        return None
+
+    if needs_probe:
+        duration_seconds = probe_duration_seconds(media_path)
+
+    return {
+        "video_id": video_id,
+        "media_path": media_path,
+        "media_exists": media_exists,
+        "fingerprint": fingerprint,
+        "duration_seconds": duration_seconds,
+        "hls_progress_pct": int(video["hls_progress_pct"] or 0),
+        "hls_state": inspect_hls_state(video_id),
+    }
+
+
+def _write_backfill_batch(rows):
+    conn = get_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        placeholders = ", ".join("?" for _ in rows)
+        current = {
+            row["id"]: row
+            for row in conn.execute(
+                f"""
+                SELECT id, duration_seconds, hls_status, hls_progress_pct, hls_step,
+                       hls_error, hls_segments_generated, hls_segments_expected
+                FROM videos
+                WHERE id IN ({placeholders})
+                """,
+                [row[-1] for row in rows],
+            ).fetchall()
+        }
+        conn.executemany(
             """
             UPDATE videos
             SET duration_seconds = ?,
@@ -89,22 +121,124 @@ def run_startup_backfill():
                 hls_step = ?,
                 hls_error = ?,
                 hls_segments_generated = ?,
-                hls_segments_expected = ?
+                hls_segments_expected = ?,
+                hls_fingerprint = ?
             WHERE id = ?
             """,
-            (
-                duration_seconds,
-                hls_state["status"],
-                hls_progress_pct,
-                hls_step,
-                hls_error,
-                hls_state["segments_generated"],
-                hls_state["segments_expected"],
-                video_id,
-            ),
+            rows,
         )
-        write_conn.commit()
-        write_conn.close()
+        # Probed durations show on public pages; HLS state does not, so a
+        # batch that only refreshed that leaves cached pages alone. NULL and 0
+        # both render as an unknown duration.
+        if any(
+            row[-1] in current and (current[row[-1]]["duration_seconds"] or 0) != (row[0] or 0)
+            for row in rows
+        ):
+            bump_content_generation(conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+    # Let progress subscribers see the corrections. "processing" in the store
+    # means an encode is running, so leftover processing rows stay DB-only
+    # (retries publish once convert_to_hls queues them), and a video some
+    # worker is encoding right now keeps its live state.
+    for row in rows:
+        video_id = row[-1]
+        fields = dict(zip(_BACKFILL_HLS_COLUMNS, row[1:7]))
+        previous = current.get(video_id)
+        if previous is None or fields["hls_status"] == "processing":
+            continue
+        if all(previous[column] == value for column, value in fields.items()):
+            continue
+        runtime = get_runtime_hls_progress(video_id)
+        if runtime and runtime.get("status") == "processing":
+            continue
+        publish_hls_metadata(video_id, fields)
+
+
+def run_startup_backfill():
+    started = time.perf_counter()
+    read_conn = get_db()
+    videos = read_conn.execute(
+        "SELECT id, filename, duration_seconds, hls_progress_pct, hls_status, hls_fingerprint FROM videos"
+    ).fetchall()
+    read_conn.close()
+
+    retries_triggered = 0
+    updated = 0
+
+    with ThreadPoolExecutor(max_workers=STARTUP_BACKFILL_WORKERS, thread_name_prefix="backfill-inspect") as pool:
+        inspected = pool.map(_inspect_backfill_video, videos)
+
+        for start in range(0, len(videos), BACKFILL_BATCH_SIZE):
+            rows = []
+            retries = []
+            for _ in range(min(BACKFILL_BATCH_SIZE, len(videos) - start)):
+                item = next(inspected)
+                if item is None:
+                    continue
+
+                hls_state = item["hls_state"]
+                hls_progress_pct = item["hls_progress_pct"]
+                fingerprint = item["fingerprint"]
+
+                should_retry = (
+                    STARTUP_HLS_RETRY_ENABLED
+                    and retries_triggered < STARTUP_HLS_RETRY_LIMIT
+                    and item["media_exists"]
+                    and hls_state["status"] in RETRYABLE_HLS_STATES
+                )
+                if should_retry:
+                    retries.append(item)
+                    retries_triggered += 1
+                    hls_state["status"] = "processing"
+                    hls_progress_pct = 0
+                    # The encode will change the folder; recheck it next boot.
+                    fingerprint = None
+
+                if hls_state["status"] == "complete":
+                    hls_progress_pct = 100
+                    hls_step = "done"
+                elif hls_state["status"] == "processing":
+                    hls_progress_pct = min(hls_progress_pct, 99)
+                    hls_step = "encoding"
+                elif hls_state["status"] == "missing":
+                    hls_progress_pct = 0
+                    hls_step = "missing"
+                else:
+                    hls_step = "pending"
+
+                rows.append(
+                    (
+                        item["duration_seconds"],
+                        hls_state["status"],
+                        hls_progress_pct,
+                        hls_step,
+                        None,
+                        hls_state["segments_generated"],
+                        hls_state["segments_expected"],
+                        fingerprint,
+                        item["video_id"],
+                    )
+                )
+
+            if rows:
+                _write_backfill_batch(rows)
+                updated += len(rows)
+            # Queue encodes only after their rows are committed, so the
+            # backfill never overwrites progress an encode has already saved.
+            for item in retries:
+                convert_to_hls(item["video_id"], item["media_path"], duration_seconds=item["duration_seconds"])
+
+    logger.info(
+        "startup backfill checked %d videos (%d updated, %d skipped unchanged, %d encodes queued) in %.1f s",
+        len(videos),
+        updated,
+        len(videos) - updated,
+        retries_triggered,
+        time.perf_counter() - started,
+    )
 
 
 def run_startup_backfill_once():
@@ -126,13 +260,76 @@ def run_startup_backfill_once():
         run_startup_backfill()
 
 
-def create_app():
-    validate_runtime_settings()
-    ensure_storage_dirs()
-    init_db()
-    run_startup_backfill_once()
+def start_startup_backfill():
+    """Run the backfill on a background thread so the app serves immediately."""
+
+    def run():
+        try:
+            run_startup_backfill_once()
+        except Exception:
+            logger.exception("startup backfill failed")
+
+    thread = threading.Thread(target=run, daemon=True, name="startup-backfill")
+    thread.start()
+    return thread
+
+
+def initialize():
+    """One-time setup: settings check, storage folders, schema migrations.
+
+    Starts no threads and leaves no connection open, so a gunicorn master can
+    run it before forking (preload_app). Later calls are no-ops.
+    """
+    global _INITIALIZED
+
+    with _INIT_LOCK:
+        if _INITIALIZED:
+            return
+        logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+        validate_runtime_settings()
+        ensure_storage_dirs()
+        if not os.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn/"):
+            # gunicorn.conf.py's on_starting does this for gunicorn runs.
+            metrics.remove_dead_process_files()
+        init_db()
+        _INITIALIZED = True
+
+
+def start_background_services():
+    """Start this process's startup backfill and analytics flusher.
+
+    Threads do not survive fork(), so under gunicorn this runs in each worker
+    after forking (post_worker_init in gunicorn.conf.py). A no-op if this
+    process already started them.
+    """
+    global _SERVICES_PID
+
+    initialize()
+    with _INIT_LOCK:
+        if _SERVICES_PID == os.getpid():
+            return
+        _SERVICES_PID = os.getpid()
+    start_startup_backfill()
     start_analytics_flusher()
 
+
+def _metrics_authorized():
+    # Request paths, queue depths and flush stats are not for the public.
+    if session.get("admin_logged_in"):
+        return True
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return bool(METRICS_TOKEN) and scheme.lower() == "bearer" and hmac.compare_digest(
+        token.strip().encode(), METRICS_TOKEN.encode()
+    )
+
+
+def create_app(start_services=True):
+    """Build the Flask app. Pass start_services=False when the caller starts
+    background services itself, as gunicorn.conf.py does after forking."""
+    initialize()
+    if start_services:
+        start_background_services()
+
     app = Flask(__name__)
     app.secret_key = SECRET_KEY
     app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH
@@ -144,8 +341,11 @@ def create_app():
     if TRUST_PROXY:
         app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 
+    profiling.install(app)
+
     app.register_blueprint(auth_bp)
     app.register_blueprint(admin_bp)
+    app.register_blueprint(api_bp)
     app.register_blueprint(public_bp)
 
     @app.template_filter("duration_label")
@@ -164,6 +364,25 @@ def create_app():
             return f"{hours:d}:{minutes:02d}:{seconds:02d}"
         return f"{minutes:02d}:{seconds:02d}"
 
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_latency(response):
+        started = g.pop("request_started", None)
+        if started is not None:
+            # The route pattern, not the raw path, keeps label cardinality bounded.
+            endpoint = request.url_rule.rule if request.url_rule else "<unmatched>"
+            metrics.HTTP_REQUEST_SECONDS.labels(endpoint, request.method, str(response.status_code)).observe(
+                time.perf_counter() - started
+            )
+        return response
+
+    @app.context_processor
+    def analytics_context():
+        return {"analytics_watch_bucket_seconds": WATCH_BUCKET_SECONDS}
+
     @app.errorhandler(403)
     def forbidden(error):
         message = getattr(error, "description", None) or "You do not have permission to view this page."
@@ -179,11 +398,16 @@ def create_app():
         except Exception:
             return jsonify({"status": "error"}), 503
 
-    return app
-
+    if METRICS_ENABLED:
+        @app.route("/metrics")
+        def prometheus_metrics():
+            if not _metrics_authorized():
+                return jsonify({"error": "authentication required"}), 401, {"WWW-Authenticate": "Bearer"}
+            body, content_type = metrics.render_metrics()
+            return body, 200, {"Content-Type": content_type}
 
-app = create_app()
+    return app
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
\ No newline at end of file
+    create_app().run(host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""Benchmark analytics ingest throughput and flush latency.
+
+Usage: python benchmarks/analytics_ingest.py [--events 50000] [--flush-keys 100,1000,10000]
+
+Ingest is measured twice: calling record_* directly (buffering, event log
+and viewer hashing only) and posting 500-event /analytics/batch requests
+through the Flask test client. Flush latency is measured by staging a
+snapshot with the given number of distinct keys in each buffer and timing
+flush_to_db against a database that already holds the rows from earlier
+flushes, so both the insert and the upsert paths are covered.
+"""
+import argparse
+import random
+import time
+
+from benchutil import emit, isolated_storage, summarize_ms
+
+BATCH_EVENTS = 500
+
+
+def _event(rng, video_ids):
+    kind = rng.random()
+    video_id = rng.choice(video_ids)
+    if kind < 0.2:
+        return {"type": "page_visit", "path": f"/c{rng.randrange(200)}"}
+    if kind < 0.3:
+        return {"type": "video_view", "video_id": video_id}
+    return {
+        "type": "video_watch",
+        "video_id": video_id,
+        "current_time": rng.uniform(0, 3600),
+        "delta_seconds": 5,
+    }
+
+
+def bench_direct(analytics, video_ids, events):
+    rng = random.Random(1)
+    batch = [_event(rng, video_ids) for _ in range(events)]
+    started = time.perf_counter()
+    for index, event in enumerate(batch):
+        viewer = f"c:viewer-{index % 5000}"
+        if event["type"] == "page_visit":
+            analytics.record_page_visit(event["path"], viewer)
+        elif event["type"] == "video_view":
+            analytics.record_video_view(event["video_id"], viewer)
+        else:
+            analytics.record_video_watch(event["video_id"], event["current_time"], event["delta_seconds"])
+    elapsed = time.perf_counter() - started
+    return {"events": events, "events_per_second": round(events / elapsed, 1)}
+
+
+def bench_batch_route(client, video_ids, events):
+    rng = random.Random(2)
+    batches = []
+    for offset in range(0, events, BATCH_EVENTS):
+        size = min(BATCH_EVENTS, events - offset)
+        batches.append({"viewer": f"viewer-{offset}", "events": [_event(rng, video_ids) for _ in range(size)]})
+
+    samples = []
+    for body in batches:
+        started = time.perf_counter()
+        response = client.post("/analytics/batch", json=body)
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 204, response.status_code
+    elapsed = sum(samples) / 1000
+    return {
+        "events": events,
+        "batch_events": BATCH_EVENTS,
+        "events_per_second": round(events / elapsed, 1),
+        "request_latency": summarize_ms(samples),
+    }
+
+
+def bench_flush(analytics, key_count, rounds):
+    samples = []
+    for round_index in range(rounds):
+        pages = {f"/flush/{index}": 1 for index in range(key_count)}
+        views = {f"v{index}": 1 for index in range(key_count)}
+        watches = [(f"v{index}", (round_index % 6) * 10, 5.0) for index in range(key_count)]
+        page_viewers = {path: [hash((path, round_index)) & ((1 << 63) - 1)] for path in pages}
+        analytics._merge_into_buffers(pages, views, watches, page_viewers)
+        started = time.perf_counter()
+        analytics.flush_to_db(allow_handoff=False)
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"keys_per_buffer": key_count, "flush": summarize_ms(samples)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=50_000)
+    parser.add_argument("--videos", type=int, default=1_000)
+    parser.add_argument("--flush-keys", default="100,1000,10000")
+    parser.add_argument("--flush-rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    isolated_storage("analytics")
+
+    import analytics
+    import app as app_module
+    from db import get_db
+
+    # create_app() migrates the schema and starts the background flusher, so
+    # threshold flushes do not land on the ingesting thread.
+    client = app_module.create_app().test_client()
+    conn = get_db()
+    video_ids = [f"v{index}" for index in range(max(args.videos, 10_000))]
+    conn.executemany(
+        "INSERT INTO videos (id, filename, display_name) VALUES (?, ?, ?)",
+        [(video_id, f"{video_id}.mp4", video_id) for video_id in video_ids],
+    )
+    conn.commit()
+    conn.close()
+    video_ids = video_ids[:args.videos]
+
+    results = {
+        "direct": bench_direct(analytics, video_ids, args.events),
+        "batch_route": bench_batch_route(client, video_ids, args.events),
+    }
+
+    # Flushes below run on this thread only.
+    analytics.stop_analytics_flusher()
+    results["flush"] = [
+        bench_flush(analytics, int(count), args.flush_rounds)
+        for count in args.flush_keys.split(",")
+        if count.strip()
+    ]
+    emit("analytics_ingest", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Helpers shared by the benchmark scripts in this directory.
+
+Every script builds its own throwaway STORAGE_ROOT before importing any app
+module (settings are read at import time) and prints one JSON document to
+stdout, so results can be saved per commit and diffed with compare.py.
+"""
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Benchmarks drive far more beacons from one address than a real browser.
+BENCH_ENV = {
+    "APP_ENV": "development",
+    "LOG_LEVEL": "WARNING",
+    "STARTUP_HLS_RETRY_ENABLED": "false",
+    "ANALYTICS_RATE_LIMIT_PER_MINUTE": "100000000",
+    "ANALYTICS_RATE_LIMIT_BURST": "100000000",
+    "ANALYTICS_MAX_BUFFER_KEYS": "10000000",
+}
+
+
+def isolated_storage(prefix, **overrides):
+    """Point the app at a fresh temporary STORAGE_ROOT and return its path."""
+    workdir = tempfile.mkdtemp(prefix=f"bench-{prefix}-")
+    env = dict(BENCH_ENV, **overrides)
+    env["STORAGE_ROOT"] = workdir
+    env["DATABASE_PATH"] = os.path.join(workdir, "database.db")
+    env["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(workdir, "prometheus")
+    os.environ.update(env)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return workdir
+
+
+def summarize_ms(samples):
+    """median / p95 / min / max of a list of millisecond samples."""
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "median_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[max(0, math.ceil(len(ordered) * 0.95) - 1)], 3),
+        "min_ms": round(ordered[0], 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def time_calls(func, runs, warmup=1):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize_ms(samples)
+
+
+def ffmpeg_available():
+    return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+
+
+def make_test_media(path, seconds, width, height, fps=30):
+    """Synthetic clip from ffmpeg's lavfi testsrc2 and sine sources."""
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-v", "error",
+        "-f", "lavfi",
+        "-i", f"testsrc2=duration={seconds}:size={width}x{height}:rate={fps}",
+        "-f", "lavfi",
+        "-i", f"sine=frequency=440:duration={seconds}",
+        "-c:v", "libx264",
+        "-preset", "ultrafast",
+        "-pix_fmt", "yuv420p",
+        "-c:a", "aac",
+        "-shortest",
+        path,
+    ]
+    subprocess.run(cmd, check=True)
+    return path
+
+
+def write_stub_hls(output_dir, segment_count, segment_bytes=0, complete=True):
+    """HLS directory with ``segment_count`` segments and a VOD playlist,
+    without encoding anything."""
+    os.makedirs(output_dir, exist_ok=True)
+    payload = os.urandom(segment_bytes) if segment_bytes else b""
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:6", "#EXT-X-PLAYLIST-TYPE:VOD"]
+    for index in range(segment_count):
+        name = f"{index:03d}.ts"
+        with open(os.path.join(output_dir, name), "wb") as handle:
+            handle.write(payload)
+        lines.extend(("#EXTINF:6.000000,", name))
+    if complete:
+        lines.append("#EXT-X-ENDLIST")
+    with open(os.path.join(output_dir, "playlist.m3u8"), "w", encoding="utf-8") as handle:
+        handle.write("\n".join(lines) + "\n")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def emit(name, results):
+    print(json.dumps({"benchmark": name, "environment": environment(), "results": results}, indent=2))
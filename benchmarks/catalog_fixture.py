@@ -0,0 +1,233 @@
+"""Generate a large synthetic catalog: collections, videos, analytics, stub HLS.
+
+Usage: python benchmarks/catalog_fixture.py --storage-root /tmp/catalog [--videos 100000] [--collections 10000]
+       [--depth 6] [--fanout 8] [--bucket-density 0.1] [--hls-segments 3]
+
+Nothing is encoded: every video gets an empty media file and an HLS
+directory with --hls-segments empty segments and a finished VOD playlist, so
+it looks complete to inspect_hls_state. Collections are laid out breadth
+first, each node taking up to --fanout children until --depth levels exist;
+any remainder becomes extra top-level collections. --bucket-density is the
+share of each video's 10 s watch buckets that have watch time.
+
+scaling.py imports generate() to build each of its scale points.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import deque
+
+INSERT_CHUNK = 5000
+
+
+def _chunks(rows, size=INSERT_CHUNK):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def collection_layout(count, depth, fanout):
+    """(id, parent_id) pairs for ``count`` collections, parents first."""
+    layout = []
+    expandable = deque()
+    root_index = 0
+    while len(layout) < count:
+        if expandable:
+            parent_id, parent_depth, children = expandable[0]
+            if children >= fanout:
+                expandable.popleft()
+                continue
+            expandable[0] = (parent_id, parent_depth, children + 1)
+            collection_id = f"{parent_id}.{children}"
+            level = parent_depth + 1
+        else:
+            collection_id = f"c{root_index}"
+            root_index += 1
+            parent_id = None
+            level = 0
+        layout.append((collection_id, parent_id))
+        if level + 1 < depth:
+            expandable.append((collection_id, level, 0))
+    return layout
+
+
+def generate(conn, videos, collections, depth=6, fanout=8, bucket_density=0.1, hls_segments=3,
+             upload_folder=None, hls_folder=None, seed=1):
+    """Fill an initialised database (and optionally the storage folders).
+
+    Returns a summary of what was written.
+    """
+    from db import rebuild_collection_tree
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    layout = collection_layout(collections, depth, fanout)
+    conn.execute("BEGIN")
+    for chunk in _chunks(
+        (
+            collection_id,
+            f"Collection {collection_id}",
+            f"s{collection_id.replace('.', '-')}",
+            parent_id,
+            "private" if index % 20 == 19 else "public",
+            collection_id,
+            0,
+            collection_id,
+        )
+        for index, (collection_id, parent_id) in enumerate(layout)
+    ):
+        conn.executemany(
+            "INSERT INTO collections (id, name, slug, parent_id, visibility, path, depth, tree_sort_key) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            chunk,
+        )
+    rebuild_collection_tree(conn)
+    conn.commit()
+
+    collection_ids = [collection_id for collection_id, _ in layout]
+    durations = [rng.randint(60, 3600) for _ in range(videos)]
+    segment_names = [f"{index:03d}.ts" for index in range(hls_segments)]
+
+    def video_rows():
+        for index, duration in enumerate(durations):
+            yield (
+                f"v{index}",
+                f"video_{index}.mp4",
+                f"Video {index}",
+                "",
+                duration,
+                "complete" if hls_segments else "missing",
+                100 if hls_segments else 0,
+                "done" if hls_segments else "missing",
+                hls_segments,
+                hls_segments,
+                index,
+                "unlisted" if index % 11 == 10 else "public",
+                rng.choice(collection_ids) if collection_ids else None,
+            )
+
+    conn.execute("BEGIN")
+    for chunk in _chunks(video_rows()):
+        conn.executemany(
+            "INSERT INTO videos (id, filename, display_name, description, duration_seconds, hls_status, "
+            "hls_progress_pct, hls_step, hls_segments_generated, hls_segments_expected, sort_order, visibility, "
+            "collection_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            chunk,
+        )
+    conn.commit()
+
+    def view_rows():
+        for index in range(videos):
+            views = int(rng.paretovariate(1.2)) * 3
+            yield (f"v{index}", views, max(1, views // 2))
+
+    bucket_count = [0]
+
+    def bucket_rows():
+        for index, duration in enumerate(durations):
+            for bucket in range(math.ceil(duration / 10)):
+                if rng.random() < bucket_density:
+                    bucket_count[0] += 1
+                    yield (f"v{index}", bucket * 10, round(rng.uniform(1, 600), 1))
+
+    conn.execute("BEGIN")
+    for chunk in _chunks(view_rows()):
+        conn.executemany(
+            "INSERT INTO video_views (video_id, view_count, unique_viewers, last_viewed_at) "
+            "VALUES (?, ?, ?, '2024-01-01T00:00:00Z')",
+            chunk,
+        )
+    for chunk in _chunks(bucket_rows()):
+        conn.executemany(
+            "INSERT INTO video_watch_buckets (video_id, bucket_start_sec, watch_seconds) VALUES (?, ?, ?)",
+            chunk,
+        )
+    conn.execute(
+        "INSERT INTO page_visits (path, visit_count, unique_viewers, last_visited_at) "
+        "SELECT '/' || path, 1 + abs(random() % 1000), 1, '2024-01-01T00:00:00Z' FROM collections"
+    )
+    conn.commit()
+
+    if upload_folder and hls_folder:
+        playlist = "\n".join(
+            ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:6", "#EXT-X-PLAYLIST-TYPE:VOD"]
+            + [line for name in segment_names for line in ("#EXTINF:6.000000,", name)]
+            + ["#EXT-X-ENDLIST", ""]
+        )
+        os.makedirs(upload_folder, exist_ok=True)
+        for index in range(videos):
+            open(os.path.join(upload_folder, f"v{index}_video_{index}.mp4"), "wb").close()
+            if not hls_segments:
+                continue
+            output_dir = os.path.join(hls_folder, f"v{index}")
+            os.makedirs(output_dir, exist_ok=True)
+            for name in segment_names:
+                open(os.path.join(output_dir, name), "wb").close()
+            with open(os.path.join(output_dir, "playlist.m3u8"), "w", encoding="utf-8") as handle:
+                handle.write(playlist)
+
+    return {
+        "videos": videos,
+        "collections": len(layout),
+        "max_depth": conn.execute("SELECT COALESCE(MAX(depth), 0) FROM collections").fetchone()[0] + 1,
+        "watch_buckets": bucket_count[0],
+        "hls_segments_per_video": hls_segments,
+        "generate_seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--storage-root", required=True)
+    parser.add_argument("--videos", type=int, default=100_000)
+    parser.add_argument("--collections", type=int, default=10_000)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--bucket-density", type=float, default=0.1)
+    parser.add_argument("--hls-segments", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.storage_root, "database.db")):
+        parser.error(f"{args.storage_root} already has a database")
+
+    os.environ["STORAGE_ROOT"] = args.storage_root
+    os.environ["DATABASE_PATH"] = os.path.join(args.storage_root, "database.db")
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from db import get_db, init_db
+    from settings import HLS_FOLDER, UPLOAD_FOLDER, ensure_storage_dirs
+
+    ensure_storage_dirs()
+    init_db()
+    conn = get_db()
+    try:
+        summary = generate(
+            conn,
+            args.videos,
+            args.collections,
+            depth=args.depth,
+            fanout=args.fanout,
+            bucket_density=args.bucket_density,
+            hls_segments=args.hls_segments,
+            upload_folder=UPLOAD_FOLDER,
+            hls_folder=HLS_FOLDER,
+            seed=args.seed,
+        )
+    finally:
+        conn.close()
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
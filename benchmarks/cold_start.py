@@ -0,0 +1,127 @@
+"""Benchmark cold start: module imports, app creation, gunicorn boot.
+
+Usage: python benchmarks/cold_start.py [--runs 5] [--workers 2] [--root PATH] [--app-target app:app]
+
+Every figure is a fresh interpreter against a fresh STORAGE_ROOT:
+``import settings``, ``import app``, an app ready to serve (import plus
+create_app() when the module does not build one itself), and gunicorn with
+and without --preload from launch to the first 200 from /healthz. --root
+points the run at another checkout so numbers can be taken before and after
+a change; --app-target overrides the gunicorn app for trees whose
+gunicorn.conf.py does not name one.
+"""
+import argparse
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchutil import ROOT, emit, summarize_ms
+
+IMPORT_SNIPPETS = {
+    "import_settings": "import settings",
+    "import_app": "import app",
+    "app_ready": "import app\nif getattr(app, 'app', None) is None:\n    app.create_app()",
+}
+
+
+def _fresh_env(root):
+    workdir = tempfile.mkdtemp(prefix="bench-coldstart-")
+    env = os.environ.copy()
+    env.update(
+        {
+            "STORAGE_ROOT": workdir,
+            "DATABASE_PATH": os.path.join(workdir, "database.db"),
+            "PROMETHEUS_MULTIPROC_DIR": os.path.join(workdir, "prometheus"),
+            "LOG_LEVEL": "WARNING",
+            "PYTHONPATH": root,
+        }
+    )
+    env.pop("ADMIN_PASSWORD_HASH", None)
+    return env
+
+
+def time_snippet(root, snippet, runs):
+    timer = (
+        "import time\n"
+        "_started = time.perf_counter()\n"
+        f"{snippet}\n"
+        "print((time.perf_counter() - _started) * 1000)\n"
+    )
+    samples = []
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-c", timer],
+            cwd=root,
+            env=_fresh_env(root),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        samples.append(float(completed.stdout.strip().splitlines()[-1]))
+    return summarize_ms(samples)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_gunicorn(root, workers, preload, app_target, runs):
+    samples = []
+    for _ in range(runs):
+        port = _free_port()
+        command = [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}", "--log-level", "warning"]
+        if preload:
+            command.append("--preload")
+        if app_target:
+            command.append(app_target)
+        env = _fresh_env(root)
+        env["GUNICORN_PRELOAD"] = "true" if preload else "false"
+        started = time.perf_counter()
+        process = subprocess.Popen(command, cwd=root, env=env)
+        try:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"gunicorn exited with {process.returncode}")
+                try:
+                    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+                    conn.request("GET", "/healthz")
+                    if conn.getresponse().status == 200:
+                        break
+                except OSError:
+                    pass
+                time.sleep(0.01)
+            samples.append((time.perf_counter() - started) * 1000)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=30)
+    return summarize_ms(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--root", default=ROOT)
+    parser.add_argument("--app-target")
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.root)
+    results = {name: time_snippet(root, snippet, args.runs) for name, snippet in IMPORT_SNIPPETS.items()}
+    if args.workers > 0:
+        results["gunicorn"] = {
+            "workers": args.workers,
+            "to_first_healthz": time_gunicorn(root, args.workers, False, args.app_target, args.runs),
+            "preload_to_first_healthz": time_gunicorn(root, args.workers, True, args.app_target, args.runs),
+        }
+    emit("cold_start", results)
+
+
+if __name__ == "__main__":
+    main()
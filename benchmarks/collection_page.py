@@ -0,0 +1,107 @@
+"""Benchmark collection_page latency against tree depth and video count.
+
+Usage: python benchmarks/collection_page.py [--depths 1,4,16] [--videos 10,1000,20000] [--runs 50]
+
+For each depth, builds a chain of nested collections (every level also has
+a few public and private siblings) and fills the deepest one with the given
+number of videos. The page is then requested through the Flask test client
+as an anonymous visitor and as an admin, with and without ?v= pointing
+past the first page of the playlist.
+"""
+import argparse
+import time
+
+from benchutil import emit, isolated_storage, summarize_ms
+
+SIBLINGS_PER_LEVEL = 3
+
+
+def build_chain(conn, insert_collection, depth, video_count, prefix):
+    parent_id = None
+    for level in range(depth):
+        collection_id = f"{prefix}-l{level}"
+        insert_collection(conn, collection_id, f"Level {level}", f"{prefix}-level-{level}", parent_id, "public")
+        for sibling in range(SIBLINGS_PER_LEVEL):
+            insert_collection(
+                conn,
+                f"{collection_id}-s{sibling}",
+                f"Sibling {sibling}",
+                f"sibling-{sibling}",
+                collection_id,
+                "private" if sibling % 2 else "public",
+            )
+        parent_id = collection_id
+
+    conn.executemany(
+        "INSERT INTO videos (id, filename, display_name, description, duration_seconds, sort_order, visibility, collection_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (
+                f"{prefix}-v{index}",
+                f"video_{index}.mp4",
+                f"Video {index}",
+                "",
+                60 + index % 3000,
+                index,
+                "unlisted" if index % 9 == 0 else "public",
+                parent_id,
+            )
+            for index in range(video_count)
+        ],
+    )
+    conn.commit()
+    path = conn.execute("SELECT path FROM collections WHERE id = ?", (parent_id,)).fetchone()[0]
+    return path, f"{prefix}-v{video_count - 1}"
+
+
+def time_get(client, url, runs):
+    client.get(url)
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        response = client.get(url)
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, (url, response.status_code)
+    return summarize_ms(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--depths", default="1,4,16")
+    parser.add_argument("--videos", default="10,1000,20000")
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    isolated_storage("collection")
+
+    import app as app_module
+    from db import get_db, insert_collection
+
+    flask_app = app_module.create_app()
+    anonymous = flask_app.test_client()
+    admin = flask_app.test_client()
+    with admin.session_transaction() as session:
+        session["admin_logged_in"] = True
+
+    cases = []
+    for depth in (int(value) for value in args.depths.split(",") if value.strip()):
+        for video_count in (int(value) for value in args.videos.split(",") if value.strip()):
+            conn = get_db()
+            path, last_video = build_chain(conn, insert_collection, depth, video_count, f"d{depth}n{video_count}")
+            conn.close()
+            url = f"/{path}"
+            cases.append(
+                {
+                    "depth": depth,
+                    "videos": video_count,
+                    "anonymous": time_get(anonymous, url, args.runs),
+                    "anonymous_selected": time_get(anonymous, f"{url}?v={last_video}", args.runs),
+                    "admin": time_get(admin, url, args.runs),
+                }
+            )
+
+    emit("collection_page", {"cases": cases})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Compare two run_all.py result files.
+
+Usage: python benchmarks/compare.py BASE.json HEAD.json [--threshold 10]
+
+Prints every timing or throughput figure present in both files with its
+relative change, flagging changes beyond --threshold percent. Lower is
+better for *_ms and *_seconds figures, higher for rates.
+"""
+import argparse
+import json
+
+HIGHER_IS_BETTER = ("per_second", "realtime_factor")
+LOWER_IS_BETTER = ("_ms", "_seconds")
+
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            yield from flatten(item, f"{prefix}[{index}]")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def _direction(path):
+    leaf = path.rsplit(".", 1)[-1]
+    if leaf.endswith(HIGHER_IS_BETTER):
+        return 1
+    if leaf.endswith(LOWER_IS_BETTER) and leaf != "wall_seconds":
+        return -1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with open(args.base, encoding="utf-8") as handle:
+        base = json.load(handle)
+    with open(args.head, encoding="utf-8") as handle:
+        head = json.load(handle)
+
+    base_values = dict(flatten(base.get("benchmarks", {})))
+    head_values = dict(flatten(head.get("benchmarks", {})))
+    print(f"base {base['environment'].get('commit')}  head {head['environment'].get('commit')}")
+    for path, old in base_values.items():
+        direction = _direction(path)
+        if not direction or path not in head_values or not old:
+            continue
+        new = head_values[path]
+        change = (new - old) / old * 100
+        marker = ""
+        if abs(change) >= args.threshold:
+            marker = "  better" if change * direction > 0 else "  WORSE"
+        print(f"{path:<80} {old:>12.3f} {new:>12.3f} {change:+8.1f}%{marker}")
+
+
+if __name__ == "__main__":
+    main()
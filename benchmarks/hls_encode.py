@@ -0,0 +1,79 @@
+"""Benchmark HLS encode throughput of _run_hls_encode on synthetic media.
+
+Usage: python benchmarks/hls_encode.py [--durations 10,30] [--resolutions 640x360,1280x720,1920x1080]
+
+Generates lavfi testsrc2/sine clips (no network, nothing under the real
+STORAGE_ROOT is touched) and encodes each one exactly as an upload would,
+reporting the realtime factor (media seconds per wall second) and segments
+written per second. Needs ffmpeg and ffprobe on PATH; without them the
+results only record why the run was skipped.
+"""
+import argparse
+import os
+import time
+
+from benchutil import emit, ffmpeg_available, isolated_storage, make_test_media
+
+
+def _csv(raw):
+    return [part.strip() for part in raw.split(",") if part.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--durations", default="10,30", help="clip lengths in seconds")
+    parser.add_argument("--resolutions", default="640x360,1280x720,1920x1080")
+    parser.add_argument("--runs", type=int, default=1, help="encodes per clip")
+    args = parser.parse_args()
+
+    if not ffmpeg_available():
+        emit("hls_encode", {"skipped": "ffmpeg/ffprobe not found on PATH"})
+        return
+
+    workdir = isolated_storage("encode")
+
+    from db import get_db, init_db
+    from hls_utils import _run_hls_encode, inspect_hls_state, probe_duration_seconds
+
+    init_db()
+    media_dir = os.path.join(workdir, "source")
+    os.makedirs(media_dir, exist_ok=True)
+
+    cases = []
+    for resolution in _csv(args.resolutions):
+        width, height = (int(value) for value in resolution.split("x"))
+        for seconds in (int(value) for value in _csv(args.durations)):
+            source = make_test_media(os.path.join(media_dir, f"{resolution}-{seconds}s.mp4"), seconds, width, height)
+            duration = probe_duration_seconds(source) or seconds
+            for run in range(args.runs):
+                video_id = f"bench-{resolution}-{seconds}-{run}"
+                conn = get_db()
+                conn.execute(
+                    "INSERT INTO videos (id, filename, display_name, duration_seconds) VALUES (?, ?, ?, ?)",
+                    (video_id, os.path.basename(source), video_id, duration),
+                )
+                conn.commit()
+                conn.close()
+
+                started = time.perf_counter()
+                result = _run_hls_encode(video_id, source, duration_seconds=duration)
+                wall = time.perf_counter() - started
+                segments = inspect_hls_state(video_id)["segments_generated"]
+                cases.append(
+                    {
+                        "resolution": resolution,
+                        "media_seconds": duration,
+                        "run": run,
+                        "result": result,
+                        "wall_seconds": round(wall, 3),
+                        "realtime_factor": round(duration / wall, 3) if wall else None,
+                        "segments": segments,
+                        "segments_per_second": round(segments / wall, 3) if wall else None,
+                    }
+                )
+
+    emit("hls_encode", {"cases": cases})
+
+
+if __name__ == "__main__":
+    main()
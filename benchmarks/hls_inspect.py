@@ -0,0 +1,49 @@
+"""Benchmark inspect_hls_state and hls_state_fingerprint against segment count.
+
+Usage: python benchmarks/hls_inspect.py [--segments 10,100,1000,5000] [--runs 200]
+
+Writes stub HLS directories (empty segment files plus a VOD playlist) so the
+cost measured is the directory listing and playlist parse, independent of
+encoder speed. The stat()-only fingerprint is timed alongside for
+comparison, since the startup backfill uses it to skip inspect_hls_state.
+"""
+import argparse
+import os
+
+from benchutil import emit, isolated_storage, time_calls, write_stub_hls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--segments", default="10,100,1000,5000")
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = isolated_storage("inspect")
+
+    from hls_utils import hls_state_fingerprint, inspect_hls_state
+    from settings import HLS_FOLDER
+
+    media_path = os.path.join(workdir, "media.mp4")
+    with open(media_path, "wb") as handle:
+        handle.write(b"\0")
+
+    cases = []
+    for count in (int(value) for value in args.segments.split(",") if value.strip()):
+        video_id = f"segments-{count}"
+        write_stub_hls(os.path.join(HLS_FOLDER, video_id), count)
+        state = inspect_hls_state(video_id)
+        cases.append(
+            {
+                "segments": count,
+                "status": state["status"],
+                "inspect_hls_state": time_calls(lambda: inspect_hls_state(video_id), args.runs),
+                "hls_state_fingerprint": time_calls(lambda: hls_state_fingerprint(video_id, media_path), args.runs),
+            }
+        )
+
+    emit("hls_inspect", {"cases": cases})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Run every benchmark and save the combined results as one JSON file.
+
+Usage: python benchmarks/run_all.py [--quick] [--only serve_hls,collection_page] [--output PATH]
+
+Each benchmark runs in its own interpreter with its own throwaway
+STORAGE_ROOT. Results go to benchmarks/results/<commit>.json unless
+--output is given; compare two such files with benchmarks/compare.py.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchutil import ROOT, environment
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# name -> (full arguments, --quick arguments)
+BENCHMARKS = {
+    "hls_encode": ([], ["--durations", "6", "--resolutions", "640x360"]),
+    "hls_inspect": ([], ["--segments", "10,1000", "--runs", "20"]),
+    "serve_hls": ([], ["--seconds", "2", "--workers", "1"]),
+    "analytics_ingest": ([], ["--events", "5000", "--flush-keys", "100,1000", "--flush-rounds", "2"]),
+    "collection_page": ([], ["--depths", "1,8", "--videos", "10,1000", "--runs", "10"]),
+    "scaling": ([], ["--points", "1000x100,5000x500", "--runs", "5"]),
+    "search_fts": ([], ["--videos", "10000", "--collections", "100", "--runs", "10"]),
+    "cold_start": ([], ["--runs", "2", "--workers", "1"]),
+}
+
+
+def run(name, extra_args):
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, os.path.join(BENCH_DIR, f"{name}.py"), *extra_args],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = round(time.perf_counter() - started, 2)
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-20:], "wall_seconds": elapsed}
+
+    return {"results": json.loads(completed.stdout)["results"], "wall_seconds": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="small sizes, for a smoke run")
+    parser.add_argument("--only", default="", help="comma-separated benchmark names")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    selected = [name.strip() for name in args.only.split(",") if name.strip()] or list(BENCHMARKS)
+    unknown = sorted(set(selected) - set(BENCHMARKS))
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    env = environment()
+    report = {"environment": env, "quick": args.quick, "benchmarks": {}}
+    for name in selected:
+        full_args, quick_args = BENCHMARKS[name]
+        print(f"running {name} ...", file=sys.stderr, flush=True)
+        report["benchmarks"][name] = run(name, quick_args if args.quick else full_args)
+
+    output = args.output or os.path.join(BENCH_DIR, "results", f"{env['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, indent=2)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
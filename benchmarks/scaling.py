@@ -0,0 +1,191 @@
+"""Time startup and page paths across catalog sizes.
+
+Usage: python benchmarks/scaling.py [--points 1000x100,10000x1000,100000x10000] [--runs 20]
+       [--depth 6] [--fanout 8] [--bucket-density 0.1] [--hls-segments 3]
+
+Each point is VIDEOSxCOLLECTIONS. Every point runs in its own interpreter
+against a fresh catalog from catalog_fixture.generate() and records:
+init_db on an empty and on the populated database, run_startup_backfill
+with every fingerprint cleared (cold) and again right after (warm),
+get_collection_parent_options, collection_page for the deepest and the
+widest collection (anonymous and admin), and get_analytics_dashboard with
+its cache cleared. Plot each figure against the point sizes to get the
+scaling curve.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from benchutil import ROOT, emit, isolated_storage, time_calls
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _timed_once(func):
+    started = time.perf_counter()
+    func()
+    return round((time.perf_counter() - started) * 1000, 3)
+
+
+def measure_point(videos, collections, args):
+    isolated_storage("scale")
+
+    from db import get_collection_parent_options, get_db, init_db
+    from settings import HLS_FOLDER, UPLOAD_FOLDER, ensure_storage_dirs
+
+    from catalog_fixture import generate
+
+    ensure_storage_dirs()
+    result = {"init_db_empty_ms": _timed_once(init_db)}
+
+    conn = get_db()
+    result["fixture"] = generate(
+        conn,
+        videos,
+        collections,
+        depth=args.depth,
+        fanout=args.fanout,
+        bucket_density=args.bucket_density,
+        hls_segments=args.hls_segments,
+        upload_folder=UPLOAD_FOLDER,
+        hls_folder=HLS_FOLDER,
+    )
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+    result["init_db_populated"] = time_calls(init_db, args.runs)
+
+    import analytics
+    import app as app_module
+
+    flask_app = app_module.create_app()
+    # create_app() started a backfill of its own; let it finish first.
+    for thread in threading.enumerate():
+        if thread.name == "startup-backfill":
+            thread.join()
+
+    conn = get_db()
+    conn.execute("UPDATE videos SET hls_fingerprint = NULL")
+    conn.commit()
+    conn.close()
+    result["startup_backfill_cold_ms"] = _timed_once(app_module.run_startup_backfill)
+    result["startup_backfill_warm_ms"] = _timed_once(app_module.run_startup_backfill)
+
+    conn = get_db()
+    result["get_collection_parent_options"] = time_calls(lambda: get_collection_parent_options(conn), args.runs)
+    widest = conn.execute(
+        """
+        SELECT c.id, c.path FROM collections c
+        WHERE c.visibility = 'public'
+        ORDER BY (SELECT COUNT(*) FROM collections child WHERE child.parent_id = c.id) DESC, c.depth
+        LIMIT 1
+        """
+    ).fetchone()
+    deepest = conn.execute(
+        """
+        SELECT c.id, c.path FROM collections c
+        WHERE NOT EXISTS (
+            SELECT 1 FROM collection_closure cc
+            JOIN collections a ON a.id = cc.ancestor_id
+            WHERE cc.descendant_id = c.id AND a.visibility <> 'public'
+        )
+        ORDER BY c.depth DESC, (SELECT COUNT(*) FROM videos v WHERE v.collection_id = c.id) DESC
+        LIMIT 1
+        """
+    ).fetchone()
+    result["get_collection_parent_options_excluding"] = time_calls(
+        lambda: get_collection_parent_options(conn, exclude_subtree_of=widest["id"]), args.runs
+    )
+    conn.close()
+
+    anonymous = flask_app.test_client()
+    admin = flask_app.test_client()
+    with admin.session_transaction() as session:
+        session["admin_logged_in"] = True
+
+    def page(client, path):
+        def get():
+            response = client.get(f"/{path}")
+            assert response.status_code == 200, (path, response.status_code)
+
+        return get
+
+    result["collection_page"] = {
+        "deepest_anonymous": time_calls(page(anonymous, deepest["path"]), args.runs),
+        "deepest_admin": time_calls(page(admin, deepest["path"]), args.runs),
+        "widest_anonymous": time_calls(page(anonymous, widest["path"]), args.runs),
+        "widest_admin": time_calls(page(admin, widest["path"]), args.runs),
+    }
+
+    def dashboard(range_key):
+        def load():
+            with analytics._DASHBOARD_CACHE_LOCK:
+                analytics._DASHBOARD_CACHE.clear()
+            analytics.get_analytics_dashboard(limit=30, range_key=range_key)
+
+        return load
+
+    result["get_analytics_dashboard"] = {
+        range_key: time_calls(dashboard(range_key), max(3, args.runs // 4))
+        for range_key in ("all", "30d")
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--points", default="1000x100,10000x1000,100000x10000")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--bucket-density", type=float, default=0.1)
+    parser.add_argument("--hls-segments", type=int, default=3)
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        videos, collections = (int(value) for value in args.single.split("x"))
+        print(json.dumps(measure_point(videos, collections, args)))
+        return
+
+    shape_args = [
+        "--runs", str(args.runs),
+        "--depth", str(args.depth),
+        "--fanout", str(args.fanout),
+        "--bucket-density", str(args.bucket_density),
+        "--hls-segments", str(args.hls_segments),
+    ]
+    points = []
+    for point in (value.strip() for value in args.points.split(",") if value.strip()):
+        print(f"scale point {point} ...", file=sys.stderr, flush=True)
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--single", point, *shape_args],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        )
+        if completed.returncode != 0:
+            points.append({"point": point, "error": completed.stderr.strip().splitlines()[-20:]})
+            continue
+        measured = json.loads(completed.stdout.strip().splitlines()[-1])
+        points.append({"point": point, **measured})
+
+    emit(
+        "scaling",
+        {
+            "depth": args.depth,
+            "fanout": args.fanout,
+            "bucket_density": args.bucket_density,
+            "hls_segments": args.hls_segments,
+            "points": points,
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
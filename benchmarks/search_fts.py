@@ -0,0 +1,144 @@
+"""Benchmark /search ranking queries against a synthetic catalog.
+
+Usage: python benchmarks/search_fts.py [--videos 100000] [--collections 1000] [--runs 50]
+
+Fills a throwaway database with synthetic titles and descriptions drawn from a Zipf-distributed
+vocabulary, and reports per-query latency for search_videos with and without
+the anonymous visibility filter. Queries are picked at several vocabulary
+ranks because ranking cost grows with the number of matching rows; the
+rank-1 word matches nearly every video, which is the case
+SEARCH_MAX_CANDIDATES bounds. "last_page" times the deepest page /search
+serves for each query.
+"""
+import argparse
+import itertools
+import random
+import time
+
+from benchutil import emit, isolated_storage, time_calls
+
+SYLLABLES = ("ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "qu", "bra", "cho", "dri", "fle", "gro")
+VOCABULARY_SIZE = 20_000
+QUERY_RANKS = (1, 10, 100, 1000)
+
+
+def build_vocabulary(size):
+    words = []
+    for length in itertools.count(2):
+        for parts in itertools.product(SYLLABLES, repeat=length):
+            words.append("".join(parts))
+            if len(words) >= size:
+                return words
+
+
+VOCABULARY = build_vocabulary(VOCABULARY_SIZE)
+ZIPF_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, VOCABULARY_SIZE + 1)))
+
+
+def _sentence(rng, count):
+    return " ".join(rng.choices(VOCABULARY, cum_weights=ZIPF_WEIGHTS, k=count))
+
+
+def populate(conn, video_count, collection_count, seed=1):
+    rng = random.Random(seed)
+    collections = [
+        (f"c{idx}", f"Collection {idx}", f"c{idx}", None, "public" if idx % 10 else "private", f"c{idx}", 0, f"c{idx}")
+        for idx in range(collection_count)
+    ]
+    conn.executemany(
+        "INSERT INTO collections (id, name, slug, parent_id, visibility, path, depth, tree_sort_key) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        collections,
+    )
+
+    batch = []
+    for idx in range(video_count):
+        batch.append(
+            (
+                f"v{idx}",
+                f"video_{idx}.mp4",
+                _sentence(rng, 4),
+                _sentence(rng, 30),
+                rng.randint(60, 3600),
+                idx,
+                "public" if idx % 7 else "unlisted",
+                f"c{rng.randrange(collection_count)}",
+            )
+        )
+        if len(batch) >= 5000:
+            _insert_videos(conn, batch)
+            batch = []
+    if batch:
+        _insert_videos(conn, batch)
+    conn.commit()
+
+
+def _insert_videos(conn, rows):
+    conn.executemany(
+        "INSERT INTO videos (id, filename, display_name, description, duration_seconds, sort_order, visibility, collection_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+
+
+def time_query(conn, search_videos, text, runs, include_hidden, offset=0):
+    return time_calls(
+        lambda: search_videos(conn, text, 20, offset=offset, include_hidden=include_hidden),
+        runs,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--videos", type=int, default=100_000)
+    parser.add_argument("--collections", type=int, default=1_000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    isolated_storage("search")
+
+    from db import build_search_query, get_db, init_db, search_videos
+    from settings import SEARCH_MAX_CANDIDATES
+
+    init_db()
+    conn = get_db()
+
+    started = time.perf_counter()
+    populate(conn, args.videos, args.collections)
+    populate_seconds = time.perf_counter() - started
+
+    results = {
+        "videos": args.videos,
+        "collections": args.collections,
+        "populate_seconds": round(populate_seconds, 2),
+        "max_candidates": SEARCH_MAX_CANDIDATES,
+        "queries": {},
+    }
+    queries = [VOCABULARY[rank - 1] for rank in QUERY_RANKS]
+    queries.append(f"{VOCABULARY[9]} {VOCABULARY[99]}")
+    queries.append(VOCABULARY[99][:3])
+    for text in queries:
+        match_count = conn.execute(
+            "SELECT COUNT(*) FROM videos_fts WHERE videos_fts MATCH ?",
+            (build_search_query(text),),
+        ).fetchone()[0]
+        results["queries"][text] = {
+            "matches": match_count,
+            "anonymous": time_query(conn, search_videos, text, args.runs, include_hidden=False),
+            "admin": time_query(conn, search_videos, text, args.runs, include_hidden=True),
+            "last_page": time_query(
+                conn,
+                search_videos,
+                text,
+                args.runs,
+                include_hidden=False,
+                offset=(SEARCH_MAX_CANDIDATES - 1) // 20 * 20,
+            ),
+        }
+
+    conn.close()
+    emit("search_fts", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Benchmark serve_hls requests per second.
+
+Usage: python benchmarks/serve_hls.py [--seconds 5] [--segment-kb 512] [--workers 2] [--concurrency 8]
+
+Serves stub HLS segments of --segment-kb random bytes, plus the playlist,
+first through the Flask test client (route and send_from_directory cost in
+one thread, no sockets) and then through gunicorn on a loopback port with
+--concurrency client threads. Pass --workers 0 to skip the gunicorn run.
+"""
+import argparse
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from benchutil import ROOT, emit, isolated_storage, summarize_ms, write_stub_hls
+
+VIDEO_ID = "bench-serve"
+SEGMENT_COUNT = 20
+
+
+def _paths():
+    paths = [f"/hls/{VIDEO_ID}/playlist.m3u8"]
+    paths.extend(f"/hls/{VIDEO_ID}/{index:03d}.ts" for index in range(SEGMENT_COUNT))
+    return paths
+
+
+def bench_test_client(seconds):
+    import app as app_module
+
+    client = app_module.create_app().test_client()
+    paths = _paths()
+    samples = []
+    sent = 0
+    deadline = time.perf_counter() + seconds
+    index = 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = client.get(paths[index % len(paths)])
+        sent += len(response.get_data())
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.status_code
+        index += 1
+    elapsed = sum(samples) / 1000
+    return {
+        "requests": len(samples),
+        "requests_per_second": round(len(samples) / elapsed, 1),
+        "mib_per_second": round(sent / elapsed / (1 << 20), 1),
+        "latency": summarize_ms(samples),
+    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/healthz")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not become healthy")
+
+
+def bench_gunicorn(seconds, workers, threads, concurrency):
+    port = _free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn",
+            "-w", str(workers),
+            "--threads", str(threads),
+            "-b", f"127.0.0.1:{port}",
+            "--log-level", "warning",
+        ],
+        cwd=ROOT,
+        env=os.environ.copy(),
+    )
+    try:
+        _wait_for(port)
+        paths = _paths()
+        samples = []
+        sent = [0]
+        errors = [0]
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def client(offset):
+            local_samples = []
+            local_bytes = 0
+            local_errors = 0
+            index = offset
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+                    conn.request("GET", paths[index % len(paths)])
+                    response = conn.getresponse()
+                    local_bytes += len(response.read())
+                    conn.close()
+                    if response.status != 200:
+                        local_errors += 1
+                except OSError:
+                    local_errors += 1
+                local_samples.append((time.perf_counter() - started) * 1000)
+                index += 1
+            with lock:
+                samples.extend(local_samples)
+                sent[0] += local_bytes
+                errors[0] += local_errors
+
+        started = time.perf_counter()
+        clients = [threading.Thread(target=client, args=(offset,)) for offset in range(concurrency)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+
+    return {
+        "workers": workers,
+        "threads": threads,
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": errors[0],
+        "requests_per_second": round(len(samples) / elapsed, 1),
+        "mib_per_second": round(sent[0] / elapsed / (1 << 20), 1),
+        "latency": summarize_ms(samples) if samples else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--segment-kb", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    isolated_storage("serve")
+
+    from settings import HLS_FOLDER
+
+    write_stub_hls(os.path.join(HLS_FOLDER, VIDEO_ID), SEGMENT_COUNT, segment_bytes=args.segment_kb * 1024)
+
+    results = {
+        "segment_kb": args.segment_kb,
+        "test_client": bench_test_client(args.seconds),
+    }
+    if args.workers > 0:
+        results["gunicorn"] = bench_gunicorn(args.seconds, args.workers, args.threads, args.concurrency)
+    emit("serve_hls", results)
+
+
+if __name__ == "__main__":
+    main()
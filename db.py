@@ -1,10 +1,15 @@
+import logging
 import sqlite3
+import time
 
-from settings import DATABASE
+from profiling import ProfilingConnection
+from settings import DATABASE, SEARCH_MAX_CANDIDATES
+
+logger = logging.getLogger(__name__)
 
 
 def get_db():
-    conn = sqlite3.connect(DATABASE)
+    conn = sqlite3.connect(DATABASE, factory=ProfilingConnection)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
     conn.execute("PRAGMA busy_timeout = 5000")
@@ -13,8 +18,11 @@ def get_db():
     return conn
 
 
-def init_db():
-    conn = get_db()
+def _table_columns(conn, table):
+    return {row["name"] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def _migrate_base_schema(conn):
     c = conn.cursor()
 
     c.execute("""
@@ -76,16 +84,7 @@ def init_db():
     )
     """)
 
-    c.execute("CREATE INDEX IF NOT EXISTS idx_collections_parent_id ON collections(parent_id)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_videos_collection_order ON videos(collection_id, sort_order)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_videos_collection_visibility ON videos(collection_id, visibility)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_page_visits_count ON page_visits(visit_count DESC)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_video_views_count ON video_views(view_count DESC)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_watch_buckets_seconds ON video_watch_buckets(watch_seconds DESC)")
-
-    columns = {
-        row["name"] for row in c.execute("PRAGMA table_info(videos)").fetchall()
-    }
+    columns = _table_columns(conn, "videos")
     if "display_name" not in columns:
         c.execute("ALTER TABLE videos ADD COLUMN display_name TEXT")
     if "description" not in columns:
@@ -107,43 +106,753 @@ def init_db():
     if "sort_order" not in columns:
         c.execute("ALTER TABLE videos ADD COLUMN sort_order INTEGER NOT NULL DEFAULT 0")
 
+    c.execute("CREATE INDEX IF NOT EXISTS idx_collections_parent_id ON collections(parent_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_videos_collection_order ON videos(collection_id, sort_order)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_videos_collection_visibility ON videos(collection_id, visibility)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_page_visits_count ON page_visits(visit_count DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_video_views_count ON video_views(view_count DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_watch_buckets_seconds ON video_watch_buckets(watch_seconds DESC)")
+
     c.execute(
         "UPDATE videos SET display_name = filename WHERE display_name IS NULL OR TRIM(display_name) = ''"
     )
     c.execute("UPDATE videos SET hls_status = 'pending' WHERE hls_status IS NULL OR TRIM(hls_status) = ''")
     c.execute("UPDATE videos SET hls_step = 'pending' WHERE hls_step IS NULL OR TRIM(hls_step) = ''")
 
-    conn.commit()
-    conn.close()
 
+def _migrate_collection_tree(conn):
+    c = conn.cursor()
+
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS collection_closure (
+        ancestor_id TEXT NOT NULL,
+        descendant_id TEXT NOT NULL,
+        depth INTEGER NOT NULL,
+        PRIMARY KEY(ancestor_id, descendant_id)
+    )
+    """)
+
+    columns = _table_columns(conn, "collections")
+    if "path" not in columns:
+        c.execute("ALTER TABLE collections ADD COLUMN path TEXT")
+    if "depth" not in columns:
+        c.execute("ALTER TABLE collections ADD COLUMN depth INTEGER NOT NULL DEFAULT 0")
+    if "tree_sort_key" not in columns:
+        c.execute("ALTER TABLE collections ADD COLUMN tree_sort_key TEXT")
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_collection_closure_descendant ON collection_closure(descendant_id, depth)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_collections_path ON collections(path)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_collections_tree_sort ON collections(tree_sort_key)")
+
+    rebuild_collection_tree(conn)
+
+
+def _migrate_video_keyset_indexes(conn):
+    c = conn.cursor()
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_videos_collection_keyset "
+        "ON videos(collection_id, sort_order, filename COLLATE NOCASE, id)"
+    )
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_videos_collection_visibility_keyset "
+        "ON videos(collection_id, visibility, sort_order, filename COLLATE NOCASE, id)"
+    )
+    c.execute("DROP INDEX IF EXISTS idx_videos_collection_order")
+    c.execute("DROP INDEX IF EXISTS idx_videos_collection_visibility")
+
+
+def _migrate_video_search_index(conn):
+    c = conn.cursor()
+
+    c.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS videos_fts USING fts5(
+        display_name,
+        description,
+        content='videos',
+        content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """)
+
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS videos_fts_ai AFTER INSERT ON videos BEGIN
+        INSERT INTO videos_fts(rowid, display_name, description)
+        VALUES (new.rowid, new.display_name, new.description);
+    END
+    """)
+
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS videos_fts_ad AFTER DELETE ON videos BEGIN
+        INSERT INTO videos_fts(videos_fts, rowid, display_name, description)
+        VALUES ('delete', old.rowid, old.display_name, old.description);
+    END
+    """)
+
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS videos_fts_au AFTER UPDATE OF display_name, description ON videos BEGIN
+        INSERT INTO videos_fts(videos_fts, rowid, display_name, description)
+        VALUES ('delete', old.rowid, old.display_name, old.description);
+        INSERT INTO videos_fts(rowid, display_name, description)
+        VALUES (new.rowid, new.display_name, new.description);
+    END
+    """)
+
+    c.execute("INSERT INTO videos_fts(videos_fts) VALUES ('rebuild')")
+
+
+def _migrate_analytics_rollups(conn):
+    c = conn.cursor()
+
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS page_visits_hourly (
+        path TEXT NOT NULL,
+        hour_start INTEGER NOT NULL,
+        visit_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(path, hour_start)
+    )
+    """)
+
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS page_visits_daily (
+        path TEXT NOT NULL,
+        day_start INTEGER NOT NULL,
+        visit_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(path, day_start)
+    )
+    """)
+
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS video_stats_hourly (
+        video_id TEXT NOT NULL,
+        hour_start INTEGER NOT NULL,
+        view_count INTEGER NOT NULL DEFAULT 0,
+        watch_seconds REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY(video_id, hour_start)
+    )
+    """)
+
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS video_stats_daily (
+        video_id TEXT NOT NULL,
+        day_start INTEGER NOT NULL,
+        view_count INTEGER NOT NULL DEFAULT 0,
+        watch_seconds REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY(video_id, day_start)
+    )
+    """)
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_page_visits_hourly_start ON page_visits_hourly(hour_start)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_page_visits_daily_start ON page_visits_daily(day_start)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_video_stats_hourly_start ON video_stats_hourly(hour_start)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_video_stats_daily_start ON video_stats_daily(day_start)")
+
+
+def _migrate_unique_viewer_sketches(conn):
+    # viewer_sketch holds a 4 KiB HyperLogLog (see hyperloglog.py);
+    # unique_viewers caches its estimate so dashboards never decode blobs.
+    for table in ("page_visits", "video_views"):
+        columns = _table_columns(conn, table)
+        if "viewer_sketch" not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN viewer_sketch BLOB")
+        if "unique_viewers" not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN unique_viewers INTEGER NOT NULL DEFAULT 0")
+
+
+def _migrate_analytics_meta(conn):
+    # flush_generation is bumped by every analytics flush, in the same
+    # transaction, so any process can tell whether its derived caches are stale.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS analytics_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    conn.execute("INSERT OR IGNORE INTO analytics_meta (key, value) VALUES ('flush_generation', 0)")
+
+
+def _migrate_hls_fingerprint(conn):
+    # Cheap stat() summary of a video's media file and HLS directory, recorded
+    # by the startup backfill so unchanged videos are skipped on the next boot.
+    if "hls_fingerprint" not in _table_columns(conn, "videos"):
+        conn.execute("ALTER TABLE videos ADD COLUMN hls_fingerprint TEXT")
+
+
+def _migrate_content_generation(conn):
+    # Bumped in the same transaction as any admin change to what anonymous
+    # visitors can see, so every worker's rendered-page cache (page_cache.py)
+    # knows when its entries are stale.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS content_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    conn.execute("INSERT OR IGNORE INTO content_meta (key, value) VALUES ('generation', 0)")
+
+
+def _migrate_collection_change_counters(conn):
+    # Per-collection counter behind the JSON API's ETags (routes/api.py).
+    # Triggers keep it current for every writer, including the HLS worker
+    # and the startup backfill; HLS progress columns are deliberately left
+    # out so encoding does not churn the counters.
+    c = conn.cursor()
+
+    if "change_counter" not in _table_columns(conn, "collections"):
+        c.execute("ALTER TABLE collections ADD COLUMN change_counter INTEGER NOT NULL DEFAULT 0")
+
+    # A collection's JSON lists its own fields and its children's, so a
+    # change bumps the collection and both its old and new parent.
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS collections_counter_ai AFTER INSERT ON collections BEGIN
+        UPDATE collections SET change_counter = change_counter + 1 WHERE id = new.parent_id;
+    END
+    """)
+
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS collections_counter_au
+    AFTER UPDATE OF name, slug, parent_id, visibility, path ON collections
+    WHEN old.name IS NOT new.name OR old.slug IS NOT new.slug OR old.parent_id IS NOT new.parent_id
+        OR old.visibility IS NOT new.visibility OR old.path IS NOT new.path
+    BEGIN
+        UPDATE collections SET change_counter = change_counter + 1
+        WHERE id IN (new.id, old.parent_id, new.parent_id);
+    END
+    """)
+
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS videos_counter_ai AFTER INSERT ON videos BEGIN
+        UPDATE collections SET change_counter = change_counter + 1 WHERE id = new.collection_id;
+    END
+    """)
+
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS videos_counter_ad AFTER DELETE ON videos BEGIN
+        UPDATE collections SET change_counter = change_counter + 1 WHERE id = old.collection_id;
+    END
+    """)
+
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS videos_counter_au
+    AFTER UPDATE OF filename, display_name, description, duration_seconds, sort_order, visibility, collection_id
+    ON videos
+    WHEN old.filename IS NOT new.filename OR old.display_name IS NOT new.display_name
+        OR old.description IS NOT new.description OR old.duration_seconds IS NOT new.duration_seconds
+        OR old.sort_order IS NOT new.sort_order OR old.visibility IS NOT new.visibility
+        OR old.collection_id IS NOT new.collection_id
+    BEGIN
+        UPDATE collections SET change_counter = change_counter + 1
+        WHERE id IN (old.collection_id, new.collection_id);
+    END
+    """)
+
+
+def _migrate_analytics_applied_log(conn):
+    # Analytics log segments (and handoff chunks written locally) whose events
+    # are already in the tables above, recorded in the same transaction as
+    # their upserts. A segment left behind by a crash between that commit and
+    # its unlink is then skipped on replay instead of being counted twice.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS analytics_applied_log (
+        entry_id TEXT PRIMARY KEY,
+        applied_at INTEGER NOT NULL
+    )
+    """)
+
+
+def _migrate_video_search_keys(conn):
+    # videos_fts used to be keyed on the implicit rowid of videos, whose TEXT
+    # primary key means VACUUM may renumber those rowids and point every index
+    # entry at the wrong video. Each video now gets a docid from an INTEGER
+    # PRIMARY KEY, which VACUUM preserves, and the index keeps its own copy of
+    # the text under that docid.
+    c = conn.cursor()
+
+    c.execute("DROP TRIGGER IF EXISTS videos_fts_ai")
+    c.execute("DROP TRIGGER IF EXISTS videos_fts_ad")
+    c.execute("DROP TRIGGER IF EXISTS videos_fts_au")
+    c.execute("DROP TABLE IF EXISTS videos_fts")
+
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS video_search_keys (
+        docid INTEGER PRIMARY KEY,
+        video_id TEXT NOT NULL UNIQUE
+    )
+    """)
+    c.execute("""
+    CREATE VIRTUAL TABLE videos_fts USING fts5(
+        display_name,
+        description,
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """)
+
+    c.execute("""
+    CREATE TRIGGER videos_fts_ai AFTER INSERT ON videos BEGIN
+        INSERT INTO video_search_keys (video_id) VALUES (new.id);
+        INSERT INTO videos_fts (rowid, display_name, description)
+        VALUES (last_insert_rowid(), new.display_name, new.description);
+    END
+    """)
 
-def get_collection_parent_options(conn):
+    c.execute("""
+    CREATE TRIGGER videos_fts_ad AFTER DELETE ON videos BEGIN
+        DELETE FROM videos_fts
+        WHERE rowid = (SELECT docid FROM video_search_keys WHERE video_id = old.id);
+        DELETE FROM video_search_keys WHERE video_id = old.id;
+    END
+    """)
+
+    c.execute("""
+    CREATE TRIGGER videos_fts_au AFTER UPDATE OF id, display_name, description ON videos BEGIN
+        UPDATE video_search_keys SET video_id = new.id WHERE video_id = old.id;
+        UPDATE videos_fts
+        SET display_name = new.display_name, description = new.description
+        WHERE rowid = (SELECT docid FROM video_search_keys WHERE video_id = new.id);
+    END
+    """)
+
+    c.execute("DELETE FROM video_search_keys")
+    c.execute("INSERT INTO video_search_keys (video_id) SELECT id FROM videos ORDER BY rowid")
+    c.execute("""
+    INSERT INTO videos_fts (rowid, display_name, description)
+    SELECT k.docid, v.display_name, v.description
+    FROM video_search_keys k
+    JOIN videos v ON v.id = k.video_id
+    """)
+
+
+def _migrate_video_search_prefixes(conn):
+    # Every search word is a prefix query, and without prefix indexes FTS5
+    # merges the doclist of every term starting with it; a two-letter prefix
+    # means most of the vocabulary. Prefix indexes for 2-4 characters make
+    # those a single doclist read. The table is rebuilt from videos under the
+    # docids in video_search_keys; the triggers find it by name.
+    c = conn.cursor()
+
+    c.execute("DROP TABLE videos_fts")
+    c.execute("""
+    CREATE VIRTUAL TABLE videos_fts USING fts5(
+        display_name,
+        description,
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3 4'
+    )
+    """)
+    c.execute("""
+    INSERT INTO videos_fts (rowid, display_name, description)
+    SELECT k.docid, v.display_name, v.description
+    FROM video_search_keys k
+    JOIN videos v ON v.id = k.video_id
+    """)
+
+
+# Append-only: each entry runs exactly once, in order, and its number is
+# recorded in schema_version. Never edit or reorder a released migration.
+MIGRATIONS = [
+    (1, _migrate_base_schema),
+    (2, _migrate_collection_tree),
+    (3, _migrate_video_keyset_indexes),
+    (4, _migrate_video_search_index),
+    (5, _migrate_analytics_rollups),
+    (6, _migrate_unique_viewer_sketches),
+    (7, _migrate_analytics_meta),
+    (8, _migrate_hls_fingerprint),
+    (9, _migrate_content_generation),
+    (10, _migrate_collection_change_counters),
+    (11, _migrate_analytics_applied_log),
+    (12, _migrate_video_search_keys),
+    (13, _migrate_video_search_prefixes),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _read_schema_version(conn):
+    try:
+        row = conn.execute("SELECT version FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return int(row["version"]) if row else 0
+
+
+def init_db():
+    started = time.perf_counter()
+    conn = get_db()
+    applied = []
+
+    try:
+        version = _read_schema_version(conn)
+        if version < SCHEMA_VERSION:
+            # BEGIN IMMEDIATE takes the database write lock, so concurrent
+            # workers queue here and re-read the version once they get it.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+                version = _read_schema_version(conn)
+                for number, migration in MIGRATIONS:
+                    if number <= version:
+                        continue
+                    migration(conn)
+                    applied.append(number)
+
+                if applied:
+                    conn.execute("DELETE FROM schema_version")
+                    conn.execute("INSERT INTO schema_version (version) VALUES (?)", (applied[-1],))
+                    version = applied[-1]
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    finally:
+        conn.close()
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if applied:
+        logger.info(
+            "schema migrated to version %d (applied %s) in %.1f ms",
+            version,
+            ", ".join(str(number) for number in applied),
+            elapsed_ms,
+        )
+    else:
+        logger.info("schema check at version %d took %.1f ms", version, elapsed_ms)
+
+
+def _tree_sort_segment(name, collection_id):
+    # 0x01 sorts below any printable name character, so siblings order by name
+    # and a parent key is always a prefix of (and sorts before) its children.
+    # NUL is avoided because SQLite string functions stop at it.
+    return f"{(name or '').lower()}\x01{collection_id}"
+
+
+def _tree_fields(conn, collection_id, name, slug, parent_id):
+    parent = None
+    if parent_id:
+        parent = conn.execute(
+            "SELECT path, depth, tree_sort_key FROM collections WHERE id = ?",
+            (parent_id,),
+        ).fetchone()
+
+    segment = _tree_sort_segment(name, collection_id)
+    if parent is None:
+        return slug, 0, segment
+
+    return (
+        f"{parent['path']}/{slug}",
+        int(parent["depth"]) + 1,
+        f"{parent['tree_sort_key']}\x1f{segment}",
+    )
+
+
+def rebuild_collection_tree(conn):
     rows = conn.execute(
         "SELECT id, name, slug, parent_id FROM collections"
     ).fetchall()
+    known_ids = {row["id"] for row in rows}
 
     by_parent = {}
     for row in rows:
-        parent_key = row["parent_id"]
+        parent_key = row["parent_id"] if row["parent_id"] in known_ids else None
         by_parent.setdefault(parent_key, []).append(row)
 
-    for children in by_parent.values():
-        children.sort(key=lambda item: item["name"].lower())
+    tree_rows = []
+    closure_rows = []
 
-    options = []
+    def walk(parent_id, depth, ancestors, path_parts, sort_parts):
+        for item in by_parent.get(parent_id, []):
+            current_path = [*path_parts, item["slug"]]
+            current_sort = [*sort_parts, _tree_sort_segment(item["name"], item["id"])]
+            current_ancestors = [*ancestors, item["id"]]
+            tree_rows.append(
+                ("/".join(current_path), depth, "\x1f".join(current_sort), item["id"])
+            )
+            for distance, ancestor_id in enumerate(reversed(current_ancestors)):
+                closure_rows.append((ancestor_id, item["id"], distance))
+            walk(item["id"], depth + 1, current_ancestors, current_path, current_sort)
 
-    def walk(parent_id=None, depth=0, slug_parts=None):
-        if slug_parts is None:
-            slug_parts = []
+    walk(None, 0, [], [], [])
 
-        for item in by_parent.get(parent_id, []):
-            current_slug_parts = [*slug_parts, item["slug"]]
-            options.append({
-                "id": item["id"],
-                "label": f"{'— ' * depth}{item['name']}",
-                "path": "/".join(current_slug_parts),
-            })
-            walk(item["id"], depth + 1, current_slug_parts)
-
-    walk()
-    return options
+    conn.execute("DELETE FROM collection_closure")
+    conn.executemany(
+        "UPDATE collections SET path = ?, depth = ?, tree_sort_key = ? WHERE id = ?",
+        tree_rows,
+    )
+    conn.executemany(
+        "INSERT INTO collection_closure (ancestor_id, descendant_id, depth) VALUES (?, ?, ?)",
+        closure_rows,
+    )
+
+
+def insert_collection(conn, collection_id, name, slug, parent_id, visibility):
+    path, depth, tree_sort_key = _tree_fields(conn, collection_id, name, slug, parent_id)
+
+    conn.execute(
+        """
+        INSERT INTO collections (id, name, slug, parent_id, visibility, path, depth, tree_sort_key)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (collection_id, name, slug, parent_id, visibility, path, depth, tree_sort_key),
+    )
+    conn.execute(
+        """
+        INSERT INTO collection_closure (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, ?, depth + 1 FROM collection_closure WHERE descendant_id = ?
+        UNION ALL
+        SELECT ?, ?, 0
+        """,
+        (collection_id, parent_id, collection_id, collection_id),
+    )
+
+
+def update_collection(conn, collection_id, name, slug, parent_id, visibility):
+    current = conn.execute(
+        "SELECT parent_id, path, depth, tree_sort_key FROM collections WHERE id = ?",
+        (collection_id,),
+    ).fetchone()
+    if current is None:
+        return
+
+    conn.execute(
+        "UPDATE collections SET name = ?, slug = ?, parent_id = ?, visibility = ? WHERE id = ?",
+        (name, slug, parent_id, visibility, collection_id),
+    )
+
+    if current["parent_id"] != parent_id:
+        conn.execute(
+            """
+            DELETE FROM collection_closure
+            WHERE descendant_id IN (
+                SELECT descendant_id FROM collection_closure WHERE ancestor_id = ?
+            )
+            AND ancestor_id NOT IN (
+                SELECT descendant_id FROM collection_closure WHERE ancestor_id = ?
+            )
+            """,
+            (collection_id, collection_id),
+        )
+        conn.execute(
+            """
+            INSERT INTO collection_closure (ancestor_id, descendant_id, depth)
+            SELECT above.ancestor_id, below.descendant_id, above.depth + below.depth + 1
+            FROM collection_closure above
+            CROSS JOIN collection_closure below
+            WHERE above.descendant_id = ? AND below.ancestor_id = ?
+            """,
+            (parent_id, collection_id),
+        )
+
+    path, depth, tree_sort_key = _tree_fields(conn, collection_id, name, slug, parent_id)
+    old_path = current["path"] or ""
+    old_sort_key = current["tree_sort_key"] or ""
+    if (path, depth, tree_sort_key) == (old_path, current["depth"], old_sort_key):
+        return
+
+    conn.execute(
+        """
+        UPDATE collections
+        SET path = ? || substr(path, ?),
+            depth = depth + ?,
+            tree_sort_key = ? || substr(tree_sort_key, ?)
+        WHERE id IN (SELECT descendant_id FROM collection_closure WHERE ancestor_id = ?)
+        """,
+        (
+            path,
+            len(old_path) + 1,
+            depth - int(current["depth"]),
+            tree_sort_key,
+            len(old_sort_key) + 1,
+            collection_id,
+        ),
+    )
+
+
+def get_descendant_ids(conn, root_id):
+    rows = conn.execute(
+        "SELECT descendant_id FROM collection_closure WHERE ancestor_id = ? AND depth > 0",
+        (root_id,),
+    ).fetchall()
+    return {row["descendant_id"] for row in rows}
+
+
+def get_collection_ancestors(conn, collection_id):
+    return conn.execute(
+        """
+        SELECT c.id, c.name, c.slug, c.path, c.visibility
+        FROM collection_closure cc
+        JOIN collections c ON c.id = cc.ancestor_id
+        WHERE cc.descendant_id = ?
+        ORDER BY cc.depth DESC
+        """,
+        (collection_id,),
+    ).fetchall()
+
+
+def get_collection_by_path(conn, collection_path):
+    return conn.execute(
+        "SELECT * FROM collections WHERE path = ?",
+        (collection_path.strip("/"),),
+    ).fetchone()
+
+
+def get_content_generation(conn):
+    row = conn.execute("SELECT value FROM content_meta WHERE key = 'generation'").fetchone()
+    return row[0] if row else 0
+
+
+def bump_content_generation(conn):
+    """Invalidate cached public pages; call inside the write's transaction."""
+    conn.execute("UPDATE content_meta SET value = value + 1 WHERE key = 'generation'")
+
+
+def get_collection_parent_options(conn, exclude_subtree_of=None):
+    if exclude_subtree_of:
+        rows = conn.execute(
+            """
+            SELECT id, name, depth, path FROM collections
+            WHERE id NOT IN (
+                SELECT descendant_id FROM collection_closure WHERE ancestor_id = ?
+            )
+            ORDER BY tree_sort_key
+            """,
+            (exclude_subtree_of,),
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT id, name, depth, path FROM collections ORDER BY tree_sort_key"
+        ).fetchall()
+
+    return [
+        {
+            "id": row["id"],
+            "label": f"{'— ' * int(row['depth'])}{row['name']}",
+            "path": row["path"],
+        }
+        for row in rows
+    ]
+
+
+def get_collection_videos_page(conn, collection_id, columns, limit, after_id=None, public_only=False):
+    """Return up to ``limit`` videos ordered by (sort_order, filename, id)
+    starting after ``after_id``, plus whether another page follows.
+
+    Returns ``(None, False)`` if ``after_id`` is not a video this listing
+    includes (deleted, moved, hidden or made up), since there is then no
+    position to continue from.
+    """
+    visibility_clause = " AND visibility = 'public'" if public_only else ""
+    where = f"collection_id = ?{visibility_clause}"
+    params = [collection_id]
+
+    if after_id:
+        cursor_row = conn.execute(
+            f"SELECT sort_order, filename FROM videos WHERE id = ? AND {where}",
+            (after_id, *params),
+        ).fetchone()
+        if cursor_row is None:
+            return None, False
+        where += " AND (sort_order, filename COLLATE NOCASE, id) > (?, ?, ?)"
+        params.extend([cursor_row["sort_order"], cursor_row["filename"], after_id])
+
+    rows = conn.execute(
+        f"""
+        SELECT {columns} FROM videos
+        WHERE {where}
+        ORDER BY sort_order ASC, filename COLLATE NOCASE ASC, id ASC
+        LIMIT ?
+        """,
+        (*params, limit + 1),
+    ).fetchall()
+
+    return rows[:limit], len(rows) > limit
+
+
+def get_public_collections_page(conn, columns, limit, after_id=None):
+    """Return up to ``limit`` collections in tree order starting after
+    ``after_id``, plus whether another page follows.
+
+    Only collections with no private ancestor (themselves included) are
+    listed. ``columns`` selects from ``collections c``.
+    """
+    where = """
+        NOT EXISTS (
+            SELECT 1 FROM collection_closure cc
+            JOIN collections a ON a.id = cc.ancestor_id
+            WHERE cc.descendant_id = c.id AND a.visibility <> 'public'
+        )
+    """
+    params = []
+
+    if after_id:
+        cursor_row = conn.execute("SELECT tree_sort_key FROM collections WHERE id = ?", (after_id,)).fetchone()
+        if cursor_row is not None:
+            where += " AND (c.tree_sort_key, c.id) > (?, ?)"
+            params.extend([cursor_row["tree_sort_key"], after_id])
+
+    rows = conn.execute(
+        f"""
+        SELECT {columns} FROM collections c
+        WHERE {where}
+        ORDER BY c.tree_sort_key ASC, c.id ASC
+        LIMIT ?
+        """,
+        (*params, limit + 1),
+    ).fetchall()
+
+    return rows[:limit], len(rows) > limit
+
+
+def build_search_query(text):
+    """Turn free text into an FTS5 query: every word must match, as a prefix."""
+    terms = []
+    for word in (text or "").split():
+        cleaned = word.replace('"', "").strip()
+        if cleaned:
+            terms.append(f'"{cleaned}"*')
+    return " ".join(terms)
+
+
+def search_videos(conn, text, limit, offset=0, include_hidden=False, max_candidates=SEARCH_MAX_CANDIDATES):
+    """Return ranked matches for ``text`` plus whether more results follow.
+
+    Ranking scores every row it sorts, so only the ``max_candidates`` most
+    recently indexed matches (highest docids) are ranked; results stop there.
+
+    Anonymous searches only see public videos that are in a public collection
+    or in none; unlisted and private videos stay reachable by URL only.
+    Admins see every match.
+    """
+    match = build_search_query(text)
+    if not match or offset >= max_candidates:
+        return [], False
+
+    # Walking the doclist by docid is cheap; it is bm25 over every match that
+    # is not. The lowest docid among the newest candidates bounds the ranked
+    # query below.
+    floor = conn.execute(
+        "SELECT rowid FROM videos_fts WHERE videos_fts MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+        (match, max_candidates - 1),
+    ).fetchone()
+
+    visibility_clause = ""
+    if not include_hidden:
+        visibility_clause = "AND v.visibility = 'public' AND (v.collection_id IS NULL OR c.visibility = 'public')"
+
+    rows = conn.execute(
+        f"""
+        SELECT v.id,
+               COALESCE(v.display_name, v.filename) AS title,
+               snippet(videos_fts, 1, char(2), char(3), '…', 16) AS excerpt,
+               v.duration_seconds,
+               c.name AS collection_name,
+               c.path AS collection_path
+        FROM videos_fts
+        JOIN video_search_keys k ON k.docid = videos_fts.rowid
+        JOIN videos v ON v.id = k.video_id
+        LEFT JOIN collections c ON c.id = v.collection_id
+        WHERE videos_fts MATCH ? AND videos_fts.rowid >= ? {visibility_clause}
+        ORDER BY bm25(videos_fts, 4.0, 1.0)
+        LIMIT ? OFFSET ?
+        """,
+        (match, floor[0] if floor else 0, limit + 1, offset),
+    ).fetchall()
+
+    return rows[:limit], len(rows) > limit
@@ -0,0 +1,45 @@
+# Loaded automatically by gunicorn from the working directory; command-line
+# flags (see the Dockerfile) still take precedence over anything set here.
+import glob
+import os
+
+from settings import PROMETHEUS_MULTIPROC_DIR
+
+# Thread budget: each worker serves --threads requests at once. Admin HLS
+# progress streams (server-sent events) hold a thread each for their whole
+# lifetime, so routes/admin.py admits at most HLS_SSE_MAX_STREAMS of them per
+# worker and answers the rest with 503, which makes the page fall back to
+# polling. Keep HLS_SSE_MAX_STREAMS well below the thread count.
+
+# Workers get an app without background threads; post_worker_init starts them.
+wsgi_app = "app:create_app(start_services=False)"
+
+# Import the app, check settings and migrate the schema once in the master
+# instead of once per worker. initialize() starts no threads, so this is
+# fork-safe.
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+
+def on_starting(server):
+    # Per-process metric files from a previous run would be summed into the
+    # new one's counters.
+    multiproc_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", PROMETHEUS_MULTIPROC_DIR)
+    os.makedirs(multiproc_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+        os.remove(path)
+
+
+def post_worker_init(worker):
+    # Runs in each worker after the fork, once the app is loaded and the
+    # worker's own signal handlers are installed. (post_fork comes before
+    # both, and a SIGTERM arriving while it started threads would be lost.)
+    import app
+
+    app.start_background_services()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    # Drop the dead worker's live gauges (queue depth, active encodes, ...).
+    multiprocess.mark_process_dead(worker.pid)
@@ -4,16 +4,32 @@ import sqlite3
 import subprocess
 import threading
 import time
+from contextlib import suppress
 
+import metrics
+import progress_store
 from settings import DATABASE, HLS_FOLDER, HLS_MAX_CONCURRENT_STREAMS
 
-HLS_RUNTIME_PROGRESS = {}
-HLS_RUNTIME_LOCK = threading.Lock()
 HLS_JOB_QUEUE = queue.Queue()
 HLS_QUEUE_LOCK = threading.Lock()
 HLS_QUEUED_VIDEO_IDS = set()
 HLS_WORKERS_STARTED = False
 
+# Woken on every local progress change so streams in this process react
+# immediately; changes from other workers are picked up by polling the shared
+# store every HLS_CHANGE_POLL_SECONDS.
+HLS_CHANGE_CONDITION = threading.Condition()
+HLS_CHANGE_POLL_SECONDS = 0.5
+# videos columns mirrored into the progress store, named there without "hls_".
+_HLS_METADATA_COLUMNS = (
+    "hls_status",
+    "hls_progress_pct",
+    "hls_step",
+    "hls_error",
+    "hls_segments_generated",
+    "hls_segments_expected",
+)
+
 
 def probe_duration_seconds(input_path):
     cmd = [
@@ -89,6 +105,55 @@ def inspect_hls_state(video_id):
     }
 
 
+def hls_state_fingerprint(video_id, media_path):
+    """stat()-only summary that changes whenever inspect_hls_state could.
+
+    Segment files being added or removed change the directory mtime, and the
+    playlist is covered by its own mtime and size.
+    """
+    parts = []
+    for path in (media_path, os.path.join(HLS_FOLDER, video_id), os.path.join(HLS_FOLDER, video_id, "playlist.m3u8")):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            parts.append("-")
+            continue
+        parts.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+    return "|".join(parts)
+
+
+def current_hls_event_sequence():
+    return progress_store.current_sequence()
+
+
+def hls_event_stream_id():
+    return progress_store.store_id()
+
+
+def wait_for_hls_changes(after_sequence, timeout):
+    """Runtime progress changes after ``after_sequence``, waiting up to ``timeout``.
+
+    Returns (latest_sequence, changes) where changes are (sequence, video_id,
+    full runtime state), or None when a slot changed since ``after_sequence``
+    has been reused for another video and the caller must resync.
+    """
+    deadline = time.monotonic() + timeout
+    while progress_store.current_sequence() <= after_sequence:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return after_sequence, []
+        with HLS_CHANGE_CONDITION:
+            HLS_CHANGE_CONDITION.wait(min(remaining, HLS_CHANGE_POLL_SECONDS))
+
+    latest = progress_store.current_sequence()
+    if progress_store.evicted_sequence() > after_sequence:
+        return latest, None
+    return latest, [
+        (sequence, video_id, state)
+        for video_id, sequence, state in progress_store.changes_since(after_sequence)
+    ]
+
+
 def _update_hls_metadata(video_id, **fields):
     if not fields:
         return
@@ -103,30 +168,51 @@ def _update_hls_metadata(video_id, **fields):
             conn.execute(f"UPDATE videos SET {assignments} WHERE id = ?", values)
             conn.commit()
             conn.close()
+            publish_hls_metadata(video_id, fields)
             return
         except sqlite3.OperationalError as exc:
             conn.close()
-            if "locked" not in str(exc).lower() or attempt == 4:
+            if "locked" not in str(exc).lower():
                 raise
+            if attempt == 4:
+                metrics.SQLITE_BUSY_FAILURES.labels("hls_metadata").inc()
+                raise
+            metrics.SQLITE_BUSY_RETRIES.labels("hls_metadata").inc()
             time.sleep(0.2 * (2 ** attempt))
 
 
+def publish_hls_metadata(video_id, fields):
+    """Mirror committed ``hls_*`` column values into the progress store.
+
+    Runtime state takes precedence over the row when progress is read, and
+    SSE subscribers only hear about store changes, so every HLS write has to
+    land here too. A write identical to the runtime state is a no-op.
+    """
+    payload = {
+        column[len("hls_"):]: "" if value is None else value
+        for column, value in fields.items()
+        if column in _HLS_METADATA_COLUMNS
+    }
+    if payload:
+        _set_runtime_progress(video_id, payload)
+
+
 def _set_runtime_progress(video_id, payload):
-    with HLS_RUNTIME_LOCK:
-        current = HLS_RUNTIME_PROGRESS.get(video_id, {})
-        current.update(payload)
-        HLS_RUNTIME_PROGRESS[video_id] = current
+    if progress_store.update(video_id, payload) is not None:
+        with HLS_CHANGE_CONDITION:
+            HLS_CHANGE_CONDITION.notify_all()
 
 
 def get_runtime_hls_progress(video_id):
-    with HLS_RUNTIME_LOCK:
-        item = HLS_RUNTIME_PROGRESS.get(video_id)
-        return dict(item) if item else None
+    return progress_store.read(video_id)
+
+
+def get_all_runtime_hls_progress():
+    return progress_store.read_all()
 
 
 def clear_runtime_hls_progress(video_id):
-    with HLS_RUNTIME_LOCK:
-        HLS_RUNTIME_PROGRESS.pop(video_id, None)
+    progress_store.clear(video_id)
 
 
 def _run_hls_encode(video_id, input_path, duration_seconds=0):
@@ -194,7 +280,7 @@ def _run_hls_encode(video_id, input_path, duration_seconds=0):
             hls_step="error",
             hls_error=str(exc),
         )
-        return
+        return "failed"
 
     last_progress = 0
 
@@ -205,7 +291,13 @@ def _run_hls_encode(video_id, input_path, duration_seconds=0):
                 continue
 
             key, value = line.split("=", 1)
-            if key == "out_time_ms":
+            if key == "speed" and value.endswith("x"):
+                with suppress(ValueError):
+                    metrics.set_encode_rates(video_id, speed=float(value[:-1]))
+            elif key == "fps":
+                with suppress(ValueError):
+                    metrics.set_encode_rates(video_id, fps=float(value))
+            elif key == "out_time_ms":
                 try:
                     out_seconds = int(value) / 1_000_000
                 except ValueError:
@@ -254,7 +346,7 @@ def _run_hls_encode(video_id, input_path, duration_seconds=0):
             hls_segments_generated=hls_state["segments_generated"],
             hls_segments_expected=hls_state["segments_expected"],
         )
-        return
+        return "complete"
 
     if return_code == 0:
         _set_runtime_progress(
@@ -277,7 +369,7 @@ def _run_hls_encode(video_id, input_path, duration_seconds=0):
             hls_segments_generated=hls_state["segments_generated"],
             hls_segments_expected=hls_state["segments_expected"],
         )
-        return
+        return "incomplete"
 
     _set_runtime_progress(
         video_id,
@@ -297,14 +389,27 @@ def _run_hls_encode(video_id, input_path, duration_seconds=0):
         hls_segments_generated=hls_state["segments_generated"],
         hls_segments_expected=hls_state["segments_expected"],
     )
+    return "failed"
 
 
 def _hls_worker_loop():
     while True:
         video_id, input_path, duration_seconds = HLS_JOB_QUEUE.get()
+        metrics.HLS_QUEUE_DEPTH.set(HLS_JOB_QUEUE.qsize())
+        metrics.HLS_ACTIVE_ENCODES.inc()
+        started = time.monotonic()
+        result = "failed"
         try:
-            _run_hls_encode(video_id, input_path, duration_seconds=duration_seconds)
+            result = _run_hls_encode(video_id, input_path, duration_seconds=duration_seconds)
         finally:
+            wall_seconds = time.monotonic() - started
+            metrics.HLS_ACTIVE_ENCODES.dec()
+            metrics.set_encode_rates(video_id)
+            metrics.HLS_ENCODES.labels(result).inc()
+            metrics.HLS_ENCODE_WALL_SECONDS.observe(wall_seconds)
+            if result == "complete" and duration_seconds and wall_seconds > 0:
+                metrics.HLS_ENCODE_MEDIA_SECONDS.inc(duration_seconds)
+                metrics.HLS_ENCODE_REALTIME_RATIO.observe(duration_seconds / wall_seconds)
             with HLS_QUEUE_LOCK:
                 HLS_QUEUED_VIDEO_IDS.discard(video_id)
             HLS_JOB_QUEUE.task_done()
@@ -361,3 +466,4 @@ def convert_to_hls(video_id, input_path, duration_seconds=0):
     )
 
     HLS_JOB_QUEUE.put((video_id, input_path, duration_seconds))
+    metrics.HLS_QUEUE_DEPTH.set(HLS_JOB_QUEUE.qsize())
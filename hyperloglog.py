@@ -0,0 +1,86 @@
+import math
+
+import numpy as np
+
+# 2**12 one-byte registers: 4 KiB per sketch, ~1.6% standard error.
+PRECISION = 12
+REGISTER_COUNT = 1 << PRECISION
+SKETCH_BYTES = REGISTER_COUNT
+_VALUE_BITS = 64 - PRECISION
+_VALUE_MASK = (1 << _VALUE_BITS) - 1
+_ALPHA = 0.7213 / (1 + 1.079 / REGISTER_COUNT)
+# 2 ** -register for every possible register value, so estimates are a lookup
+# and a row sum instead of a Python loop over 4096 registers.
+_INVERSE_POWERS = 2.0 ** -np.arange(_VALUE_BITS + 2, dtype=np.float64)
+
+
+def sketch_from_hashes(values):
+    """Sketch of uniformly distributed 64-bit hashes."""
+    hashes = np.fromiter(values, dtype=np.uint64)
+    registers = np.zeros(REGISTER_COUNT, dtype=np.uint8)
+    if hashes.size:
+        indexes = (hashes >> np.uint64(_VALUE_BITS)).astype(np.intp)
+        # Remainders are below 2**52, so float64 holds them exactly and
+        # frexp's exponent is their bit length (0 for 0).
+        _, bit_lengths = np.frexp((hashes & np.uint64(_VALUE_MASK)).astype(np.float64))
+        np.maximum.at(registers, indexes, (_VALUE_BITS + 1 - bit_lengths).astype(np.uint8))
+    return bytearray(registers.tobytes())
+
+
+def _coerce(sketch):
+    if sketch is None or len(sketch) != SKETCH_BYTES:
+        return None
+    return sketch
+
+
+def _registers(sketches):
+    """Stack valid sketches into a (len(sketches), REGISTER_COUNT) array."""
+    return np.frombuffer(b"".join(bytes(sketch) for sketch in sketches), dtype=np.uint8).reshape(
+        -1, REGISTER_COUNT
+    )
+
+
+def merge(left, right):
+    """Register-wise max of two sketches; either side may be NULL/invalid."""
+    left = _coerce(left)
+    right = _coerce(right)
+    if left is None:
+        return bytes(right) if right is not None else None
+    if right is None:
+        return bytes(left)
+    return merge_many([left], [right])[0]
+
+
+def merge_many(lefts, rights):
+    """Pairwise merge of two equally long lists of valid sketches."""
+    if not lefts:
+        return []
+    merged = np.maximum(_registers(lefts), _registers(rights))
+    return [row.tobytes() for row in merged]
+
+
+def estimate(sketch):
+    sketch = _coerce(sketch)
+    if sketch is None:
+        return 0
+    return estimate_many([sketch])[0]
+
+
+def estimate_many(sketches):
+    """Cardinality estimates for a list of valid sketches."""
+    if not sketches:
+        return []
+    registers = _registers(sketches)
+    harmonic = _INVERSE_POWERS[registers].sum(axis=1)
+    zeros = np.count_nonzero(registers == 0, axis=1)
+
+    estimates = []
+    for row_harmonic, row_zeros in zip(harmonic.tolist(), zeros.tolist()):
+        raw = _ALPHA * REGISTER_COUNT * REGISTER_COUNT / row_harmonic
+        if raw <= 2.5 * REGISTER_COUNT and row_zeros:
+            # Linear counting is more accurate while many registers are empty.
+            estimates.append(int(round(REGISTER_COUNT * math.log(REGISTER_COUNT / row_zeros))))
+        else:
+            estimates.append(int(round(raw)))
+    return estimates
+
@@ -0,0 +1,193 @@
+import glob
+import os
+import threading
+
+from settings import PROMETHEUS_MULTIPROC_DIR
+
+# prometheus_client decides at import time whether values live in per-process
+# mmap files under PROMETHEUS_MULTIPROC_DIR, which is what lets /metrics in any
+# gunicorn worker report host-wide totals, and each metric opens its file when
+# it is defined. So importing this module touches neither: _load() sets the
+# directory up and defines the metrics on first use. gunicorn.conf.py clears
+# the directory on master start and marks workers dead when they exit;
+# remove_dead_process_files() does the same for runs outside gunicorn.
+_LOAD_LOCK = threading.Lock()
+_prometheus = None
+
+
+def _define_metrics(prometheus_client):
+    HTTP_REQUEST_SECONDS = prometheus_client.Histogram(
+        "videoshare_http_request_duration_seconds",
+        "Request latency by route.",
+        ["endpoint", "method", "status"],
+        buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    )
+
+    HLS_QUEUE_DEPTH = prometheus_client.Gauge(
+        "videoshare_hls_queue_depth",
+        "Encodes waiting for an HLS worker.",
+        multiprocess_mode="livesum",
+    )
+    HLS_ACTIVE_ENCODES = prometheus_client.Gauge(
+        "videoshare_hls_active_encodes",
+        "ffmpeg HLS encodes currently running.",
+        multiprocess_mode="livesum",
+    )
+    HLS_ENCODE_SPEED = prometheus_client.Gauge(
+        "videoshare_hls_encode_speed_ratio",
+        "Sum of ffmpeg speed= (media seconds per wall second) over running encodes.",
+        multiprocess_mode="livesum",
+    )
+    HLS_ENCODE_FPS = prometheus_client.Gauge(
+        "videoshare_hls_encode_fps",
+        "Sum of ffmpeg fps= over running encodes.",
+        multiprocess_mode="livesum",
+    )
+    HLS_ENCODES = prometheus_client.Counter(
+        "videoshare_hls_encodes_total",
+        "Finished HLS encodes by outcome.",
+        ["result"],
+    )
+    HLS_ENCODE_WALL_SECONDS = prometheus_client.Histogram(
+        "videoshare_hls_encode_wall_seconds",
+        "Wall-clock time per HLS encode.",
+        buckets=(5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200),
+    )
+    HLS_ENCODE_REALTIME_RATIO = prometheus_client.Histogram(
+        "videoshare_hls_encode_realtime_ratio",
+        "Media duration divided by encode wall time, per completed encode.",
+        buckets=(0.25, 0.5, 1, 2, 4, 8, 16, 32, 64),
+    )
+    HLS_ENCODE_MEDIA_SECONDS = prometheus_client.Counter(
+        "videoshare_hls_encode_media_seconds_total",
+        "Media seconds of completed encodes.",
+    )
+
+    HLS_SERVED_BYTES = prometheus_client.Counter(
+        "videoshare_hls_served_bytes_total",
+        "Bytes sent by serve_hls.",
+    )
+    HLS_SERVED_REQUESTS = prometheus_client.Counter(
+        "videoshare_hls_requests_total",
+        "serve_hls requests by status code.",
+        ["status"],
+    )
+
+    PAGE_CACHE_REQUESTS = prometheus_client.Counter(
+        "videoshare_page_cache_requests_total",
+        "Anonymous page requests answered from the rendered-page cache (hit) or rendered (miss).",
+        ["result"],
+    )
+
+    ANALYTICS_BUFFERED_KEYS = prometheus_client.Gauge(
+        "videoshare_analytics_buffered_keys",
+        "Distinct keys in each analytics buffer when it was last snapshotted.",
+        ["buffer"],
+        multiprocess_mode="livesum",
+    )
+    ANALYTICS_FLUSH_SECONDS = prometheus_client.Histogram(
+        "videoshare_analytics_flush_seconds",
+        "Time to write one analytics snapshot to SQLite.",
+        buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    )
+    ANALYTICS_FLUSH_ERRORS = prometheus_client.Counter(
+        "videoshare_analytics_flush_errors_total",
+        "Analytics snapshots that failed to write.",
+    )
+    ANALYTICS_ROWS_WRITTEN = prometheus_client.Counter(
+        "videoshare_analytics_rows_written_total",
+        "Analytics rows upserted by flushes.",
+        ["table"],
+    )
+    ANALYTICS_DROPPED_EVENTS = prometheus_client.Counter(
+        "videoshare_analytics_dropped_events_total",
+        "Analytics events dropped because their buffer was full.",
+        ["buffer"],
+    )
+
+    SQLITE_BUSY_RETRIES = prometheus_client.Counter(
+        "videoshare_sqlite_busy_retries_total",
+        "SQLite 'database is locked' errors that were retried.",
+        ["site"],
+    )
+    SQLITE_BUSY_FAILURES = prometheus_client.Counter(
+        "videoshare_sqlite_busy_failures_total",
+        "SQLite 'database is locked' errors that exhausted their retries.",
+        ["site"],
+    )
+
+    return {name: value for name, value in locals().items() if name.isupper()}
+
+
+def _load():
+    global _prometheus
+
+    with _LOAD_LOCK:
+        if _prometheus is None:
+            multiproc_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", PROMETHEUS_MULTIPROC_DIR)
+            os.makedirs(multiproc_dir, exist_ok=True)
+            import prometheus_client
+            import prometheus_client.multiprocess
+
+            globals().update(_define_metrics(prometheus_client))
+            _prometheus = prometheus_client
+    return _prometheus
+
+
+def __getattr__(name):
+    if name.isupper():
+        _load()
+        if name in globals():
+            return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def remove_dead_process_files():
+    """Delete metric files of processes that are no longer running.
+
+    Only for single-process runs (python app.py, scripts): there every other
+    pid's files are left over from an earlier run and would be summed into
+    /metrics. Under gunicorn, dead workers' counters are meant to keep counting.
+    """
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR", PROMETHEUS_MULTIPROC_DIR)
+    for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+        pid = os.path.basename(path)[: -len(".db")].rpartition("_")[2]
+        if pid.isdigit() and not _process_alive(int(pid)):
+            os.remove(path)
+
+
+_ENCODE_RATES = {}
+_ENCODE_RATES_LOCK = threading.Lock()
+
+
+def set_encode_rates(video_id, speed=None, fps=None):
+    """Record a running encode's latest ffmpeg speed/fps; None clears it."""
+    _load()
+    with _ENCODE_RATES_LOCK:
+        if speed is None and fps is None:
+            _ENCODE_RATES.pop(video_id, None)
+        else:
+            current = _ENCODE_RATES.setdefault(video_id, [0.0, 0.0])
+            if speed is not None:
+                current[0] = speed
+            if fps is not None:
+                current[1] = fps
+        HLS_ENCODE_SPEED.set(sum(rate[0] for rate in _ENCODE_RATES.values()))
+        HLS_ENCODE_FPS.set(sum(rate[1] for rate in _ENCODE_RATES.values()))
+
+
+def render_metrics():
+    prometheus_client = _load()
+    registry = prometheus_client.CollectorRegistry()
+    prometheus_client.multiprocess.MultiProcessCollector(registry)
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
@@ -0,0 +1,99 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import make_response, request, session
+
+import metrics
+from db import get_content_generation, get_db
+from settings import PAGE_CACHE_MAX_BYTES
+
+# Rendered anonymous pages, least recently used first:
+# (path, ?v=, ?after=, ?start=) -> (content generation, body, etag).
+# Admin views carry editing forms and live HLS state, so they always render.
+_CACHE = OrderedDict()
+_CACHE_BYTES = 0
+_CACHE_LOCK = threading.Lock()
+
+
+def _cache_key():
+    args = request.args
+    return (request.path, args.get("v"), args.get("after"), args.get("start"))
+
+
+def _lookup(key, generation):
+    with _CACHE_LOCK:
+        entry = _CACHE.get(key)
+        if entry is None or entry[0] != generation:
+            return None
+        _CACHE.move_to_end(key)
+        return entry
+
+
+def _store(key, generation, body, etag):
+    global _CACHE_BYTES
+
+    if len(body) > PAGE_CACHE_MAX_BYTES // 4:
+        return
+    with _CACHE_LOCK:
+        previous = _CACHE.pop(key, None)
+        if previous is not None:
+            _CACHE_BYTES -= len(previous[1])
+        _CACHE[key] = (generation, body, etag)
+        _CACHE_BYTES += len(body)
+        while _CACHE_BYTES > PAGE_CACHE_MAX_BYTES:
+            _, evicted = _CACHE.popitem(last=False)
+            _CACHE_BYTES -= len(evicted[1])
+
+
+def clear():
+    global _CACHE_BYTES
+
+    with _CACHE_LOCK:
+        _CACHE.clear()
+        _CACHE_BYTES = 0
+
+
+def _finish(response, etag, result):
+    metrics.PAGE_CACHE_REQUESTS.labels(result).inc()
+    response.set_etag(etag)
+    # Revalidate every time; unchanged pages cost a 304 and no render.
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Page-Cache"] = result
+    return response.make_conditional(request)
+
+
+def cached_page(view):
+    """Serve anonymous GETs of ``view`` from the rendered-page cache."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not PAGE_CACHE_MAX_BYTES or request.method != "GET" or session.get("admin_logged_in"):
+            return view(*args, **kwargs)
+
+        # Read before rendering: an edit committed mid-render leaves the entry
+        # tagged with the older generation, so it is re-rendered next time.
+        conn = get_db()
+        try:
+            generation = get_content_generation(conn)
+        finally:
+            conn.close()
+
+        key = _cache_key()
+        entry = _lookup(key, generation)
+        if entry is not None:
+            response = make_response(entry[1])
+            response.mimetype = "text/html"
+            return _finish(response, entry[2], "hit")
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200 or response.direct_passthrough or response.mimetype != "text/html":
+            return response
+
+        body = response.get_data()
+        etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        _store(key, generation, body, etag)
+        return _finish(response, etag, "miss")
+
+    return wrapper
@@ -0,0 +1,288 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from settings import PROFILE_DIR, PROFILING_ENABLED, SLOW_REQUEST_LOG, SLOW_REQUEST_MS
+
+logger = logging.getLogger(__name__)
+
+# Per-request counters, set by ProfilingMiddleware for the thread serving the
+# request and None everywhere else (background flushers, encodes, startup).
+_REQUEST = threading.local()
+
+# Audit events that touch the filesystem. stat()/exists() raise no audit
+# event, so those are not counted.
+_FS_AUDIT_EVENTS = frozenset({
+    "open",
+    "os.listdir",
+    "os.scandir",
+    "os.mkdir",
+    "os.remove",
+    "os.rename",
+    "os.rmdir",
+    "os.truncate",
+    "os.utime",
+    "os.chmod",
+    "shutil.copyfile",
+    "shutil.rmtree",
+})
+
+# Admins set the sampling rate from /admin/profiling; it is stored in a file
+# so every worker picks it up, re-read at most once per second.
+SAMPLING_FILE = os.path.join(PROFILE_DIR, "sampling_rate")
+_SAMPLING_CHECK_SECONDS = 1.0
+_sampling_rate = 0.0
+_sampling_checked_at = 0.0
+
+_slow_logger = None
+_slow_logger_lock = threading.Lock()
+
+# The audit hook and template signals are process-wide, so they are set up
+# once however many apps create_app() builds.
+_INSTALLED = False
+_INSTALL_LOCK = threading.Lock()
+
+# Only one cProfile profiler can be active per process (enabling a second one
+# raises ValueError on Python 3.12+), so a sampled request that finds another
+# being profiled runs unprofiled.
+_PROFILER_LOCK = threading.Lock()
+
+
+def _stats():
+    return getattr(_REQUEST, "stats", None)
+
+
+def _audit_hook(event, args):
+    if event in _FS_AUDIT_EVENTS:
+        stats = getattr(_REQUEST, "stats", None)
+        if stats is not None:
+            stats["fs_calls"] += 1
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    def execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            _record_sql(started)
+
+    def executemany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            _record_sql(started)
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """Connection that charges statement count and time to the current request."""
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            _record_sql(started)
+
+    def executemany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            _record_sql(started)
+
+
+def _record_sql(started):
+    stats = _stats()
+    if stats is not None:
+        stats["sql_count"] += 1
+        stats["sql_ms"] += (time.perf_counter() - started) * 1000
+
+
+def _template_started(sender, template, context, **extra):
+    stats = _stats()
+    if stats is not None:
+        stats["_template_started"].append(time.perf_counter())
+
+
+def _template_rendered(sender, template, context, **extra):
+    stats = _stats()
+    if stats is not None and stats["_template_started"]:
+        stats["template_ms"] += (time.perf_counter() - stats["_template_started"].pop()) * 1000
+
+
+def get_sampling_rate():
+    global _sampling_rate, _sampling_checked_at
+
+    now = time.monotonic()
+    if now - _sampling_checked_at >= _SAMPLING_CHECK_SECONDS:
+        _sampling_checked_at = now
+        try:
+            with open(SAMPLING_FILE, "r", encoding="utf-8") as handle:
+                _sampling_rate = min(1.0, max(0.0, float(handle.read().strip() or 0)))
+        except (OSError, ValueError):
+            _sampling_rate = 0.0
+    return _sampling_rate
+
+
+def set_sampling_rate(rate):
+    global _sampling_checked_at
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    temp_path = f"{SAMPLING_FILE}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as handle:
+        handle.write(str(min(1.0, max(0.0, float(rate)))))
+    os.replace(temp_path, SAMPLING_FILE)
+    _sampling_checked_at = 0.0
+
+
+def list_profiles(limit=50):
+    try:
+        names = [name for name in os.listdir(PROFILE_DIR) if name.endswith(".pstats")]
+    except OSError:
+        return []
+    return sorted(names, reverse=True)[:limit]
+
+
+def _slow_log():
+    global _slow_logger
+
+    if _slow_logger is None:
+        with _slow_logger_lock:
+            if _slow_logger is None:
+                os.makedirs(os.path.dirname(SLOW_REQUEST_LOG) or ".", exist_ok=True)
+                slow_logger = logging.getLogger("videoshare.slow_requests")
+                slow_logger.propagate = False
+                slow_logger.setLevel(logging.INFO)
+                slow_logger.addHandler(logging.FileHandler(SLOW_REQUEST_LOG, encoding="utf-8"))
+                _slow_logger = slow_logger
+    return _slow_logger
+
+
+def _profile_path(environ):
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", environ.get("PATH_INFO", "")).strip("-")[:60] or "root"
+    now = time.time()
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(now)) + f"{int(now * 1000) % 1000:03d}"
+    return os.path.join(PROFILE_DIR, f"{stamp}-{os.getpid()}-{environ.get('REQUEST_METHOD', 'GET')}-{slug}.pstats")
+
+
+class ProfilingMiddleware:
+    """Per-request wall, SQL, template and filesystem accounting.
+
+    Requests slower than SLOW_REQUEST_MS are appended to SLOW_REQUEST_LOG as
+    JSON lines; a sampled fraction of requests also runs under cProfile with
+    the stats dumped to PROFILE_DIR. Timing covers the application call, not
+    the streaming of its response body.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        stats = {
+            "sql_count": 0,
+            "sql_ms": 0.0,
+            "template_ms": 0.0,
+            "fs_calls": 0,
+            "_template_started": [],
+        }
+        status_holder = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            status_holder.append(status)
+            return start_response(status, headers, exc_info)
+
+        profiler = None
+        rate = get_sampling_rate()
+        if rate and random.random() < rate and _PROFILER_LOCK.acquire(blocking=False):
+            profiler = cProfile.Profile()
+
+        _REQUEST.stats = stats
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # Some other tool holds the profiling hook.
+                    profiler = None
+                    _PROFILER_LOCK.release()
+            try:
+                return self.app(environ, capture_start_response)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                    _PROFILER_LOCK.release()
+        finally:
+            wall_ms = (time.perf_counter() - started) * 1000
+            _REQUEST.stats = None
+            environ["videoshare.request_stats"] = stats
+            if profiler is not None:
+                self._dump_profile(profiler, environ)
+            if wall_ms >= SLOW_REQUEST_MS:
+                self._log_slow(environ, status_holder, wall_ms, stats)
+
+    @staticmethod
+    def _dump_profile(profiler, environ):
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(_profile_path(environ))
+        except OSError:
+            logger.exception("could not write request profile")
+
+    @staticmethod
+    def _log_slow(environ, status_holder, wall_ms, stats):
+        entry = {
+            "at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "method": environ.get("REQUEST_METHOD"),
+            "path": environ.get("PATH_INFO"),
+            "query": environ.get("QUERY_STRING") or None,
+            "status": status_holder[0].split(" ", 1)[0] if status_holder else None,
+            "wall_ms": round(wall_ms, 1),
+            "sql_count": stats["sql_count"],
+            "sql_ms": round(stats["sql_ms"], 1),
+            "template_ms": round(stats["template_ms"], 1),
+            "fs_calls": stats["fs_calls"],
+            "pid": os.getpid(),
+        }
+        try:
+            _slow_log().info(json.dumps(entry, separators=(",", ":")))
+        except OSError:
+            logger.exception("could not write slow request log")
+
+
+def _install_hooks():
+    global _INSTALLED
+
+    with _INSTALL_LOCK:
+        if _INSTALLED:
+            return
+
+        from flask import before_render_template, template_rendered
+
+        # Connected for every app; the receivers are no-ops outside requests.
+        before_render_template.connect(_template_started)
+        template_rendered.connect(_template_rendered)
+        # Audit hooks cannot be removed; _audit_hook is a no-op outside requests.
+        sys.addaudithook(_audit_hook)
+        _INSTALLED = True
+
+
+def install(app):
+    """Wrap ``app`` (a Flask app) with ProfilingMiddleware if enabled."""
+    if not PROFILING_ENABLED:
+        return
+
+    _install_hooks()
+    app.wsgi_app = ProfilingMiddleware(app.wsgi_app)
@@ -0,0 +1,322 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from settings import STORAGE_ROOT
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Live HLS progress shared by every worker on the host: a small mmap'd file of
+# fixed-size slots, one per video being (or recently) encoded. Writers
+# serialize on an flock of the file; readers never lock and instead retry on a
+# per-slot seqlock (the version is odd while a write is in progress).
+#
+# A writer killed mid-update leaves its slot's version odd. Readers give up
+# waiting once the owner pid is gone (or after STALE_SLOT_SECONDS) and treat
+# the slot as empty; the next write there, or the next process to open the
+# file, puts it back in order.
+#
+# Without fcntl the same layout lives in a process-local bytearray.
+
+STORE_PATH = os.path.join(STORAGE_ROOT, ".hls_progress.mmap")
+SLOT_COUNT = 512
+STALE_SLOT_SECONDS = 0.1
+_SPIN_READS = 100
+
+_MAGIC = b"HLSPROG1"
+# magic, store id, change sequence, highest change sequence ever evicted
+_HEADER = struct.Struct("<8s8sQQ")
+_HEADER_SIZE = 64
+# version, change sequence, owner pid, present-field mask, progress_pct,
+# segments_generated, segments_expected, video_id, status, step, error
+_ERROR_BYTES = 224
+_SLOT = struct.Struct(f"<QQIIiii64s16s32s{_ERROR_BYTES}s")
+_SLOT_SIZE = 384
+assert _SLOT.size <= _SLOT_SIZE
+
+INT_FIELDS = ("progress_pct", "segments_generated", "segments_expected")
+TEXT_FIELDS = ("status", "step", "error")
+_FIELD_BITS = {name: 1 << index for index, name in enumerate(INT_FIELDS + TEXT_FIELDS)}
+
+_LOCK = threading.Lock()
+_BUFFER = None
+_FD = None
+_SLOT_INDEX = {}
+
+
+def _init_buffer():
+    global _BUFFER, _FD
+
+    size = _HEADER_SIZE + SLOT_COUNT * _SLOT_SIZE
+    if fcntl is None:
+        _BUFFER = bytearray(size)
+        _HEADER.pack_into(_BUFFER, 0, _MAGIC, os.urandom(8), 0, 0)
+        return
+
+    os.makedirs(STORAGE_ROOT, exist_ok=True)
+    fd = os.open(STORE_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        valid = os.fstat(fd).st_size == size and os.pread(fd, len(_MAGIC), 0) == _MAGIC
+        if not valid:
+            os.ftruncate(fd, 0)
+            os.ftruncate(fd, size)
+            os.pwrite(fd, _HEADER.pack(_MAGIC, os.urandom(8), 0, 0), 0)
+        else:
+            _reset_torn_slots(fd)
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    _BUFFER = mmap.mmap(fd, size)
+    _FD = fd
+
+
+def _reset_torn_slots(fd):
+    # Caller holds the flock, so no live writer is mid-update: any odd
+    # version was left by a writer that died.
+    for index in range(SLOT_COUNT):
+        offset = _slot_offset(index)
+        (version,) = struct.unpack("<Q", os.pread(fd, 8, offset))
+        if version % 2:
+            os.pwrite(fd, struct.pack("<Q", version + 1) + bytes(_SLOT_SIZE - 8), offset)
+
+
+def _buffer():
+    if _BUFFER is None:
+        with _LOCK:
+            if _BUFFER is None:
+                _init_buffer()
+    return _BUFFER
+
+
+@contextmanager
+def _write_lock():
+    buffer = _buffer()
+    with _LOCK:
+        if _FD is not None:
+            fcntl.flock(_FD, fcntl.LOCK_EX)
+        try:
+            yield buffer
+        finally:
+            if _FD is not None:
+                fcntl.flock(_FD, fcntl.LOCK_UN)
+
+
+def _slot_offset(index):
+    return _HEADER_SIZE + index * _SLOT_SIZE
+
+
+def _decode(raw):
+    return raw.rstrip(b"\0").decode("utf-8", errors="replace")
+
+
+def _read_slot(buffer, index):
+    """Consistent copy of one slot, retrying while a writer holds it.
+
+    A slot torn by a dead writer reads as empty, with its version rounded up
+    to even so the next writer there restores the seqlock.
+    """
+    offset = _slot_offset(index)
+    attempts = 0
+    deadline = None
+    while True:
+        values = _SLOT.unpack_from(buffer, offset)
+        if not values[0] % 2:
+            if struct.unpack_from("<Q", buffer, offset)[0] == values[0]:
+                return values
+            continue
+
+        attempts += 1
+        if attempts < _SPIN_READS:
+            continue
+        if deadline is None:
+            deadline = time.monotonic() + STALE_SLOT_SECONDS
+        if not _pid_alive(values[2]) or time.monotonic() >= deadline:
+            return (values[0] + 1, 0, 0, 0, 0, 0, 0, b"", b"", b"", b"")
+        time.sleep(0.001)
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _slot_state(values):
+    _, _, pid, mask, progress_pct, generated, expected, _, status, step, error = values
+    state = {}
+    ints = dict(zip(INT_FIELDS, (progress_pct, generated, expected)))
+    texts = dict(zip(TEXT_FIELDS, (status, step, error)))
+    for name, value in ints.items():
+        if mask & _FIELD_BITS[name]:
+            state[name] = value
+    for name, value in texts.items():
+        if mask & _FIELD_BITS[name]:
+            state[name] = _decode(value)
+    # An encode whose process died will never finish; don't report it live.
+    if state.get("status") == "processing" and not _pid_alive(pid):
+        return None
+    return state
+
+
+def _find_slot(buffer, video_id):
+    encoded = video_id.encode("utf-8")[:64]
+    index = _SLOT_INDEX.get(video_id)
+    if index is not None and _read_slot(buffer, index)[7].rstrip(b"\0") == encoded:
+        return index
+
+    for index in range(SLOT_COUNT):
+        if _read_slot(buffer, index)[7].rstrip(b"\0") == encoded:
+            _SLOT_INDEX[video_id] = index
+            return index
+    return None
+
+
+def _allocate_slot(buffer):
+    """Caller holds the write lock. Free slot, else the least recently changed
+    one that is not mid-encode, else the least recently changed."""
+    candidates = []
+    for index in range(SLOT_COUNT):
+        values = _read_slot(buffer, index)
+        if not values[7].strip(b"\0"):
+            return index
+        state = _slot_state(values)
+        busy = bool(state) and state.get("status") == "processing"
+        candidates.append((busy, values[1], index))
+
+    _, evicted_sequence, index = min(candidates)
+    magic, store_id, sequence, previous = _HEADER.unpack_from(buffer, 0)
+    _HEADER.pack_into(buffer, 0, magic, store_id, sequence, max(previous, evicted_sequence))
+    return index
+
+
+def store_id():
+    return _HEADER.unpack_from(_buffer(), 0)[1].hex()
+
+
+def current_sequence():
+    return _HEADER.unpack_from(_buffer(), 0)[2]
+
+
+def evicted_sequence():
+    return _HEADER.unpack_from(_buffer(), 0)[3]
+
+
+def update(video_id, fields):
+    """Merge ``fields`` into ``video_id``'s slot. Returns the change sequence,
+    or None if nothing changed."""
+    with _write_lock() as buffer:
+        index = _find_slot(buffer, video_id)
+        if index is None:
+            index = _allocate_slot(buffer)
+            version = _read_slot(buffer, index)[0]
+            values = (version, 0, 0, 0, 0, 0, 0, b"", b"", b"", b"")
+            current = {}
+        else:
+            values = _read_slot(buffer, index)
+            current = _slot_state(values)
+            if current is not None and all(current.get(key) == value for key, value in fields.items() if key in _FIELD_BITS):
+                return None
+            current = current or {}
+
+        version, _, _, mask, progress_pct, generated, expected, _, status, step, error = values
+        if not current:
+            # Fresh slot, or the previous owner died mid-encode: start clean.
+            mask, progress_pct, generated, expected, status, step, error = 0, 0, 0, 0, b"", b"", b""
+
+        ints = dict(zip(INT_FIELDS, (progress_pct, generated, expected)))
+        texts = dict(zip(TEXT_FIELDS, (status, step, error)))
+        for key, value in fields.items():
+            if key in ints:
+                ints[key] = int(value or 0)
+            elif key in texts:
+                limit = _ERROR_BYTES if key == "error" else (16 if key == "status" else 32)
+                texts[key] = str(value or "").encode("utf-8")[:limit]
+            else:
+                continue
+            mask |= _FIELD_BITS[key]
+
+        magic, identity, sequence, evicted = _HEADER.unpack_from(buffer, 0)
+        sequence += 1
+        offset = _slot_offset(index)
+        struct.pack_into("<Q", buffer, offset, version + 1)
+        _SLOT.pack_into(
+            buffer,
+            offset,
+            version + 1,
+            sequence,
+            os.getpid(),
+            mask,
+            ints["progress_pct"],
+            ints["segments_generated"],
+            ints["segments_expected"],
+            video_id.encode("utf-8")[:64],
+            texts["status"],
+            texts["step"],
+            texts["error"],
+        )
+        struct.pack_into("<Q", buffer, offset, version + 2)
+        _HEADER.pack_into(buffer, 0, magic, identity, sequence, evicted)
+        _SLOT_INDEX[video_id] = index
+        return sequence
+
+
+def read(video_id):
+    buffer = _buffer()
+    index = _find_slot(buffer, video_id)
+    if index is None:
+        return None
+    return _slot_state(_read_slot(buffer, index))
+
+
+def read_all():
+    """{video_id: state} for every live slot, in one pass over the store."""
+    buffer = _buffer()
+    states = {}
+    for index in range(SLOT_COUNT):
+        values = _read_slot(buffer, index)
+        if not values[7].strip(b"\0"):
+            continue
+        state = _slot_state(values)
+        if state is not None:
+            states[_decode(values[7])] = state
+    return states
+
+
+def clear(video_id):
+    with _write_lock() as buffer:
+        index = _find_slot(buffer, video_id)
+        if index is None:
+            return
+        offset = _slot_offset(index)
+        version = _read_slot(buffer, index)[0]
+        struct.pack_into("<Q", buffer, offset, version + 1)
+        buffer[offset + 8:offset + _SLOT_SIZE] = bytes(_SLOT_SIZE - 8)
+        struct.pack_into("<Q", buffer, offset, version + 2)
+        _SLOT_INDEX.pop(video_id, None)
+
+
+def changes_since(sequence):
+    """(video_id, change sequence, state) for every slot written after ``sequence``."""
+    buffer = _buffer()
+    changes = []
+    for index in range(SLOT_COUNT):
+        values = _read_slot(buffer, index)
+        if values[1] <= sequence or not values[7].strip(b"\0"):
+            continue
+        state = _slot_state(values)
+        if state is not None:
+            changes.append((_decode(values[7]), values[1], state))
+    changes.sort(key=lambda change: change[1])
+    return changes
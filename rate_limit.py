@@ -0,0 +1,37 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Per-process token buckets keyed by client. Each gunicorn worker keeps its
+# own buckets, so the effective host-wide limit scales with the worker count.
+MAX_TRACKED_CLIENTS = 50000
+
+_BUCKETS = OrderedDict()
+_LOCK = threading.Lock()
+
+
+def consume(client_key, cost, rate_per_second, burst):
+    """Take ``cost`` tokens from ``client_key``'s bucket.
+
+    Returns 0 if allowed, otherwise the seconds until enough tokens refill.
+    A cost larger than ``burst`` can never be satisfied and is refused outright.
+    """
+    now = time.monotonic()
+    with _LOCK:
+        tokens, updated = _BUCKETS.get(client_key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate_per_second)
+
+        if cost > tokens:
+            _BUCKETS[client_key] = (tokens, now)
+            _BUCKETS.move_to_end(client_key)
+            if cost > burst:
+                return float("inf")
+            return (cost - tokens) / rate_per_second
+
+        _BUCKETS[client_key] = (tokens - cost, now)
+        _BUCKETS.move_to_end(client_key)
+        # Least recently seen clients are dropped first; they come back with
+        # a full bucket, which is what an idle client would have anyway.
+        while len(_BUCKETS) > MAX_TRACKED_CLIENTS:
+            _BUCKETS.popitem(last=False)
+    return 0
@@ -1,41 +1,54 @@
+import json
+import logging
 import os
 import sqlite3
+import threading
+import time
 import uuid
 
-from flask import Blueprint, abort, jsonify, redirect, render_template, request, url_for
+from flask import Blueprint, Response, abort, jsonify, redirect, render_template, request, url_for
 from werkzeug.utils import secure_filename
 
-from analytics import get_analytics_dashboard
-from db import get_collection_parent_options, get_db
+from analytics import DASHBOARD_RANGES, get_analytics_dashboard, get_flush_stats
+from analytics_retention import get_retention_curve
+from db import (
+    bump_content_generation,
+    get_collection_parent_options,
+    get_db,
+    get_descendant_ids,
+    insert_collection,
+    update_collection,
+)
 from decorators import admin_required
 from hls_utils import (
     convert_to_hls,
-    get_runtime_hls_progress,
+    current_hls_event_sequence,
+    get_all_runtime_hls_progress,
+    hls_event_stream_id,
     inspect_hls_state,
     probe_duration_seconds,
+    wait_for_hls_changes,
+)
+from profiling import get_sampling_rate, list_profiles, set_sampling_rate
+from settings import (
+    HLS_SSE_MAX_STREAM_SECONDS,
+    HLS_SSE_MAX_STREAMS,
+    PROFILING_ENABLED,
+    SLOW_REQUEST_LOG,
+    SLOW_REQUEST_MS,
+    UPLOAD_FOLDER,
 )
-from settings import UPLOAD_FOLDER
+
+logger = logging.getLogger(__name__)
 
 admin_bp = Blueprint("admin", __name__)
 ALLOWED_VISIBILITY = {"public", "unlisted", "private"}
+HLS_SSE_HEARTBEAT_SECONDS = 15
+HLS_SSE_RETRY_MS = 3000
 
-
-def get_descendant_ids(conn, root_id):
-    rows = conn.execute("SELECT id, parent_id FROM collections").fetchall()
-    by_parent = {}
-    for row in rows:
-        by_parent.setdefault(row["parent_id"], []).append(row["id"])
-
-    descendants = set()
-    stack = [root_id]
-    while stack:
-        current = stack.pop()
-        for child_id in by_parent.get(current, []):
-            if child_id not in descendants:
-                descendants.add(child_id)
-                stack.append(child_id)
-
-    return descendants
+# Open SSE streams in this worker; each one holds a request thread.
+_SSE_STREAMS = 0
+_SSE_STREAMS_LOCK = threading.Lock()
 
 
 @admin_bp.route("/admin")
@@ -44,21 +57,59 @@ def admin_panel():
     conn = get_db()
     collections = get_collection_parent_options(conn)
     conn.close()
-    return render_template("admin_panel.html", collections=collections)
+    return render_template(
+        "admin_panel.html",
+        collections=collections,
+        profiling_enabled=PROFILING_ENABLED,
+        profile_sample_rate=get_sampling_rate(),
+        profiles=list_profiles(limit=20),
+        slow_request_ms=SLOW_REQUEST_MS,
+        slow_request_log=SLOW_REQUEST_LOG,
+    )
+
+
+@admin_bp.route("/admin/profiling", methods=["POST"])
+@admin_required
+def update_profiling():
+    if not PROFILING_ENABLED:
+        abort(404)
+    try:
+        percent = float(request.form.get("sample_percent") or 0)
+    except ValueError:
+        abort(400)
+    set_sampling_rate(percent / 100)
+    return redirect(url_for("admin.admin_panel"))
 
 
 @admin_bp.route("/admin/analytics")
 @admin_required
 def analytics_panel():
-    dashboard = get_analytics_dashboard(limit=30)
+    range_key = request.args.get("range") or "all"
+    if range_key not in DASHBOARD_RANGES:
+        range_key = "all"
+
+    dashboard = get_analytics_dashboard(limit=30, range_key=range_key)
     return render_template(
         "admin_analytics.html",
+        range_key=range_key,
+        range_options=list(DASHBOARD_RANGES),
+        daily_totals=dashboard["daily_totals"],
         top_pages=dashboard["top_pages"],
         top_videos=dashboard["top_videos"],
         top_segments=dashboard["top_segments"],
+        flush_stats=get_flush_stats(),
     )
 
 
+@admin_bp.route("/admin/analytics/retention/<video_id>")
+@admin_required
+def analytics_retention(video_id):
+    curve = get_retention_curve(video_id)
+    if curve is None:
+        abort(404)
+    return jsonify(curve)
+
+
 @admin_bp.route("/create_collection", methods=["GET", "POST"])
 @admin_required
 def create_collection():
@@ -76,10 +127,14 @@ def create_collection():
         collection_id = str(uuid.uuid4())
 
         conn = get_db()
-        conn.execute(
-            "INSERT INTO collections (id, name, slug, parent_id, visibility) VALUES (?, ?, ?, ?, ?)",
-            (collection_id, name, slug, parent_id, visibility),
-        )
+        if parent_id and not conn.execute(
+            "SELECT 1 FROM collections WHERE id = ?", (parent_id,)
+        ).fetchone():
+            conn.close()
+            abort(400)
+
+        insert_collection(conn, collection_id, name, slug, parent_id, visibility)
+        bump_content_generation(conn)
         conn.commit()
         conn.close()
         return redirect(url_for("admin.admin_panel"))
@@ -135,14 +190,12 @@ def update_collection_settings(collection_id):
             abort(400)
 
     try:
-        conn.execute(
-            "UPDATE collections SET name = ?, slug = ?, parent_id = ?, visibility = ? WHERE id = ?",
-            (updated_name, updated_slug, parent_id, visibility, collection_id),
-        )
+        update_collection(conn, collection_id, updated_name, updated_slug, parent_id, visibility)
     except sqlite3.IntegrityError:
         conn.close()
         abort(400)
 
+    bump_content_generation(conn)
     conn.commit()
     conn.close()
 
@@ -211,6 +264,7 @@ def upload():
                 collection_id,
             ),
         )
+        bump_content_generation(conn)
         conn.commit()
         conn.close()
 
@@ -233,10 +287,13 @@ def update_playlist(collection_id):
 
     conn = get_db()
     videos = conn.execute(
-        "SELECT id, filename, display_name, description, visibility, sort_order, hls_status, hls_segments_generated, hls_segments_expected FROM videos WHERE collection_id = ?",
+        "SELECT id, filename, display_name, description, visibility, sort_order FROM videos WHERE collection_id = ?",
         (collection_id,),
     ).fetchall()
 
+    # Group rows by the exact set of columns that changed so each group is a
+    # single executemany; untouched rows and rows absent from the form are skipped.
+    updates_by_fields = {}
     for video in videos:
         video_id = video["id"]
         name_key = f"title_{video_id}"
@@ -244,6 +301,9 @@ def update_playlist(collection_id):
         visibility_key = f"visibility_{video_id}"
         order_key = f"order_{video_id}"
 
+        if not any(key in request.form for key in (name_key, description_key, visibility_key, order_key)):
+            continue
+
         updated_name = (request.form.get(name_key) or "").strip()
         if not updated_name:
             updated_name = video["filename"]
@@ -259,20 +319,49 @@ def update_playlist(collection_id):
         except ValueError:
             updated_order = video["sort_order"] or 0
 
-        conn.execute(
-            "UPDATE videos SET display_name = ?, description = ?, visibility = ?, sort_order = ? WHERE id = ? AND collection_id = ?",
-            (updated_name, updated_description, updated_visibility, updated_order, video_id, collection_id),
+        changes = {}
+        if updated_name != video["display_name"]:
+            changes["display_name"] = updated_name
+        if updated_description != (video["description"] or ""):
+            changes["description"] = updated_description
+        if updated_visibility != video["visibility"]:
+            changes["visibility"] = updated_visibility
+        if updated_order != video["sort_order"]:
+            changes["sort_order"] = updated_order
+
+        if changes:
+            fields = tuple(sorted(changes))
+            updates_by_fields.setdefault(fields, []).append(
+                (*(changes[field] for field in fields), video_id, collection_id)
+            )
+
+    rows_updated = 0
+    for fields, params in updates_by_fields.items():
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        conn.executemany(
+            f"UPDATE videos SET {assignments} WHERE id = ? AND collection_id = ?",
+            params,
         )
+        rows_updated += len(params)
 
+    if rows_updated:
+        bump_content_generation(conn)
     conn.commit()
     conn.close()
 
-    return redirect(return_path)
+    logger.info(
+        "playlist %s saved: %d of %d rows updated",
+        collection_id,
+        rows_updated,
+        len(videos),
+    )
 
+    response = redirect(return_path)
+    response.headers["X-Rows-Updated"] = str(rows_updated)
+    return response
 
-@admin_bp.route("/admin/hls_progress/<collection_id>")
-@admin_required
-def hls_progress(collection_id):
+
+def _collection_hls_progress(collection_id):
     conn = get_db()
     videos = conn.execute(
         """
@@ -285,9 +374,10 @@ def hls_progress(collection_id):
     ).fetchall()
     conn.close()
 
+    runtime_progress = get_all_runtime_hls_progress()
     result = []
     for row in videos:
-        runtime = get_runtime_hls_progress(row["id"])
+        runtime = runtime_progress.get(row["id"])
         if runtime:
             status = runtime.get("status") or row["hls_status"]
             progress_pct = int(runtime.get("progress_pct") or 0)
@@ -315,4 +405,136 @@ def hls_progress(collection_id):
             }
         )
 
-    return jsonify({"videos": result})
+    return result
+
+
+@admin_bp.route("/admin/hls_progress/<collection_id>")
+@admin_required
+def hls_progress(collection_id):
+    return jsonify({"videos": _collection_hls_progress(collection_id)})
+
+
+def _sse_message(event, data, event_id):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def _parse_hls_event_id(raw, stream_id):
+    # Ids are "<store id>:<sequence>". Sequences are shared by every worker on
+    # the host, but one from a since-recreated progress store forces a snapshot.
+    event_stream_id, _, sequence = (raw or "").rpartition(":")
+    if event_stream_id != stream_id or not sequence.isdigit():
+        return None
+    return int(sequence)
+
+
+def _acquire_sse_stream():
+    global _SSE_STREAMS
+
+    with _SSE_STREAMS_LOCK:
+        if _SSE_STREAMS >= HLS_SSE_MAX_STREAMS:
+            return False
+        _SSE_STREAMS += 1
+        return True
+
+
+def _release_sse_stream():
+    global _SSE_STREAMS
+
+    with _SSE_STREAMS_LOCK:
+        _SSE_STREAMS -= 1
+
+
+@admin_bp.route("/admin/hls_progress/<collection_id>/events")
+@admin_required
+def hls_progress_events(collection_id):
+    # Over the cap, EventSource gives up on the 503 and the page polls
+    # /admin/hls_progress instead, leaving the threads to public requests.
+    if not _acquire_sse_stream():
+        response = jsonify({"error": "too many progress streams; poll instead"})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(HLS_SSE_MAX_STREAM_SECONDS)
+        return response
+
+    try:
+        response = _hls_progress_stream(collection_id)
+    except Exception:
+        _release_sse_stream()
+        raise
+    # Runs when the server closes the response, whether or not the
+    # generator was ever started.
+    response.call_on_close(_release_sse_stream)
+    return response
+
+
+def _hls_progress_stream(collection_id):
+    stream_id = hls_event_stream_id()
+    resume_from = _parse_hls_event_id(
+        request.headers.get("Last-Event-ID") or request.args.get("last_event_id"),
+        stream_id,
+    )
+
+    conn = get_db()
+    member_ids = {
+        row["id"] for row in conn.execute("SELECT id FROM videos WHERE collection_id = ?", (collection_id,))
+    }
+    conn.close()
+    other_ids = set()
+
+    def in_collection(video_id):
+        # Videos uploaded after the stream opened are looked up once.
+        if video_id in member_ids:
+            return True
+        if video_id in other_ids:
+            return False
+        lookup = get_db()
+        row = lookup.execute("SELECT collection_id FROM videos WHERE id = ?", (video_id,)).fetchone()
+        lookup.close()
+        (member_ids if row and row["collection_id"] == collection_id else other_ids).add(video_id)
+        return video_id in member_ids
+
+    def stream():
+        sequence = resume_from
+        # Last state sent per video, so progress events carry only what changed.
+        sent = {}
+
+        def snapshot():
+            videos = _collection_hls_progress(collection_id)
+            sent.clear()
+            sent.update((item["id"], dict(item)) for item in videos)
+            return _sse_message("snapshot", {"videos": videos}, f"{stream_id}:{sequence}")
+
+        yield f"retry: {HLS_SSE_RETRY_MS}\n\n"
+        if sequence is None:
+            sequence = current_hls_event_sequence()
+            yield snapshot()
+
+        # Streams are recycled so a gthread worker's threads are not pinned
+        # forever; EventSource reconnects and resumes from Last-Event-ID.
+        deadline = time.monotonic() + HLS_SSE_MAX_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            latest, changes = wait_for_hls_changes(sequence, HLS_SSE_HEARTBEAT_SECONDS)
+            if changes is None:
+                sequence = latest
+                yield snapshot()
+                continue
+
+            delivered = False
+            for change_sequence, video_id, state in changes:
+                if not in_collection(video_id):
+                    continue
+                previous = sent.setdefault(video_id, {})
+                delta = {key: value for key, value in state.items() if previous.get(key) != value}
+                if not delta:
+                    continue
+                previous.update(delta)
+                delivered = True
+                yield _sse_message("progress", {"id": video_id, **delta}, f"{stream_id}:{change_sequence}")
+            if not delivered:
+                yield f": heartbeat\nid: {stream_id}:{latest}\n\n"
+            sequence = latest
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,221 @@
+import hashlib
+
+from flask import Blueprint, abort, current_app, jsonify, request, url_for
+
+from db import get_collection_videos_page, get_content_generation, get_db, get_public_collections_page
+from settings import COLLECTION_PAGE_SIZE
+
+# Read-only JSON view of the public catalog. Every response carries an ETag
+# built from a counter that changes whenever the data behind it does: the
+# content generation for the collection tree, the collection's
+# change_counter (kept by triggers, see db.py) for its contents and videos.
+# A poll with a matching If-None-Match costs the lookup that reads the
+# counter and a 304.
+api_bp = Blueprint("api", __name__, url_prefix="/api")
+
+MAX_API_PAGE_SIZE = 500
+
+# Field name -> SQL expression; ?fields=a,b selects a subset. The id is
+# always returned since cursors are ids.
+COLLECTION_FIELDS = {
+    "id": "c.id",
+    "name": "c.name",
+    "slug": "c.slug",
+    "path": "c.path",
+    "parent_id": "c.parent_id",
+    "depth": "c.depth",
+}
+VIDEO_FIELDS = {
+    "id": "id",
+    "title": "COALESCE(display_name, filename)",
+    "filename": "filename",
+    "description": "description",
+    "duration_seconds": "duration_seconds",
+    "sort_order": "sort_order",
+    "collection_id": "collection_id",
+}
+DEFAULT_VIDEO_FIELDS = ("id", "title", "duration_seconds", "sort_order")
+CHILD_COLUMNS = "c.id AS id, c.name AS name, c.slug AS slug, c.path AS path"
+
+
+def _error(status, message):
+    response = jsonify({"error": message})
+    response.status_code = status
+    return response
+
+
+def _projection(fields, default):
+    raw = request.args.get("fields")
+    names = [name.strip() for name in raw.split(",") if name.strip()] if raw else list(default)
+    unknown = [name for name in names if name not in fields]
+    if unknown:
+        abort(_error(400, "unknown fields: " + ", ".join(unknown)))
+    if "id" not in names:
+        names.insert(0, "id")
+    return ", ".join(f"{fields[name]} AS {name}" for name in dict.fromkeys(names))
+
+
+def _page_size():
+    try:
+        return min(MAX_API_PAGE_SIZE, max(1, int(request.args.get("limit") or COLLECTION_PAGE_SIZE)))
+    except ValueError:
+        return COLLECTION_PAGE_SIZE
+
+
+def _next_url(rows, has_more):
+    if not has_more:
+        return None
+    args = request.args.to_dict()
+    args["after"] = rows[-1]["id"]
+    args.update(request.view_args or {})
+    return url_for(request.endpoint, **args)
+
+
+def _etag(counter):
+    # The query string is part of the tag: each projection and page of the
+    # same collection is a different representation.
+    key = f"{counter}|{request.full_path}".encode()
+    return hashlib.blake2b(key, digest_size=12).hexdigest()
+
+
+def _not_modified(etag):
+    if not request.if_none_match.contains(etag):
+        return None
+    response = current_app.response_class(status=304)
+    return _finish(response, etag)
+
+
+def _finish(response, etag):
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _begin_read(conn):
+    # One read transaction, so the counter in the ETag describes exactly the
+    # rows that follow even if an admin commits in between.
+    conn.execute("BEGIN")
+
+
+@api_bp.route("/collections")
+def collections_index():
+    columns = _projection(COLLECTION_FIELDS, COLLECTION_FIELDS)
+    limit = _page_size()
+
+    conn = get_db()
+    try:
+        _begin_read(conn)
+        etag = _etag(f"g{get_content_generation(conn)}")
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+
+        rows, has_more = get_public_collections_page(conn, columns, limit, after_id=request.args.get("after"))
+    finally:
+        conn.close()
+
+    response = jsonify(
+        {
+            "collections": [dict(row) for row in rows],
+            "next": _next_url(rows, has_more),
+        }
+    )
+    return _finish(response, etag)
+
+
+@api_bp.route("/collections/<collection_id>")
+def collection_detail(collection_id):
+    columns = _projection(VIDEO_FIELDS, DEFAULT_VIDEO_FIELDS)
+    limit = _page_size()
+    after_id = request.args.get("after") or None
+
+    conn = get_db()
+    try:
+        _begin_read(conn)
+        collection = conn.execute(
+            "SELECT id, name, slug, path, parent_id, visibility, change_counter FROM collections WHERE id = ?",
+            (collection_id,),
+        ).fetchone()
+        if collection is None:
+            return _error(404, "collection not found")
+        if collection["visibility"] == "private":
+            return _error(403, "collection is private")
+
+        etag = _etag(f"c{collection['change_counter']}")
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+
+        children = conn.execute(
+            f"""
+            SELECT {CHILD_COLUMNS} FROM collections c
+            WHERE c.parent_id = ? AND c.visibility = 'public'
+            ORDER BY c.tree_sort_key
+            """,
+            (collection_id,),
+        ).fetchall()
+        videos, has_more = get_collection_videos_page(
+            conn,
+            collection_id,
+            columns,
+            limit,
+            after_id=after_id,
+            public_only=True,
+        )
+        if videos is None:
+            return _error(400, "after is not a video in this collection")
+    finally:
+        conn.close()
+
+    response = jsonify(
+        {
+            "collection": {
+                "id": collection["id"],
+                "name": collection["name"],
+                "slug": collection["slug"],
+                "path": collection["path"],
+                "parent_id": collection["parent_id"],
+            },
+            "children": [dict(row) for row in children],
+            "videos": [dict(row) for row in videos],
+            "next": _next_url(videos, has_more),
+        }
+    )
+    return _finish(response, etag)
+
+
+@api_bp.route("/videos/<video_id>")
+def video_detail(video_id):
+    columns = _projection(VIDEO_FIELDS, VIDEO_FIELDS)
+
+    conn = get_db()
+    try:
+        _begin_read(conn)
+        state = conn.execute(
+            """
+            SELECT v.visibility, c.change_counter
+            FROM videos v
+            LEFT JOIN collections c ON c.id = v.collection_id
+            WHERE v.id = ?
+            """,
+            (video_id,),
+        ).fetchone()
+        if state is None:
+            return _error(404, "video not found")
+        if state["visibility"] == "private":
+            return _error(403, "video is private")
+
+        # Videos outside any collection have no counter of their own.
+        if state["change_counter"] is None:
+            etag = _etag(f"g{get_content_generation(conn)}")
+        else:
+            etag = _etag(f"c{state['change_counter']}")
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+
+        video = conn.execute(f"SELECT {columns} FROM videos WHERE id = ?", (video_id,)).fetchone()
+    finally:
+        conn.close()
+
+    return _finish(jsonify({"video": dict(video)}), etag)
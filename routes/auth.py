@@ -1,7 +1,7 @@
 from flask import Blueprint, redirect, render_template, request, session, url_for
 from werkzeug.security import check_password_hash
 
-from settings import ADMIN_PASSWORD_HASH, ADMIN_USERNAME
+from settings import ADMIN_USERNAME, get_admin_password_hash
 
 auth_bp = Blueprint("auth", __name__)
 
@@ -11,7 +11,7 @@ def login():
     if request.method == "POST":
         username = request.form["username"]
         password = request.form["password"]
-        if username == ADMIN_USERNAME and check_password_hash(ADMIN_PASSWORD_HASH, password):
+        if username == ADMIN_USERNAME and check_password_hash(get_admin_password_hash(), password):
             session["admin_logged_in"] = True
             return redirect(url_for("admin.admin_panel"))
     return render_template("login.html")
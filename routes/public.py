@@ -1,30 +1,46 @@
+import math
 import os
 
 from flask import Blueprint, abort, jsonify, redirect, render_template, request, send_from_directory, session
-
-from analytics import record_page_visit, record_video_view, record_video_watch
-from db import get_collection_parent_options, get_db
-from settings import HLS_FOLDER
+from markupsafe import Markup, escape
+
+import metrics
+import rate_limit
+from analytics import is_known_video, record_page_visit, record_video_view, record_video_watch
+from db import (
+    get_collection_ancestors,
+    get_collection_by_path,
+    get_collection_parent_options,
+    get_collection_videos_page,
+    get_db,
+    search_videos,
+)
+from page_cache import cached_page
+from settings import (
+    ANALYTICS_RATE_LIMIT_BURST,
+    ANALYTICS_RATE_LIMIT_PER_MINUTE,
+    COLLECTION_PAGE_SIZE,
+    HLS_FOLDER,
+    SEARCH_MAX_CANDIDATES,
+    SEARCH_PAGE_SIZE,
+)
 
 public_bp = Blueprint("public", __name__)
 
+MAX_ANALYTICS_BATCH_EVENTS = 500
+MAX_ANALYTICS_BODY_BYTES = 128 * 1024
 
-def get_descendant_ids(conn, root_id):
-    rows = conn.execute("SELECT id, parent_id FROM collections").fetchall()
-    by_parent = {}
-    for row in rows:
-        by_parent.setdefault(row["parent_id"], []).append(row["id"])
-
-    descendants = set()
-    stack = [root_id]
-    while stack:
-        current = stack.pop()
-        for child_id in by_parent.get(current, []):
-            if child_id not in descendants:
-                descendants.add(child_id)
-                stack.append(child_id)
-
-    return descendants
+# Playlist rows only need a short description for the "Now Playing" swap; the
+# selected video is fetched separately with its full description.
+PUBLIC_PLAYLIST_COLUMNS = (
+    "id, filename, display_name, substr(description, 1, 280) AS description, "
+    "duration_seconds, sort_order"
+)
+PUBLIC_SELECTED_COLUMNS = "id, filename, display_name, description, duration_seconds, sort_order"
+ADMIN_PLAYLIST_COLUMNS = (
+    "id, filename, display_name, description, duration_seconds, sort_order, visibility, "
+    "hls_status, hls_progress_pct, hls_step, hls_segments_generated, hls_segments_expected"
+)
 
 
 @public_bp.route("/")
@@ -37,27 +53,130 @@ def robots_txt():
     return "User-agent: *\nDisallow: /\n", 200, {"Content-Type": "text/plain; charset=utf-8"}
 
 
+def _highlight_excerpt(excerpt):
+    # search_videos marks matches with \x02/\x03 so the text can be escaped first.
+    escaped = str(escape(excerpt or ""))
+    return Markup(escaped.replace("\x02", "<mark>").replace("\x03", "</mark>"))
+
+
+@public_bp.route("/search")
+def search():
+    query = (request.args.get("q") or "").strip()
+    try:
+        page = max(1, int(request.args.get("page") or 1))
+    except ValueError:
+        page = 1
+    # search_videos ranks at most SEARCH_MAX_CANDIDATES matches.
+    page = min(page, math.ceil(SEARCH_MAX_CANDIDATES / SEARCH_PAGE_SIZE))
+
+    results = []
+    has_more = False
+    if query:
+        conn = get_db()
+        rows, has_more = search_videos(
+            conn,
+            query,
+            SEARCH_PAGE_SIZE,
+            offset=(page - 1) * SEARCH_PAGE_SIZE,
+            include_hidden=bool(session.get("admin_logged_in")),
+        )
+        conn.close()
+
+        for row in rows:
+            if row["collection_path"] is None:
+                url = f"/video/{row['id']}"
+            else:
+                url = f"/{row['collection_path']}?v={row['id']}"
+            results.append(
+                {
+                    "id": row["id"],
+                    "title": row["title"],
+                    "excerpt": _highlight_excerpt(row["excerpt"]),
+                    "duration_seconds": row["duration_seconds"],
+                    "collection_name": row["collection_name"],
+                    "url": url,
+                }
+            )
+
+    return render_template(
+        "search.html",
+        query=query,
+        results=results,
+        page=page,
+        has_more=has_more,
+    )
+
+
+def _viewer_key(payload):
+    # The client sends a random per-browser id; without one, fall back to
+    # address + user agent, which undercounts viewers behind shared NAT.
+    viewer = payload.get("viewer") if isinstance(payload, dict) else None
+    if isinstance(viewer, str) and 0 < len(viewer) <= 64:
+        return "c:" + viewer
+    return "a:{}|{}".format(request.remote_addr or "", request.headers.get("User-Agent", ""))
+
+
+def _analytics_rejection(cost):
+    """Return an error response if this analytics request must be refused.
+
+    Checked before anything is buffered; the body-size check runs before the
+    JSON is parsed so oversized floods cost almost nothing.
+    """
+    if request.content_length is not None and request.content_length > MAX_ANALYTICS_BODY_BYTES:
+        return jsonify({"error": "analytics payload too large"}), 413
+
+    retry_after = rate_limit.consume(
+        request.remote_addr or "",
+        cost,
+        ANALYTICS_RATE_LIMIT_PER_MINUTE / 60.0,
+        ANALYTICS_RATE_LIMIT_BURST,
+    )
+    if retry_after:
+        response = jsonify({"error": "rate limited"})
+        response.status_code = 429
+        if retry_after != float("inf"):
+            response.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+        return response
+    return None
+
+
 @public_bp.route("/analytics/page_visit", methods=["POST"])
 def analytics_page_visit():
+    rejection = _analytics_rejection(1)
+    if rejection:
+        return rejection
+
     payload = request.get_json(silent=True) or {}
     path = payload.get("path") or request.path
-    record_page_visit(path)
+    if not isinstance(path, str):
+        return jsonify({"error": "path must be a string"}), 400
+    record_page_visit(path, _viewer_key(payload))
     return ("", 204)
 
 
 @public_bp.route("/analytics/video_view", methods=["POST"])
 def analytics_video_view():
+    rejection = _analytics_rejection(1)
+    if rejection:
+        return rejection
+
     payload = request.get_json(silent=True) or {}
     video_id = payload.get("video_id")
     if not video_id:
         return jsonify({"error": "video_id required"}), 400
+    if not is_known_video(video_id):
+        return jsonify({"error": "unknown video_id"}), 404
 
-    record_video_view(video_id)
+    record_video_view(video_id, _viewer_key(payload))
     return ("", 204)
 
 
 @public_bp.route("/analytics/video_watch", methods=["POST"])
 def analytics_video_watch():
+    rejection = _analytics_rejection(1)
+    if rejection:
+        return rejection
+
     payload = request.get_json(silent=True) or {}
     video_id = payload.get("video_id")
     current_time = payload.get("current_time")
@@ -65,12 +184,72 @@ def analytics_video_watch():
 
     if not video_id:
         return jsonify({"error": "video_id required"}), 400
+    if not is_known_video(video_id):
+        return jsonify({"error": "unknown video_id"}), 404
 
     record_video_watch(video_id, current_time, delta_seconds)
     return ("", 204)
 
 
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _valid_batch_event(event):
+    """Whether a batch event is well-formed enough to record without raising."""
+    if not isinstance(event, dict):
+        return False
+
+    event_type = event.get("type")
+    if event_type == "page_visit":
+        return isinstance(event.get("path"), str)
+    if event_type == "video_view":
+        return isinstance(event.get("video_id"), str)
+    if event_type == "video_watch":
+        return (
+            isinstance(event.get("video_id"), str)
+            and _is_number(event.get("current_time"))
+            and _is_number(event.get("delta_seconds"))
+        )
+    return False
+
+
+@public_bp.route("/analytics/batch", methods=["POST"])
+def analytics_batch():
+    if request.content_length is not None and request.content_length > MAX_ANALYTICS_BODY_BYTES:
+        return jsonify({"error": "analytics payload too large"}), 413
+
+    payload = request.get_json(silent=True)
+    events = payload.get("events") if isinstance(payload, dict) else payload
+    if not isinstance(events, list):
+        return jsonify({"error": "events array required"}), 400
+    if len(events) > MAX_ANALYTICS_BATCH_EVENTS:
+        return jsonify({"error": f"at most {MAX_ANALYTICS_BATCH_EVENTS} events per batch"}), 413
+
+    # Malformed events are dropped before anything is recorded or charged to
+    # the rate limit, so a bad field cannot fail the request half way through
+    # and leave the client's retry to count the first half twice.
+    events = [event for event in events if _valid_batch_event(event)]
+
+    rejection = _analytics_rejection(max(1, len(events)))
+    if rejection:
+        return rejection
+
+    viewer_key = _viewer_key(payload)
+    for event in events:
+        event_type = event["type"]
+        if event_type == "page_visit":
+            record_page_visit(event["path"] or "/", viewer_key)
+        elif event_type == "video_view" and is_known_video(event.get("video_id")):
+            record_video_view(event["video_id"], viewer_key)
+        elif event_type == "video_watch" and is_known_video(event.get("video_id")):
+            record_video_watch(event["video_id"], event["current_time"], event["delta_seconds"])
+
+    return ("", 204)
+
+
 @public_bp.route("/video/<video_id>")
+@cached_page
 def video_page(video_id):
     conn = get_db()
     video = conn.execute(
@@ -98,68 +277,81 @@ def collection_video(collection_path, video_id):
 
 
 @public_bp.route("/<path:collection_path>")
+@cached_page
 def collection_page(collection_path):
-    slugs = collection_path.strip("/").split("/")
-    parent_id = None
     conn = get_db()
-    collection = None
-    path_parts = []
-    breadcrumbs = [{"name": "Home", "url": "/"}]
+    collection = get_collection_by_path(conn, collection_path)
+    if collection is None:
+        conn.close()
+        abort(404)
 
-    for slug in slugs:
-        collection = conn.execute(
-            "SELECT * FROM collections WHERE slug = ? AND parent_id IS ?",
-            (slug, parent_id),
-        ).fetchone()
-        if not collection:
-            conn.close()
-            abort(404)
-        parent_id = collection["id"]
-        path_parts.append(collection["slug"])
+    breadcrumbs = [{"name": "Home", "url": "/"}]
+    for ancestor in get_collection_ancestors(conn, collection["id"]):
         breadcrumbs.append(
             {
-                "name": collection["name"],
-                "url": "/" + "/".join(path_parts),
+                "name": ancestor["name"],
+                "url": "/" + ancestor["path"],
             }
         )
 
-    if collection is None:
-        conn.close()
-        abort(404)
-
     if collection["visibility"] == "private" and not session.get("admin_logged_in"):
         conn.close()
         abort(403)
 
-    if session.get("admin_logged_in"):
+    is_admin = bool(session.get("admin_logged_in"))
+    after_id = request.args.get("after") or None
+    try:
+        position_offset = max(0, int(request.args.get("start") or 0)) if after_id else 0
+    except ValueError:
+        position_offset = 0
+
+    if is_admin:
         sub_collections = conn.execute(
-            "SELECT * FROM collections WHERE parent_id = ?", (collection["id"],)
-        ).fetchall()
-        videos = conn.execute(
-            "SELECT * FROM videos WHERE collection_id = ? ORDER BY sort_order ASC, filename COLLATE NOCASE ASC",
-            (collection["id"],),
+            "SELECT id, name, slug FROM collections WHERE parent_id = ?", (collection["id"],)
         ).fetchall()
-        descendants = get_descendant_ids(conn, collection["id"])
-        parent_options = [
-            option for option in get_collection_parent_options(conn)
-            if option["id"] != collection["id"] and option["id"] not in descendants
-        ]
+        playlist_columns = ADMIN_PLAYLIST_COLUMNS
+        selected_columns = ADMIN_PLAYLIST_COLUMNS
+        parent_options = get_collection_parent_options(conn, exclude_subtree_of=collection["id"])
     else:
         sub_collections = conn.execute(
-            "SELECT * FROM collections WHERE parent_id = ? AND visibility = 'public'", (collection["id"],)
-        ).fetchall()
-        videos = conn.execute(
-            "SELECT * FROM videos WHERE collection_id = ? AND visibility = 'public' ORDER BY sort_order ASC, filename COLLATE NOCASE ASC",
-            (collection["id"],),
+            "SELECT id, name, slug FROM collections WHERE parent_id = ? AND visibility = 'public'", (collection["id"],)
         ).fetchall()
+        playlist_columns = PUBLIC_PLAYLIST_COLUMNS
+        selected_columns = PUBLIC_SELECTED_COLUMNS
         parent_options = []
 
+    videos, has_more = get_collection_videos_page(
+        conn,
+        collection["id"],
+        playlist_columns,
+        COLLECTION_PAGE_SIZE,
+        after_id=after_id,
+        public_only=not is_admin,
+    )
+    if videos is None:
+        # A stale ?after= has no position; start= would only mislabel page 1.
+        conn.close()
+        return redirect(request.path)
+
     selected_video_id = request.args.get("v")
     selected_video = None
     if selected_video_id:
-        selected_video = next((video for video in videos if video["id"] == selected_video_id), None)
+        visibility_clause = "" if is_admin else " AND visibility = 'public'"
+        selected_video = conn.execute(
+            f"SELECT {selected_columns} FROM videos WHERE id = ? AND collection_id = ?{visibility_clause}",
+            (selected_video_id, collection["id"]),
+        ).fetchone()
     if selected_video is None and videos:
         selected_video = videos[0]
+        if not is_admin:
+            selected_video = conn.execute(
+                f"SELECT {selected_columns} FROM videos WHERE id = ?",
+                (selected_video["id"],),
+            ).fetchone()
+
+    next_page_url = None
+    if has_more:
+        next_page_url = f"{request.path}?after={videos[-1]['id']}&start={position_offset + len(videos)}"
 
     if breadcrumbs:
         breadcrumbs[-1]["url"] = None
@@ -172,6 +364,9 @@ def collection_page(collection_path):
         sub_collections=sub_collections,
         videos=videos,
         selected_video=selected_video,
+        position_offset=position_offset,
+        next_page_url=next_page_url,
+        first_page_url=request.path if after_id else None,
         breadcrumbs=breadcrumbs,
         parent_options=parent_options,
     )
@@ -181,5 +376,10 @@ def collection_page(collection_path):
 def serve_hls(video_id, filename):
     directory = os.path.join(HLS_FOLDER, video_id)
     if not os.path.exists(os.path.join(directory, filename)):
+        metrics.HLS_SERVED_REQUESTS.labels("404").inc()
         abort(404)
-    return send_from_directory(directory, filename)
+    response = send_from_directory(directory, filename)
+    metrics.HLS_SERVED_REQUESTS.labels(str(response.status_code)).inc()
+    if response.content_length:
+        metrics.HLS_SERVED_BYTES.inc(response.content_length)
+    return response
@@ -1,8 +1,6 @@
 import os
 from datetime import timedelta
 
-from werkzeug.security import generate_password_hash
-
 STORAGE_ROOT = os.getenv("STORAGE_ROOT", "storage")
 UPLOAD_FOLDER = os.path.join(STORAGE_ROOT, "media")
 HLS_FOLDER = os.path.join(STORAGE_ROOT, "hls")
@@ -10,13 +8,12 @@ DATABASE = os.getenv("DATABASE_PATH", os.path.join(STORAGE_ROOT, "database.db"))
 SECRET_KEY = os.getenv("SECRET_KEY", "CHANGE_THIS_SECRET")
 APP_ENV = os.getenv("APP_ENV", "development").lower()
 IS_PRODUCTION = APP_ENV == "production"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
 
 _plain_admin_password = os.getenv("ADMIN_PASSWORD", "change_this_password")
-ADMIN_PASSWORD_HASH = os.getenv("ADMIN_PASSWORD_HASH")
-if not ADMIN_PASSWORD_HASH:
-    ADMIN_PASSWORD_HASH = generate_password_hash(_plain_admin_password)
+_admin_password_hash = os.getenv("ADMIN_PASSWORD_HASH")
 
 SESSION_COOKIE_SECURE = os.getenv("SESSION_COOKIE_SECURE", "true" if IS_PRODUCTION else "false").lower() == "true"
 SESSION_COOKIE_HTTPONLY = True
@@ -26,8 +23,35 @@ PERMANENT_SESSION_LIFETIME = timedelta(days=int(os.getenv("SESSION_LIFETIME_DAYS
 TRUST_PROXY = os.getenv("TRUST_PROXY", "true" if IS_PRODUCTION else "false").lower() == "true"
 MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "2048"))
 MAX_CONTENT_LENGTH = MAX_UPLOAD_MB * 1024 * 1024
+COLLECTION_PAGE_SIZE = max(1, int(os.getenv("COLLECTION_PAGE_SIZE", "100")))
+SEARCH_PAGE_SIZE = max(1, int(os.getenv("SEARCH_PAGE_SIZE", "20")))
+SEARCH_MAX_CANDIDATES = max(1, int(os.getenv("SEARCH_MAX_CANDIDATES", "1000")))
 STARTUP_HLS_RETRY_ENABLED = os.getenv("STARTUP_HLS_RETRY_ENABLED", "true").lower() == "true"
 STARTUP_HLS_RETRY_LIMIT = int(os.getenv("STARTUP_HLS_RETRY_LIMIT", "50"))
+STARTUP_BACKFILL_WORKERS = max(1, int(os.getenv("STARTUP_BACKFILL_WORKERS", "8")))
+ANALYTICS_COLLECTOR_ENABLED = os.getenv("ANALYTICS_COLLECTOR_ENABLED", "true").lower() == "true"
+ANALYTICS_SOCKET_PATH = os.getenv("ANALYTICS_SOCKET_PATH", os.path.join(STORAGE_ROOT, "analytics.sock"))
+ANALYTICS_HANDOFF_SECONDS = float(os.getenv("ANALYTICS_HANDOFF_SECONDS", "1"))
+ANALYTICS_LOG_ENABLED = os.getenv("ANALYTICS_LOG_ENABLED", "true").lower() == "true"
+ANALYTICS_LOG_DIR = os.getenv("ANALYTICS_LOG_DIR", os.path.join(STORAGE_ROOT, "analytics-log"))
+ANALYTICS_LOG_FSYNC_SECONDS = float(os.getenv("ANALYTICS_LOG_FSYNC_SECONDS", "0.2"))
+ANALYTICS_HOURLY_RETENTION_DAYS = max(1, int(os.getenv("ANALYTICS_HOURLY_RETENTION_DAYS", "14")))
+ANALYTICS_DAILY_RETENTION_DAYS = max(0, int(os.getenv("ANALYTICS_DAILY_RETENTION_DAYS", "730")))
+ANALYTICS_RATE_LIMIT_PER_MINUTE = max(1, int(os.getenv("ANALYTICS_RATE_LIMIT_PER_MINUTE", "600")))
+ANALYTICS_RATE_LIMIT_BURST = max(1, int(os.getenv("ANALYTICS_RATE_LIMIT_BURST", "600")))
+ANALYTICS_MAX_BUFFER_KEYS = max(1, int(os.getenv("ANALYTICS_MAX_BUFFER_KEYS", "20000")))
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", os.path.join(STORAGE_ROOT, "prometheus"))
+PAGE_CACHE_MAX_BYTES = max(0, int(os.getenv("PAGE_CACHE_MAX_MB", "64"))) * 1024 * 1024
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+SLOW_REQUEST_MS = max(0.0, float(os.getenv("SLOW_REQUEST_MS", "500")))
+SLOW_REQUEST_LOG = os.getenv("SLOW_REQUEST_LOG", os.path.join(STORAGE_ROOT, "slow_requests.log"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(STORAGE_ROOT, "profiles"))
+HLS_SSE_MAX_STREAMS = max(0, int(os.getenv("HLS_SSE_MAX_STREAMS", "1")))
+HLS_SSE_MAX_STREAM_SECONDS = max(5, int(os.getenv("HLS_SSE_MAX_STREAM_SECONDS", "60")))
+STATIC_EXPORT_DIR = os.getenv("STATIC_EXPORT_DIR", os.path.join(STORAGE_ROOT, "static-export"))
+STATIC_EXPORT_UPSTREAM = os.getenv("STATIC_EXPORT_UPSTREAM", "127.0.0.1:5000")
 _hls_max_streams_raw = os.getenv("HLS_MAX_CONCURRENT_STREAMS", "2")
 try:
     HLS_MAX_CONCURRENT_STREAMS = max(1, int(_hls_max_streams_raw))
@@ -35,6 +59,28 @@ except ValueError:
     HLS_MAX_CONCURRENT_STREAMS = 2
 
 
+def get_admin_password_hash():
+    """Hash to check admin logins against.
+
+    Hashing a plain ADMIN_PASSWORD is a deliberately slow KDF, so it happens on
+    first use instead of in every process that imports settings.
+    """
+    global _admin_password_hash
+
+    if not _admin_password_hash:
+        from werkzeug.security import generate_password_hash
+
+        _admin_password_hash = generate_password_hash(_plain_admin_password)
+    return _admin_password_hash
+
+
+def __getattr__(name):
+    # settings.ADMIN_PASSWORD_HASH keeps working, evaluated lazily.
+    if name == "ADMIN_PASSWORD_HASH":
+        return get_admin_password_hash()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def validate_runtime_settings():
     if not IS_PRODUCTION:
         return
@@ -55,3 +101,4 @@ def ensure_storage_dirs():
     os.makedirs(STORAGE_ROOT, exist_ok=True)
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     os.makedirs(HLS_FOLDER, exist_ok=True)
+    os.makedirs(ANALYTICS_LOG_DIR, exist_ok=True)
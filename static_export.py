@@ -0,0 +1,395 @@
+import argparse
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import suppress
+
+from db import get_collection_ancestors, get_collection_videos_page, get_db, get_public_collections_page
+from hls_utils import hls_state_fingerprint, inspect_hls_state
+from settings import (
+    COLLECTION_PAGE_SIZE,
+    HLS_FOLDER,
+    MAX_UPLOAD_MB,
+    STATIC_EXPORT_DIR,
+    STATIC_EXPORT_UPSTREAM,
+    UPLOAD_FOLDER,
+)
+
+logger = logging.getLogger(__name__)
+
+# Layout under the output directory:
+#   site/                      nginx document root
+#     index.html, robots.txt
+#     <collection path>/index.html          first page of the playlist
+#     <collection path>/page-<start>.html   ?after=...&start=<start>
+#     video/<id>/index.html
+#     hls/<id>/...                          hardlinks into HLS_FOLDER
+#   nginx.conf
+#   export-state.json          what the last run wrote, for incremental runs
+#
+# A collection's ?v=<id> links are all answered with its first page. The
+# page's script selects the video from its playlist, or, for a video further
+# down, looks it up through /api/videos/<id>, which the app serves. That
+# lookup is one extra request, and the playlist still shows page 1.
+SITE_DIRNAME = "site"
+STATE_FILENAME = "export-state.json"
+NGINX_FILENAME = "nginx.conf"
+STATE_FORMAT = 1
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+COLLECTION_BATCH = 1000
+
+NGINX_TEMPLATE = """\
+# Written by static_export.py; include inside the http {{}} block.
+# Anonymous page views and finished HLS trees are served from {site};
+# anything not exported (search, analytics, admin, private or new content)
+# falls through to the app.
+
+# Logged-in sessions always reach the app: they see admin controls.
+map $cookie_session $videoshare_static_root {{
+    ""      {site};
+    default {site}/.dynamic;
+}}
+
+map $arg_start $videoshare_static_start {{
+    "~^[0-9]{{1,9}}$" $arg_start;
+    default         invalid;
+}}
+
+# ?after=...&start=N is playlist page N; any other query (?v=) gets the
+# first page, which selects the requested video client-side (fetching it
+# from /api/videos/<id> when it is not on that page).
+map $arg_after $videoshare_static_page {{
+    ""      /index.html;
+    default /page-$videoshare_static_start.html;
+}}
+
+upstream videoshare_app {{
+    server {upstream};
+}}
+
+server {{
+    listen {listen};
+    server_name {server_name};
+    client_max_body_size {max_upload_mb}m;
+
+    location / {{
+        root $videoshare_static_root;
+        try_files $uri$videoshare_static_page $uri @app;
+        add_header Cache-Control "no-cache";
+    }}
+
+    location /hls/ {{
+        root {site};
+        types {{
+            application/vnd.apple.mpegurl m3u8;
+            video/mp2t ts;
+        }}
+        try_files $uri @app;
+    }}
+
+    location @app {{
+        proxy_pass http://videoshare_app;
+        proxy_set_header Host $host;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+        proxy_set_header X-Forwarded-Host $host;
+        # Uploads stream through; HLS progress uses server-sent events.
+        proxy_request_buffering off;
+        proxy_buffering off;
+        proxy_read_timeout 300s;
+    }}
+}}
+"""
+
+
+def _export_format():
+    """Changes whenever every page must be re-rendered: templates, page size."""
+    digest = hashlib.blake2b(f"{STATE_FORMAT}|{COLLECTION_PAGE_SIZE}".encode(), digest_size=16)
+    for name in sorted(os.listdir(TEMPLATES_DIR)):
+        with open(os.path.join(TEMPLATES_DIR, name), "rb") as handle:
+            digest.update(name.encode() + b"\0" + handle.read())
+    return digest.hexdigest()
+
+
+def _load_state(output_dir, export_format):
+    try:
+        with open(os.path.join(output_dir, STATE_FILENAME), encoding="utf-8") as handle:
+            state = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    if state.get("format") != export_format:
+        return None
+    return state
+
+
+def _write_file(path, data):
+    # Write next to the target and rename, so nginx never serves half a page.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as handle:
+        handle.write(data)
+    os.replace(temp_path, path)
+
+
+def _remove_file(site_dir, relative_path):
+    path = os.path.join(site_dir, relative_path)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return
+    directory = os.path.dirname(path)
+    while directory != site_dir:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+        directory = os.path.dirname(directory)
+
+
+def _render(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        logger.warning("static export skipped %s: HTTP %d", url, response.status_code)
+        return None
+    return response.get_data()
+
+
+def _export_page(client, site_dir, url, relative_path):
+    body = _render(client, url)
+    if body is None:
+        return False
+    _write_file(os.path.join(site_dir, relative_path), body)
+    return True
+
+
+def _collection_signature(conn, collection):
+    # change_counter covers the collection, its children and its videos;
+    # breadcrumbs add the ancestors' names, which it does not.
+    names = [row["name"] for row in get_collection_ancestors(conn, collection["id"])]
+    return [collection["change_counter"], names]
+
+
+def _collection_pages(conn, collection_id):
+    """(url query, file name) for every page of the public playlist."""
+    pages = [("", "index.html")]
+    after_id = None
+    start = 0
+    while True:
+        rows, has_more = get_collection_videos_page(
+            conn, collection_id, "id", COLLECTION_PAGE_SIZE, after_id=after_id, public_only=True
+        )
+        if not has_more:
+            return pages
+        after_id = rows[-1]["id"]
+        start += len(rows)
+        pages.append((f"?after={after_id}&start={start}", f"page-{start}.html"))
+
+
+def _export_collection(client, conn, site_dir, collection):
+    base = collection["path"]
+    files = []
+    for query, filename in _collection_pages(conn, collection["id"]):
+        relative_path = os.path.join(base, filename)
+        if _export_page(client, site_dir, f"/{base}{query}", relative_path):
+            files.append(relative_path)
+
+    videos = {}
+    rows = conn.execute(
+        "SELECT id, filename FROM videos WHERE collection_id = ? AND visibility <> 'private'",
+        (collection["id"],),
+    ).fetchall()
+    for row in rows:
+        relative_path = os.path.join("video", row["id"], "index.html")
+        if _export_page(client, site_dir, f"/video/{row['id']}", relative_path):
+            files.append(relative_path)
+            videos[row["id"]] = row["filename"]
+    return files, videos
+
+
+def _link_or_copy(source, target, copy):
+    temp_path = f"{target}.tmp"
+    with suppress(FileNotFoundError):
+        os.remove(temp_path)
+    if not copy:
+        try:
+            os.link(source, temp_path)
+            os.replace(temp_path, target)
+            return
+        except OSError as exc:
+            if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+    shutil.copy2(source, temp_path)
+    os.replace(temp_path, target)
+
+
+def _sync_hls_tree(site_dir, video_id, copy):
+    source_dir = os.path.join(HLS_FOLDER, video_id)
+    target_dir = os.path.join(site_dir, "hls", video_id)
+    os.makedirs(target_dir, exist_ok=True)
+
+    names = sorted(os.listdir(source_dir))
+    # The playlist goes last, so it never lists a segment not yet in place.
+    names.sort(key=lambda name: name == "playlist.m3u8")
+    for name in names:
+        source = os.path.join(source_dir, name)
+        target = os.path.join(target_dir, name)
+        if not os.path.isfile(source):
+            continue
+        try:
+            source_stat = os.stat(source)
+            target_stat = os.stat(target)
+        except FileNotFoundError:
+            pass
+        else:
+            if (source_stat.st_dev, source_stat.st_ino) == (target_stat.st_dev, target_stat.st_ino):
+                continue
+            if copy and (source_stat.st_size, source_stat.st_mtime_ns) == (target_stat.st_size, target_stat.st_mtime_ns):
+                continue
+        _link_or_copy(source, target, copy)
+
+    for name in set(os.listdir(target_dir)) - set(names):
+        os.remove(os.path.join(target_dir, name))
+
+
+def _remove_hls_tree(site_dir, video_id):
+    shutil.rmtree(os.path.join(site_dir, "hls", video_id), ignore_errors=True)
+
+
+def write_nginx_config(output_dir, listen="80", server_name="_", upstream=STATIC_EXPORT_UPSTREAM):
+    site_dir = os.path.abspath(os.path.join(output_dir, SITE_DIRNAME))
+    config = NGINX_TEMPLATE.format(
+        site=site_dir,
+        upstream=upstream,
+        listen=listen,
+        server_name=server_name,
+        max_upload_mb=MAX_UPLOAD_MB,
+    )
+    path = os.path.join(output_dir, NGINX_FILENAME)
+    _write_file(path, config.encode())
+    return path
+
+
+def export_site(output_dir=STATIC_EXPORT_DIR, full=False, copy_hls=False):
+    """Render the public catalog into ``output_dir``; return a summary.
+
+    Collections whose change_counter and breadcrumbs match the previous run
+    are left alone unless ``full`` is set or the templates changed.
+    """
+    from app import create_app
+
+    started = time.perf_counter()
+    output_dir = os.path.abspath(output_dir)
+    site_dir = os.path.join(output_dir, SITE_DIRNAME)
+    os.makedirs(site_dir, exist_ok=True)
+
+    export_format = _export_format()
+    previous = None if full else _load_state(output_dir, export_format)
+    if previous is None:
+        previous = {"collections": {}, "hls": {}}
+    previous_collections = previous["collections"]
+    previous_hls = previous["hls"]
+
+    client = create_app(start_services=False).test_client()
+    for url, relative_path in (("/", "index.html"), ("/robots.txt", "robots.txt")):
+        _export_page(client, site_dir, url, relative_path)
+
+    collections = {}
+    rendered = 0
+    conn = get_db()
+    try:
+        after_id = None
+        while True:
+            batch, has_more = get_public_collections_page(
+                conn,
+                "c.id AS id, c.path AS path, c.change_counter AS change_counter",
+                COLLECTION_BATCH,
+                after_id=after_id,
+            )
+            for collection in batch:
+                signature = _collection_signature(conn, collection)
+                record = previous_collections.get(collection["id"])
+                if record and record["signature"] == signature and record["path"] == collection["path"]:
+                    collections[collection["id"]] = record
+                    continue
+
+                files, videos = _export_collection(client, conn, site_dir, collection)
+                collections[collection["id"]] = {
+                    "path": collection["path"],
+                    "signature": signature,
+                    "files": files,
+                    "videos": videos,
+                }
+                rendered += 1
+            if not has_more:
+                break
+            after_id = batch[-1]["id"]
+    finally:
+        conn.close()
+
+    # Files the previous run wrote that no current collection claims: pages
+    # at an old path, dropped playlist pages, videos gone private.
+    current_files = {path for record in collections.values() for path in record["files"]}
+    previous_files = {path for record in previous_collections.values() for path in record["files"]}
+    for relative_path in previous_files - current_files:
+        _remove_file(site_dir, relative_path)
+
+    hls = {}
+    exported_videos = {
+        video_id: filename for record in collections.values() for video_id, filename in record["videos"].items()
+    }
+    for video_id, filename in exported_videos.items():
+        fingerprint = hls_state_fingerprint(video_id, os.path.join(UPLOAD_FOLDER, filename))
+        if previous_hls.get(video_id) == fingerprint:
+            hls[video_id] = fingerprint
+            continue
+        if inspect_hls_state(video_id)["status"] == "complete":
+            _sync_hls_tree(site_dir, video_id, copy_hls)
+            hls[video_id] = fingerprint
+        else:
+            # Still encoding: the app serves it until a later export.
+            _remove_hls_tree(site_dir, video_id)
+    for video_id in set(previous_hls) - set(hls):
+        _remove_hls_tree(site_dir, video_id)
+
+    state = {"format": export_format, "collections": collections, "hls": hls}
+    _write_file(os.path.join(output_dir, STATE_FILENAME), json.dumps(state).encode())
+
+    summary = {
+        "collections": len(collections),
+        "collections_rendered": rendered,
+        "videos": len(exported_videos),
+        "hls_trees": len(hls),
+        "elapsed_s": round(time.perf_counter() - started, 2),
+    }
+    logger.info(
+        "static export to %s: %d collections (%d rendered), %d videos, %d HLS trees in %.2f s",
+        output_dir,
+        summary["collections"],
+        summary["collections_rendered"],
+        summary["videos"],
+        summary["hls_trees"],
+        summary["elapsed_s"],
+    )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the public catalog as static HTML for nginx.")
+    parser.add_argument("--output", default=STATIC_EXPORT_DIR)
+    parser.add_argument("--full", action="store_true", help="re-render every collection, not just changed ones")
+    parser.add_argument("--copy-hls", action="store_true", help="copy HLS files instead of hardlinking them")
+    parser.add_argument("--listen", default="80")
+    parser.add_argument("--server-name", default="_")
+    parser.add_argument("--upstream", default=STATIC_EXPORT_UPSTREAM, help="address of the app behind nginx")
+    args = parser.parse_args()
+
+    export_site(args.output, full=args.full, copy_hls=args.copy_hls)
+    write_nginx_config(args.output, listen=args.listen, server_name=args.server_name, upstream=args.upstream)
+
+
+if __name__ == "__main__":
+    main()